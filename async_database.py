@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+""" This file contains the asyncio versions of the functions in database.py, for use inside of the bot's commands.
+
+The functions in database.py block until sqlite has finished, including the fsync on commit, which stalls the whole
+event loop while they run. The functions here take the same arguments, return the same values and raise the same
+DatabaseErrors, but run the queries on worker threads so the event loop stays free to handle other guilds' commands.
+
+Common Uses
+-----------
+Example:
+    definition = await async_database.get_def(path, server, command)
+
+Threads
+-------
+Reads run on a small pool of reader threads, so several guilds can read at once. Anything that may commit runs on a
+single dedicated writer thread, as sqlite only allows one writer at a time anyway, and queueing the writes in the bot
+is cheaper than having them fight over the database lock.
+
+Write Batching
+--------------
+Committed inserts and deletes of definitions don't each get their own transaction. They are queued on a WriteBatcher
+per database, which waits a few milliseconds for other writes to arrive and then commits them together with
+database.run_batch, so a busy bot pays for one fsync per batch rather than one per write. Each caller still gets the
+result of its own operation. Writes that arrive while a batch is committing are held for the next one. The window and
+the largest batch are set with configure_batching.
+
+Todo
+----
+*
+
+"""
+from concurrent.futures import ThreadPoolExecutor  # Used to run the queries off of the event loop
+import asyncio  # Used to await the queries from the event loop
+import functools  # Used to pass keyword arguments to the executors
+import database  # Used to actually run the queries
+import defs_io  # Used to import and export definition files
+
+
+# The number of threads used to run reads
+READER_THREADS = database.DEFAULT_POOL_SIZE
+
+# The default number of seconds a batch waits for more writes before committing
+DEFAULT_BATCH_WINDOW = 0.005
+# The default largest number of writes committed together
+DEFAULT_BATCH_SIZE = 200
+
+# The executor used to run reads
+_readers = ThreadPoolExecutor(max_workers=READER_THREADS, thread_name_prefix='db-reader')
+# The executor used to run writes, with a single thread so writes are serialized
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+
+
+def _run(executor, func, *args, **kwargs):
+    """ Runs the given function on the given executor.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        The executor to run the function on.
+    func : callable
+        The function to be run.
+
+    Returns
+    -------
+    asyncio.Future
+        The future that will hold the result of the function.
+
+    """
+
+    # Schedules the function on the executor from the running loop
+    return asyncio.get_event_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+class WriteBatcher:
+    """ Groups the writes to a database that arrive close together into batches, committing each batch in a single
+    transaction on the writer thread.
+
+    """
+
+    def __init__(self, path, window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_BATCH_SIZE):
+        """ Constructs the WriteBatcher class.
+
+        Parameters
+        ----------
+        path : str
+            The path to the database.
+        window : float
+            The number of seconds to wait for more writes after the first one of a batch arrives.
+        max_batch : int
+            The largest number of writes committed together. A full batch is committed without waiting.
+
+        """
+
+        # Sets the settings of the batcher
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        # The operations waiting to be committed, with the futures of their callers
+        self._pending = []
+        # The timer or task that will commit the pending operations, if one is scheduled
+        self._flush = None
+        # The statistics of the batcher
+        self._stats = {'operations': 0, 'batches': 0, 'largest': 0}
+
+    def submit(self, *operation):
+        """ Queues an operation to be committed with the next batch. See database.run_batch for the operations.
+
+        Returns
+        -------
+        asyncio.Future
+            The future that will hold the result of the operation, or the DatabaseError it failed with.
+
+        """
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((operation, future))
+        # Commits straight away once the batch is full, and otherwise waits for the window to pass
+        if len(self._pending) >= self.max_batch:
+            self._schedule(loop, 0)
+        elif self._flush is None:
+            self._schedule(loop, self.window)
+        return future
+
+    def _schedule(self, loop, delay):
+        """ Schedules the pending operations to be committed after the given delay, unless a commit is running.
+
+        """
+
+        if isinstance(self._flush, asyncio.Future):
+            # The running commit schedules the next batch when it finishes
+            return
+        if self._flush is not None:
+            self._flush.cancel()
+        self._flush = loop.call_later(delay, self._start, loop)
+
+    def _start(self, loop):
+        """ Starts committing the pending operations.
+
+        """
+
+        self._flush = asyncio.ensure_future(self._commit(loop))
+
+    async def _commit(self, loop):
+        """ Commits the pending operations in batches until none are left, giving each caller its result.
+
+        """
+
+        try:
+            while self._pending:
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                operations = [operation for operation, _ in batch]
+                try:
+                    results = await _run(_writer, database.run_batch, self.path, operations)
+                # Fails every operation of the batch if it couldn't be committed
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self._stats['operations'] += len(batch)
+                self._stats['batches'] += 1
+                self._stats['largest'] = max(self._stats['largest'], len(batch))
+                # Gives each caller its own result, raising the error of an operation that failed
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if result is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(result)
+        finally:
+            self._flush = None
+
+    def drain(self):
+        """ Commits the pending operations on the calling thread, without giving the callers their results. Used when
+        shutting down, once the event loop has stopped.
+
+        """
+
+        if self._flush is not None and not isinstance(self._flush, asyncio.Future):
+            self._flush.cancel()
+        self._flush = None
+        pending, self._pending = self._pending, []
+        if pending:
+            database.run_batch(self.path, [operation for operation, _ in pending])
+
+    def stats(self):
+        """ Gets the statistics of the batcher.
+
+        Returns
+        -------
+        dict
+            The number of operations and batches committed, the largest batch, and the average batch size.
+
+        """
+
+        stats = dict(self._stats)
+        stats['pending'] = len(self._pending)
+        stats['average'] = stats['operations'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+# The write batcher of each database, by path
+_batchers = {}
+
+
+def configure_batching(path, window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_BATCH_SIZE):
+    """ Sets how the writes to the given database are batched. A window of 0 still groups the writes that arrive
+    while a batch is committing.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    window : float
+        The number of seconds to wait for more writes after the first one of a batch arrives.
+    max_batch : int
+        The largest number of writes committed together.
+
+    """
+
+    batcher = get_batcher(path)
+    batcher.window = window
+    batcher.max_batch = max_batch
+
+
+def get_batcher(path):
+    """ Gets the write batcher of the given database, creating it with the default settings if needed.
+
+    Returns
+    -------
+    WriteBatcher
+        The write batcher of the database.
+
+    """
+
+    if path not in _batchers:
+        _batchers[path] = WriteBatcher(path)
+    return _batchers[path]
+
+
+async def sql_execute(path, sql, commit=False):
+    """ Executes the given sql without blocking the event loop. See database.sql_execute.
+
+    """
+
+    # Runs on the writer when the sql may change the database, and on a reader otherwise
+    return await _run(_writer if commit else _readers, database.sql_execute, path, sql, commit=commit)
+
+
+async def list_tables(path, commit=False):
+    """ Lists all of the tables in the database without blocking the event loop. See database.list_tables.
+
+    """
+
+    return await _run(_readers, database.list_tables, path, commit=commit)
+
+
+async def ins_def(path, server, command, definition, commit=False):
+    """ Inserts a new definition into the defs table without blocking the event loop. See database.ins_def. Committed
+    inserts are batched with the other writes to the database.
+
+    """
+
+    if commit:
+        return await get_batcher(path).submit('ins_def', server, command, definition)
+    return await _run(_writer, database.ins_def, path, server, command, definition, commit=commit)
+
+
+async def get_def(path, server, command):
+    """ Gets a definition from the defs table without blocking the event loop. See database.get_def.
+
+    """
+
+    return await _run(_readers, database.get_def, path, server, command)
+
+
+async def del_def(path, server, command, commit=False):
+    """ Removes the definition from the defs table without blocking the event loop. See database.del_def. Committed
+    deletes are batched with the other writes to the database.
+
+    """
+
+    if commit:
+        return await get_batcher(path).submit('del_def', server, command)
+    return await _run(_writer, database.del_def, path, server, command, commit=commit)
+
+
+async def search_defs(path, server, query, limit=10, offset=0):
+    """ Searches the definitions of a guild without blocking the event loop. See database.search_defs.
+
+    """
+
+    return await _run(_readers, database.search_defs, path, server, query, limit=limit, offset=offset)
+
+
+async def list_defs(path, server, limit=20, offset=0):
+    """ Lists the commands of a guild's definitions without blocking the event loop. See database.list_defs.
+
+    """
+
+    return await _run(_readers, database.list_defs, path, server, limit=limit, offset=offset)
+
+
+async def suggest_defs(path, server, command, limit=3):
+    """ Finds the commands of a guild closest to one that doesn't exist without blocking the event loop. See
+    database.suggest_defs.
+
+    """
+
+    return await _run(_readers, database.suggest_defs, path, server, command, limit=limit)
+
+
+async def count_defs(path, server):
+    """ Counts the definitions of a guild without blocking the event loop. See database.count_defs.
+
+    """
+
+    return await _run(_readers, database.count_defs, path, server)
+
+
+async def blob_stats(path):
+    """ Measures the space saved by the blob store without blocking the event loop. See database.blob_stats.
+
+    """
+
+    return await _run(_readers, database.blob_stats, path)
+
+
+async def migrate_blobs(path, batch_size=500, pause=0.05, progress=None):
+    """ Moves the definitions stored before the blob store existed into it without blocking the event loop. See
+    database.migrate_blobs. Runs on a thread of its own rather than the writer thread, so the writes of the commands
+    aren't queued behind it, and each of its batches waits for the write lock like any other writer.
+
+    """
+
+    return await _run(None, database.migrate_blobs, path, batch_size=batch_size, pause=pause, progress=progress)
+
+
+async def export_defs(path, server, fp, fmt):
+    """ Writes every definition of a guild to a file without blocking the event loop. See defs_io.export_defs.
+
+    """
+
+    return await _run(_readers, defs_io.export_defs, path, server, fp, fmt)
+
+
+async def import_defs(path, server, fp, fmt, upsert=False, progress=None):
+    """ Inserts every definition of a file into a guild without blocking the event loop. See defs_io.import_defs. Runs
+    on a thread of its own rather than the writer thread, so the writes of the commands aren't queued behind the file
+    being read, and its insert waits for the write lock like any other writer.
+
+    """
+
+    return await _run(None, defs_io.import_defs, path, server, fp, fmt, upsert=upsert, progress=progress)
+
+
+async def ins_group(path, server, name, role, category, channels, members=(), commit=False):
+    """ Inserts a new group into the group registry without blocking the event loop. See database.ins_group.
+
+    """
+
+    return await _run(_writer, database.ins_group, path, server, name, role, category, channels, members=members,
+                      commit=commit)
+
+
+async def del_group(path, server, name, commit=False):
+    """ Removes a group from the group registry without blocking the event loop. See database.del_group.
+
+    """
+
+    return await _run(_writer, database.del_group, path, server, name, commit=commit)
+
+
+async def get_groups(path, server):
+    """ Gets every group of a guild from the group registry without blocking the event loop. See database.get_groups.
+
+    """
+
+    return await _run(_readers, database.get_groups, path, server)
+
+
+async def add_group_members(path, server, role, members, commit=False):
+    """ Adds members to a group of the group registry without blocking the event loop. See
+    database.add_group_members.
+
+    """
+
+    return await _run(_writer, database.add_group_members, path, server, role, members, commit=commit)
+
+
+async def del_group_members(path, server, role, members, commit=False):
+    """ Removes members from groups of the group registry without blocking the event loop. See
+    database.del_group_members.
+
+    """
+
+    return await _run(_writer, database.del_group_members, path, server, role, members, commit=commit)
+
+
+def shutdown():
+    """ Waits for the queued queries to finish and stops the worker threads. Used when shutting down the bot.
+
+    """
+
+    # Lets the writes finish first so nothing is lost, then commits any writes still waiting for a batch
+    _writer.shutdown(wait=True)
+    for batcher in _batchers.values():
+        batcher.drain()
+    _readers.shutdown(wait=True)
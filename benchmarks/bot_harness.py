@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+""" Drives the real cogs against the in-process discord stand-in and the local Wikipedia stand-in, measuring each
+command the way users would run it across many guilds at once.
+
+The commands are run in phases, one command at a time, with every user of every guild running it concurrently. For
+each command the harness records the latency percentiles, how long the event loop was blocked while it ran, and the
+number of database connections and discord requests each run of the command took. The results are written as JSON,
+named after the commit they were measured on, so a later run can be compared against them with --compare.
+
+Usage
+-----
+    python benchmarks/bot_harness.py [--guilds 20] [--users 10] [--concurrency 50] [--api-latency 0.02]
+                                     [--wiki-latency 0.05] [--limits off|discord] [--output results.json]
+                                     [--compare baseline.json]
+
+The harness needs the bot's dependencies, discord.py included, as it imports the real cogs. It uses the bot's
+settings.py if there is one, and example_settings.py otherwise, always with its own temporary databases.
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import asyncio  # Used to run the commands on an event loop
+import importlib  # Used to import the cogs once the settings are in place
+import json  # Used to write and read the results
+import os  # Used to find the repository
+import platform  # Used to record the machine the results were measured on
+import random  # Used to pick the definitions looked up
+import string  # Used to name the groups
+import subprocess  # Used to find the commit the results were measured on
+import sys  # Used to import the modules of the bot
+import tempfile  # Used to hold the databases
+import time  # Used to time the commands
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Uses the example settings when the bot hasn't been set up, so the cogs can be imported
+try:
+    import settings  # noqa: E402
+except ImportError:
+    import example_settings as settings  # noqa: E402
+    sys.modules['settings'] = settings
+
+import async_database  # noqa: E402
+import database  # noqa: E402
+import storage  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+from fake_discord import ApiLog, FakeBot, FakeContext, FakeGuild, FakeMessage  # noqa: E402
+from wiki_fixture import WikiFixture  # noqa: E402
+
+# The cogs driven by the harness, as (module, class name)
+COGS = [('commands.definitions', 'Definitions'), ('commands.groups', 'Groups'), ('commands.wiki', 'Wiki'),
+        ('commands.general', 'General')]
+# The subjects looked up with !wiki, all found in the Wikipedia stand-in's corpus
+SUBJECTS = ['python', 'project', 'discord', 'monty python']
+# The words the definitions are made of, and searched for
+WORDS = ['project', 'deadline', 'sprint', 'design', 'review', 'meeting', 'notes', 'roadmap', 'release', 'docs']
+# How often the heartbeat measuring the blocking of the event loop wakes up, in seconds
+TICK = 0.001
+# The results compared by --compare, as (key, label)
+COMPARED = [('p50', 'p50 ms'), ('p99', 'p99 ms'), ('blocked', 'blocked ms'), ('db', 'db/cmd'), ('api', 'api/cmd')]
+
+
+def commit():
+    """ Gets the short hash of the commit being measured, marked with + when the tree has uncommitted changes.
+
+    """
+
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL)
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                        stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return rev.decode().strip() + ('+' if dirty.strip() else '')
+
+
+def percentile(ordered, p):
+    """ Gets the given percentile of the given sorted values.
+
+    """
+
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def db_checkouts():
+    """ Gets the number of connections checked out of every database pool so far.
+
+    """
+
+    return sum(stats['checkouts'] for stats in database.pool_stats().values())
+
+
+async def heartbeat(delays, stop):
+    """ Wakes up every tick until stopped, recording how late each wake up was in milliseconds.
+
+    """
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        delays.append(max(0.0, (time.perf_counter() - start - TICK) * 1000))
+
+
+class Harness:
+    """ The fake guilds, the bot holding the real cogs, and the runs of the commands against them.
+
+    """
+
+    def __init__(self, guilds, users, api_latency, limits, concurrency, seed=0):
+        """ Constructs the Harness class.
+
+        Parameters
+        ----------
+        guilds : int
+            The number of guilds.
+        users : int
+            The number of users in each guild.
+        api_latency : float
+            The number of seconds each request to the fake discord takes.
+        limits : str
+            'discord' to pace the requests with the scheduler settings of the bot, 'off' to not pace them.
+        concurrency : int
+            The maximum number of commands running at once.
+        seed : int
+            The seed of the random choices of the workload.
+
+        """
+
+        self.api = ApiLog(latency=api_latency)
+        if limits == 'discord':
+            scheduler = Scheduler(routes=settings.scheduler_settings['routes'],
+                                  global_rate=settings.scheduler_settings['global_rate'],
+                                  concurrency=settings.scheduler_settings['concurrency'])
+        else:
+            scheduler = Scheduler(routes={}, default=(10 ** 6, 1), global_rate=(10 ** 6, 1), concurrency=10 ** 6)
+        self.bot = FakeBot(self.api, scheduler)
+        self.guilds = [FakeGuild(self.api, members=users, name='guild{}'.format(g)) for g in range(guilds)]
+        self.concurrency = concurrency
+        self.rng = random.Random(seed)
+        # Adds the real cogs to the fake bot
+        for module, name in COGS:
+            importlib.import_module(module).setup(self.bot)
+        self.results = {}
+
+    def command(self, cog, name):
+        """ Gets the function run by the given command of the given cog, skipping discord's argument parsing and
+        permission checks.
+
+        """
+
+        cog = self.bot.get_cog(cog)
+        return lambda ctx, *args, **kwargs: getattr(type(cog), name).callback(cog, ctx, *args, **kwargs)
+
+    async def run(self, name, invocations):
+        """ Runs every invocation of a command concurrently, recording the measurements of the command.
+
+        Parameters
+        ----------
+        name : str
+            The name of the command.
+        invocations : list
+            Functions returning the awaitable of one run of the command.
+
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+        errors = []
+
+        async def timed(invocation):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await invocation()
+                except Exception as e:
+                    errors.append('{}: {}'.format(type(e).__name__, e))
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        delays = []
+        stop = asyncio.Event()
+        beat = asyncio.ensure_future(heartbeat(delays, stop))
+        api_before = self.api.snapshot()
+        db_before = db_checkouts()
+        start = time.perf_counter()
+        await asyncio.gather(*[timed(invocation) for invocation in invocations])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+
+        count = len(invocations)
+        latencies.sort()
+        delays.sort()
+        api = self.api.snapshot() - api_before
+        self.results[name] = {
+            'count': count,
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'elapsed_s': elapsed,
+            'latency_ms': {'p50': percentile(latencies, 0.5), 'p90': percentile(latencies, 0.9),
+                           'p99': percentile(latencies, 0.99), 'max': latencies[-1] if latencies else 0.0,
+                           'mean': sum(latencies) / count if count else 0.0},
+            'blocked_ms': {'total': sum(delays), 'max': delays[-1] if delays else 0.0,
+                           'p99': percentile(delays, 0.99)},
+            'db_per_command': (db_checkouts() - db_before) / count if count else 0.0,
+            'api_per_command': sum(api.values()) / count if count else 0.0,
+            'api_calls': {kind: calls / count for kind, calls in sorted(api.items())} if count else {},
+        }
+
+    def every_user(self, make):
+        """ Makes an invocation for every user of every guild.
+
+        Parameters
+        ----------
+        make : callable
+            Called with the guild, the index of the user and the user, returning the invocation of the user.
+
+        """
+
+        return [make(guild, i, member) for guild in self.guilds for i, member in enumerate(guild.members)]
+
+    def context(self, guild, author, **kwargs):
+        """ Makes the context of a message sent by the given member in the guild's general channel.
+
+        """
+
+        return FakeContext(self.bot, guild.text_channels[0], author, **kwargs)
+
+    async def run_all(self):
+        """ Runs every phase of the workload, in an order where each phase has what it needs from the ones before.
+
+        """
+
+        users = len(self.guilds[0].members) if self.guilds else 0
+        group_names = {guild.id: 'team' + ''.join(string.ascii_lowercase[int(d)] for d in str(n))
+                       for n, guild in enumerate(self.guilds)}
+
+        def definition(i):
+            return ' '.join(self.rng.choice(WORDS) for _ in range(8)) + ' https://example.com/{}'.format(i)
+
+        ins_def = self.command('Definitions', 'ins_def')
+        await self.run('ins_def', self.every_user(
+            lambda g, i, m: lambda: ins_def(self.context(g, m), 'key{}'.format(i), definition(i))))
+        # A tenth of the lookups are of keywords that don't exist
+        get_def = self.command('Definitions', 'get_def')
+        await self.run('get_def', self.every_user(
+            lambda g, i, m: lambda: get_def(self.context(g, m), 'key{}'.format(self.rng.randrange(int(users * 1.1))))))
+        search_def = self.command('Definitions', 'search_def')
+        await self.run('search_def', self.every_user(
+            lambda g, i, m: lambda: search_def(self.context(g, m), query=self.rng.choice(WORDS)[:4])))
+        list_defs = self.command('Definitions', 'list_defs')
+        await self.run('list_defs', self.every_user(lambda g, i, m: lambda: list_defs(self.context(g, m), 1)))
+        invite = self.command('General', 'invite')
+        await self.run('invite', self.every_user(lambda g, i, m: lambda: invite(self.context(g, m))))
+
+        wiki = self.command('Wiki', 'wiki')
+
+        def ask_wiki(g, i, m):
+            async def invocation():
+                ctx = self.context(g, m)
+                # The user picks the first option as soon as they are asked
+                self.bot.script(FakeMessage(self.api, ctx.channel, m, content='1'))
+                await wiki(ctx, SUBJECTS[i % len(SUBJECTS)])
+            return invocation
+
+        await self.run('wiki', self.every_user(ask_wiki))
+
+        # The first member of each guild creates a group, then adds the rest of the guild to it
+        create_group = self.command('Groups', 'create_group')
+        await self.run('create_group', [lambda g=g: create_group(self.context(g, g.members[0]), group_names[g.id])
+                                        for g in self.guilds if g.members])
+        add_to_group = self.command('Groups', 'add_to_group')
+
+        def add_everyone(g):
+            roles = [role for role in g.roles if role.name == group_names[g.id]]
+            return lambda: add_to_group(self.context(g, g.members[0], mentions=g.members[1:], role_mentions=roles))
+
+        await self.run('add_to_group', [add_everyone(g) for g in self.guilds if g.members])
+        # The groups are archived then deleted, reading back what was sent to their channels
+        archive_group = self.command('Groups', 'archive_group')
+        await self.run('archive_group', [lambda g=g: archive_group(self.context(g, g.members[0]), group_names[g.id])
+                                         for g in self.guilds if g.members])
+
+        del_def = self.command('Definitions', 'del_def')
+        await self.run('del_def', self.every_user(lambda g, i, m: lambda: del_def(self.context(g, m),
+                                                                                   'key{}'.format(i))))
+        for cog, name in (('Definitions', 'cache_stats'), ('Definitions', 'storage_stats'), ('Wiki', 'wiki_stats'),
+                          ('General', 'queue_stats'), ('General', 'stats')):
+            stats = self.command(cog, name)
+            await self.run(name, [lambda g=g: stats(self.context(g, g.members[0])) for g in self.guilds
+                                  if g.members])
+
+    async def close(self):
+        """ Stops the scheduler and the worker threads of the cogs.
+
+        """
+
+        await self.bot.scheduler.close()
+        self.bot.get_cog('Wiki').client.close()
+
+
+def compare(baseline, results):
+    """ Formats the change of every command's measurements from the baseline results to the given results.
+
+    """
+
+    lines = ['comparing {} against {}'.format(results['commit'], baseline['commit'])]
+    lines.append('{:<14}'.format('command') + ''.join(' {:>30}'.format(label) for _, label in COMPARED))
+    for name, now in results['commands'].items():
+        before = baseline['commands'].get(name)
+        if before is None:
+            continue
+        cells = []
+        for key, _ in COMPARED:
+            old, new = [{'p50': r['latency_ms']['p50'], 'p99': r['latency_ms']['p99'],
+                         'blocked': r['blocked_ms']['total'], 'db': r['db_per_command'],
+                         'api': r['api_per_command']}[key] for r in (before, now)]
+            change = '{:+.0%}'.format((new - old) / old) if old else 'n/a'
+            cells.append(' {:>30}'.format('{:.2f} -> {:.2f} ({})'.format(old, new, change)))
+        lines.append('{:<14}'.format(name) + ''.join(cells))
+    return '\n'.join(lines)
+
+
+def main():
+    """ Runs the benchmark, printing a summary and writing the results as JSON.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--guilds', type=int, default=20, help='the number of guilds')
+    parser.add_argument('--users', type=int, default=10, help='the number of users in each guild')
+    parser.add_argument('--concurrency', type=int, default=50, help='the number of commands running at once')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='the seconds each discord request takes')
+    parser.add_argument('--wiki-latency', type=float, default=0.05, help='the seconds each Wikipedia request takes')
+    parser.add_argument('--limits', choices=('off', 'discord'), default='off',
+                        help="whether requests are paced by the bot's scheduler settings")
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the workload')
+    parser.add_argument('--output', help='the file the results are written to. Defaults to '
+                                         'benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', help='a results file to compare the results against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Points the cogs at databases of their own
+        settings.db_settings['path'] = os.path.join(tmp, 'pm.db')
+        settings.wiki_settings['cache_path'] = os.path.join(tmp, 'wiki_cache.db')
+        storage.bootstrap(settings.db_settings['path'], pool_size=settings.db_settings['pool_size'],
+                          pragmas=settings.db_settings['pragmas'])
+        database.configure_cache(settings.db_settings['path'], max_entries=settings.db_settings['cache_entries'],
+                                 max_bytes=settings.db_settings['cache_bytes'], ttl=settings.db_settings['cache_ttl'],
+                                 max_guilds=settings.db_settings['cache_guilds'])
+        async_database.configure_batching(settings.db_settings['path'], window=settings.db_settings['batch_window'],
+                                          max_batch=settings.db_settings['batch_size'])
+
+        loop = asyncio.get_event_loop()
+        with WikiFixture(latency=args.wiki_latency):
+            harness = Harness(args.guilds, args.users, args.api_latency, args.limits, args.concurrency, args.seed)
+            try:
+                loop.run_until_complete(harness.run_all())
+            finally:
+                loop.run_until_complete(harness.close())
+        async_database.shutdown()
+        database.close_pools()
+
+    results = {
+        'commit': commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'commands': harness.results,
+    }
+
+    print('{:<14}{:>6}{:>7}{:>10}{:>10}{:>10}{:>12}{:>8}{:>8}'.format(
+        'command', 'runs', 'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'blocked ms', 'db/cmd', 'api/cmd'))
+    for name, r in harness.results.items():
+        print('{:<14}{:>6}{:>7}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}{:>8.2f}{:>8.2f}'.format(
+            name, r['count'], r['errors'], r['latency_ms']['p50'], r['latency_ms']['p90'], r['latency_ms']['p99'],
+            r['blocked_ms']['total'], r['db_per_command'], r['api_per_command']))
+        if r['first_error']:
+            print('    first error: {}'.format(r['first_error']))
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', '{}.json'.format(results['commit']))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), results))
+
+
+if __name__ == '__main__':
+    main()
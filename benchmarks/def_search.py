@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+""" Measures the latency of searching and listing definitions at scale, against a generated database holding
+hundreds of thousands of definitions spread across many guilds.
+
+Usage
+-----
+    python benchmarks/def_search.py [--defs 300000] [--guilds 500] [--queries 500]
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import os  # Used to find the repository
+import random  # Used to generate the definitions and queries
+import sys  # Used to import the modules of the bot
+import tempfile  # Used to hold the generated database
+import time  # Used to time the queries
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+import storage  # noqa: E402
+
+# Common words, which every guild uses
+WORDS = ['project', 'manager', 'deadline', 'sprint', 'design', 'review', 'python', 'discord', 'meeting', 'notes',
+         'roadmap', 'budget', 'client', 'release', 'testing', 'deploy', 'server', 'channel', 'guide', 'schedule',
+         'link', 'docs', 'wiki', 'repository', 'branch', 'issue', 'ticket', 'backlog', 'milestone', 'report']
+# The syllables the rest of the vocabulary is made of
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'qu', 'bra', 'din', 'fel', 'gor', 'hin', 'jup']
+
+
+def vocabulary(size, rng):
+    """ Makes a vocabulary of the common words followed by generated words. Words are drawn from it with a Zipf
+    distribution, so a few words are very common and most are rare, like in real text.
+
+    """
+
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return words, weights
+
+
+def generate(path, defs, guilds, words, weights, seed=0):
+    """ Creates a database at the given path holding the given number of random definitions, with the current schema.
+    The definitions are inserted straight into defs, like those of a database made before the blob store existed.
+
+    """
+
+    rng = random.Random(seed)
+    storage.migrate(path)
+    with database.connect(path, commit=True) as c:
+        rows = ((rng.randrange(guilds), '{}{}'.format(rng.choice(words[:200]), i),
+                 ' '.join(rng.choices(words, weights, k=rng.randint(5, 40)))) for i in range(defs))
+        c.executemany('INSERT INTO defs (server, command, def) VALUES (?, ?, ?);', rows)
+
+
+def percentiles(timings):
+    """ Formats the 50th, 95th and 99th percentiles and the max of the given timings in milliseconds.
+
+    """
+
+    ordered = sorted(timings)
+    pick = [ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000 for p in (0.5, 0.95, 0.99)]
+    return 'p50 {:.3f}ms, p95 {:.3f}ms, p99 {:.3f}ms, max {:.3f}ms'.format(*pick, ordered[-1] * 1000)
+
+
+def main():
+    """ Runs the benchmark, printing the latency percentiles of each kind of query.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--defs', type=int, default=300000, help='the number of definitions generated')
+    parser.add_argument('--guilds', type=int, default=500, help='the number of guilds the definitions belong to')
+    parser.add_argument('--queries', type=int, default=500, help='the number of queries of each kind run')
+    parser.add_argument('--vocabulary', type=int, default=20000, help='the number of distinct words used')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    words, weights = vocabulary(args.vocabulary, rng)
+
+    def word():
+        return rng.choices(words, weights)[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        start = time.perf_counter()
+        generate(path, args.defs, args.guilds, words, weights)
+        print('Generated {} definitions across {} guilds in {:.1f}s'.format(
+            args.defs, args.guilds, time.perf_counter() - start))
+        queries = {
+            'search one word': lambda: database.search_defs(path, rng.randrange(args.guilds), word()),
+            'search prefix': lambda: database.search_defs(path, rng.randrange(args.guilds), word()[:3]),
+            'search two words': lambda: database.search_defs(path, rng.randrange(args.guilds),
+                                                             '{} {}'.format(word(), word())),
+            'search common word': lambda: database.search_defs(path, rng.randrange(args.guilds), WORDS[0]),
+            'list first page': lambda: database.list_defs(path, rng.randrange(args.guilds)),
+            'list last page': lambda: database.list_defs(path, rng.randrange(args.guilds), offset=500),
+        }
+        for name, query in queries.items():
+            timings = []
+            for _ in range(args.queries):
+                start = time.perf_counter()
+                query()
+                timings.append(time.perf_counter() - start)
+            print('{}: {}'.format(name, percentiles(timings)))
+        database.close_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+""" Measures the latency of suggesting the closest definitions to a mistyped keyword, against a generated guild with
+tens of thousands of definitions, and how often the keyword meant is among the suggestions.
+
+Usage
+-----
+    python benchmarks/def_suggest.py [--defs 50000] [--queries 1000]
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import os  # Used to find the repository
+import random  # Used to generate the keywords and typos
+import string  # Used to make the typos
+import sys  # Used to import the modules of the bot
+import tempfile  # Used to hold the generated database
+import time  # Used to time the suggestions
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import database  # noqa: E402
+import storage  # noqa: E402
+from def_search import vocabulary, percentiles  # noqa: E402
+
+
+def typo(keyword, rng):
+    """ Makes a typo in the keyword: a letter dropped, doubled, swapped with the next or replaced.
+
+    """
+
+    i = rng.randrange(len(keyword))
+    kind = rng.randrange(4)
+    if kind == 0 and len(keyword) > 3:
+        return keyword[:i] + keyword[i + 1:]
+    if kind == 1:
+        return keyword[:i] + keyword[i] + keyword[i:]
+    if kind == 2 and i < len(keyword) - 1:
+        return keyword[:i] + keyword[i + 1] + keyword[i] + keyword[i + 2:]
+    return keyword[:i] + rng.choice(string.ascii_lowercase) + keyword[i + 1:]
+
+
+def main():
+    """ Runs the benchmark, printing the time taken to build the guild's index and the latency of the suggestions.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--defs', type=int, default=50000, help='the number of definitions of the guild')
+    parser.add_argument('--queries', type=int, default=1000, help='the number of mistyped keywords looked up')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    words, _ = vocabulary(args.defs, rng)
+    keywords = words[:args.defs]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        storage.bootstrap(path)
+        database.ins_defs(path, 1, ((keyword, 'definition of ' + keyword) for keyword in keywords), commit=True)
+
+        # The first suggestion reads the guild's keywords and builds its index
+        start = time.perf_counter()
+        database.suggest_defs(path, 1, 'warmup')
+        print('Built the index of {} keywords in {:.1f}ms'.format(len(keywords), (time.perf_counter() - start) * 1000))
+
+        timings = []
+        found = 0
+        for _ in range(args.queries):
+            keyword = rng.choice(keywords)
+            start = time.perf_counter()
+            suggestions = database.suggest_defs(path, 1, typo(keyword, rng))
+            timings.append(time.perf_counter() - start)
+            found += keyword in suggestions
+        print('suggest: {}'.format(percentiles(timings)))
+        print('The keyword meant was suggested for {:.1%} of the typos'.format(found / args.queries))
+
+        # Inserting and deleting keep the index up to date without rebuilding it
+        timings = []
+        for i in range(args.queries):
+            start = time.perf_counter()
+            database.ins_def(path, 1, 'added{}'.format(i), 'definition', commit=True)
+            database.del_def(path, 1, 'added{}'.format(i), commit=True)
+            timings.append(time.perf_counter() - start)
+        print('insert and delete: {}'.format(percentiles(timings)))
+        database.close_pools()
+
+
+if __name__ == '__main__':
+    main()
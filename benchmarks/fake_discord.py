@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+""" An in-process stand-in for the parts of discord the cogs use, so the real cogs can be driven without a connection
+to discord.
+
+The fake guilds, channels, members, roles and messages only keep the state the cogs read back, and every request the
+cogs make to discord is counted by an ApiLog and can be delayed to stand in for the round trip to discord.
+
+Common Uses
+-----------
+Example:
+    api = ApiLog(latency=0.02)
+    bot = FakeBot(api, scheduler)
+    guild = FakeGuild(api, 1, members=10)
+    ctx = FakeContext(bot, guild.text_channels[0], guild.members[0])
+    await Definitions.get_def.callback(cog, ctx, 'keyword')
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to delay the requests
+import collections  # Used to count the requests
+import datetime  # Used to date the messages
+import itertools  # Used to give every fake object its own id
+from interactions import InteractionManager  # Used to answer the prompts of the cogs
+
+
+# The ids handed out to the fake objects
+_ids = itertools.count(1000)
+
+
+class ApiLog:
+    """ Counts the requests made to the fake discord, by kind, delaying each one by the given latency.
+
+    """
+
+    def __init__(self, latency=0.0):
+        """ Constructs the ApiLog class.
+
+        Parameters
+        ----------
+        latency : float
+            The number of seconds each request takes.
+
+        """
+
+        self.latency = latency
+        self.calls = collections.Counter()
+        # Called with every message the bot sends, used by FakeBot to answer prompts
+        self.on_send = None
+
+    async def request(self, kind):
+        """ Records a request of the given kind, taking as long as a request to discord would.
+
+        """
+
+        self.calls[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def snapshot(self):
+        """ Gets a copy of the counts, to be subtracted from a later snapshot.
+
+        """
+
+        return collections.Counter(self.calls)
+
+
+class FakeRole:
+    """ A role of a fake guild.
+
+    """
+
+    def __init__(self, api, guild, name, mentionable=False):
+        self.api = api
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.mentionable = mentionable
+        self.mention = '<@&{}>'.format(self.id)
+
+    @property
+    def members(self):
+        """ The members of the guild that have the role.
+
+        """
+
+        return [member for member in self.guild.members + [self.guild.me] if self in member.roles]
+
+    async def delete(self):
+        """ Deletes the role from its guild.
+
+        """
+
+        await self.api.request('delete_role')
+        if self in self.guild.roles:
+            self.guild.roles.remove(self)
+
+    def __repr__(self):
+        return 'FakeRole({!r})'.format(self.name)
+
+
+class FakeMember:
+    """ A member of a fake guild.
+
+    """
+
+    def __init__(self, api, guild, name, roles=()):
+        self.api = api
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.display_name = name
+        self.mention = '<@{}>'.format(self.id)
+        self.roles = [guild.default_role] + list(roles)
+
+    async def add_roles(self, *roles):
+        """ Gives the member the given roles.
+
+        """
+
+        await self.api.request('add_roles')
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles):
+        """ Takes the given roles away from the member.
+
+        """
+
+        await self.api.request('remove_roles')
+        self.roles = [role for role in self.roles if role not in roles]
+
+    def __repr__(self):
+        return 'FakeMember({!r})'.format(self.name)
+
+
+class FakeMessage:
+    """ A message sent to a fake channel, either by the bot or by a member.
+
+    """
+
+    def __init__(self, api, channel, author, content=None, embed=None, file=None, mentions=(), role_mentions=()):
+        self.api = api
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embed = embed
+        self.file = file
+        self.mentions = list(mentions)
+        self.role_mentions = list(role_mentions)
+        self.attachments = []
+        self.created_at = datetime.datetime.utcnow()
+
+    async def edit(self, content=None, embed=None):
+        """ Changes the content or embed of the message.
+
+        """
+
+        await self.api.request('edit_message')
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+
+    async def delete(self):
+        """ Deletes the message.
+
+        """
+
+        await self.api.request('delete_message')
+
+
+class FakeChannel:
+    """ A text channel, voice channel or category of a fake guild. Every message sent to it is kept.
+
+    """
+
+    def __init__(self, api, guild, name, kind='text', category=None, overwrites=None):
+        self.api = api
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.kind = kind
+        self.category = category
+        self.overwrites = overwrites or {}
+        self.messages = []
+
+    async def send(self, content=None, embed=None, file=None):
+        """ Sends a message from the bot to the channel, keeping it with the channel's messages.
+
+        """
+
+        await self.api.request('send')
+        message = FakeMessage(self.api, self, self.guild.me, content=content, embed=embed, file=file)
+        self.messages.append(message)
+        if self.api.on_send is not None:
+            self.api.on_send(message)
+        return message
+
+    async def delete(self):
+        """ Deletes the channel from its guild.
+
+        """
+
+        await self.api.request('delete_channel')
+        if self in self.guild.channels:
+            self.guild.channels.remove(self)
+
+    async def set_permissions(self, target, **permissions):
+        """ Sets the permissions of a role or member in the channel.
+
+        """
+
+        await self.api.request('edit_channel')
+        self.overwrites[target] = permissions
+
+    def history(self, limit=100, after=None):
+        """ Reads the messages of the channel, oldest first, after the given message if one is given.
+
+        """
+
+        return FakeHistory(self, limit, after)
+
+    def __repr__(self):
+        return 'FakeChannel({!r})'.format(self.name)
+
+
+class FakeHistory:
+    """ A page of the messages of a fake channel, read when flattened.
+
+    """
+
+    def __init__(self, channel, limit, after):
+        self.channel = channel
+        self.limit = limit
+        self.after = after
+
+    async def flatten(self):
+        """ Reads the page of messages.
+
+        """
+
+        await self.channel.api.request('history')
+        after = self.after.id if self.after is not None else 0
+        return [message for message in self.channel.messages if message.id > after][:self.limit]
+
+
+class FakeGuild:
+    """ A guild with a single text channel, a given number of members, and the bot as a member.
+
+    """
+
+    def __init__(self, api, id=None, members=10, name='guild'):
+        """ Constructs the FakeGuild class.
+
+        Parameters
+        ----------
+        api : ApiLog
+            The log the requests made to the guild are counted in.
+        id : int
+            The id of the guild.
+        members : int
+            The number of members of the guild, not counting the bot.
+        name : str
+            The name of the guild.
+
+        """
+
+        self.api = api
+        self.id = next(_ids) if id is None else id
+        self.name = name
+        self.default_role = FakeRole(api, self, '@everyone')
+        self.roles = [self.default_role]
+        self.me = FakeMember(api, self, 'bot')
+        self.members = [FakeMember(api, self, '{}-member{}'.format(name, i)) for i in range(members)]
+        self.channels = [FakeChannel(api, self, 'general')]
+
+    @property
+    def text_channels(self):
+        """ The text channels of the guild.
+
+        """
+
+        return [channel for channel in self.channels if channel.kind == 'text']
+
+    def get_channel(self, channel_id):
+        """ Gets the channel or category of the guild with the given id, or None.
+
+        """
+
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+
+    def get_role(self, role_id):
+        """ Gets the role of the guild with the given id, or None.
+
+        """
+
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    async def create_role(self, name, mentionable=False):
+        """ Creates a role in the guild.
+
+        """
+
+        await self.api.request('create_role')
+        role = FakeRole(self.api, self, name, mentionable=mentionable)
+        self.roles.append(role)
+        return role
+
+    async def _create_channel(self, kind, name, category=None, overwrites=None):
+        """ Creates a channel of the given kind in the guild.
+
+        """
+
+        await self.api.request('create_channel')
+        channel = FakeChannel(self.api, self, name, kind=kind, category=category, overwrites=overwrites)
+        self.channels.append(channel)
+        return channel
+
+    async def create_category(self, name, overwrites=None):
+        """ Creates a category in the guild.
+
+        """
+
+        return await self._create_channel('category', name, overwrites=overwrites)
+
+    async def create_text_channel(self, name, category=None, overwrites=None):
+        """ Creates a text channel in the guild.
+
+        """
+
+        return await self._create_channel('text', name, category=category, overwrites=overwrites)
+
+    async def create_voice_channel(self, name, category=None, overwrites=None):
+        """ Creates a voice channel in the guild.
+
+        """
+
+        return await self._create_channel('voice', name, category=category, overwrites=overwrites)
+
+
+class FakeUser:
+    """ The user of the fake bot.
+
+    """
+
+    def __init__(self, name='Project Manager Bot'):
+        self.id = next(_ids)
+        self.name = name
+
+
+class FakeBot:
+    """ Stands in for discord.ext.commands.Bot, holding the cogs and answering prompts with scripted replies.
+
+    """
+
+    def __init__(self, api, scheduler, loop=None, prompt_timeout=60):
+        """ Constructs the FakeBot class.
+
+        Parameters
+        ----------
+        api : ApiLog
+            The log the requests of the bot are counted in.
+        scheduler : scheduler.Scheduler
+            The scheduler the cogs queue their requests on.
+        loop : asyncio.AbstractEventLoop
+            The event loop the cogs run on.
+        prompt_timeout : float
+            The number of seconds the prompts of the cogs wait for an answer.
+
+        """
+
+        self.api = api
+        self.scheduler = scheduler
+        self.loop = loop or asyncio.get_event_loop()
+        self.user = FakeUser()
+        self.cogs = {}
+        self.listeners = collections.defaultdict(list)
+        # The replies members will send, by channel, handed to the first prompt in the channel they answer
+        self._scripted = collections.defaultdict(list)
+        self.interactions = InteractionManager(self, timeout=prompt_timeout)
+        api.on_send = self._answer
+
+    def add_listener(self, func, name=None):
+        """ Adds a listener of the given event.
+
+        """
+
+        self.listeners[name or func.__name__].append(func)
+
+    def add_cog(self, cog):
+        """ Adds a cog to the bot, keyed by its class name.
+
+        """
+
+        self.cogs[type(cog).__name__] = cog
+
+    def get_cog(self, name):
+        """ Gets the cog with the given class name, or None.
+
+        """
+
+        return self.cogs.get(name)
+
+    def script(self, message):
+        """ Queues a message a member will send once the bot has sent a prompt in its channel that it answers.
+
+        """
+
+        self._scripted[message.channel.id].append(message)
+
+    def _answer(self, sent):
+        """ Sends the scripted replies that answer a prompt open in the channel the bot just sent a message to.
+
+        """
+
+        messages = self._scripted.get(sent.channel.id, [])
+        for message in list(messages):
+            if self.interactions.dispatch(message):
+                messages.remove(message)
+
+
+class FakeContext:
+    """ Stands in for discord.ext.commands.Context, for a message sent by a member in a channel.
+
+    """
+
+    def __init__(self, bot, channel, author, content='', mentions=(), role_mentions=()):
+        self.bot = bot
+        self.message = FakeMessage(bot.api, channel, author, content=content, mentions=mentions,
+                                   role_mentions=role_mentions)
+        self.guild = channel.guild
+        self.channel = channel
+        self.author = author
+        self.me = channel.guild.me
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+""" Measures how long the event loop is blocked by the definition queries, comparing the synchronous functions in
+database.py against the asyncio versions in async_database.py.
+
+A heartbeat task wakes up every millisecond while the queries run. Whenever it wakes up late, the loop was blocked for
+that long, and the delay is added to a latency histogram which is printed once both runs have finished.
+
+Usage
+-----
+    python benchmarks/loop_blocking.py [--ops 2000] [--concurrency 20]
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import asyncio  # Used to run the benchmark on an event loop
+import os  # Used to find the repository and the database schema
+import shutil  # Used to copy the database so the real one isn't touched
+import sys  # Used to import the modules of the bot
+import tempfile  # Used to hold the copy of the database
+import time  # Used to time the heartbeat
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+import async_database  # noqa: E402
+
+# The upper bounds of the histogram buckets, in milliseconds
+BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, float('inf')]
+# How often the heartbeat wakes up, in seconds
+TICK = 0.001
+
+
+async def heartbeat(delays, stop):
+    """ Wakes up every tick, recording how late each wake up was.
+
+    Parameters
+    ----------
+    delays : list
+        The list the delays are added to, in milliseconds.
+    stop : asyncio.Event
+        Set when the heartbeat should stop.
+
+    """
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        delays.append(max(0.0, (time.perf_counter() - start - TICK) * 1000))
+
+
+async def sync_op(path, i):
+    """ Runs one insert, read and delete with the blocking functions, as the commands used to.
+
+    """
+
+    database.ins_def(path, i, 'key', 'value {}'.format(i), commit=True)
+    database.get_def(path, i, 'key')
+    database.del_def(path, i, 'key', commit=True)
+
+
+async def async_op(path, i):
+    """ Runs one insert, read and delete with the asyncio functions.
+
+    """
+
+    await async_database.ins_def(path, i, 'key', 'value {}'.format(i), commit=True)
+    await async_database.get_def(path, i, 'key')
+    await async_database.del_def(path, i, 'key', commit=True)
+
+
+async def run(op, path, ops, concurrency):
+    """ Runs the given operation the given number of times while the heartbeat is running.
+
+    Returns
+    -------
+    tuple
+        The list of heartbeat delays, and the total time taken in seconds.
+
+    """
+
+    delays = []
+    stop = asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(delays, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(i):
+        async with semaphore:
+            await op(path, i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[limited(i) for i in range(ops)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    return delays, elapsed
+
+
+def histogram(delays):
+    """ Formats the given delays as a histogram.
+
+    """
+
+    lines = []
+    lower = 0
+    for upper in BUCKETS:
+        count = len([d for d in delays if lower <= d < upper])
+        label = '{:>4}-{:<4}ms'.format(lower, upper if upper != float('inf') else '')
+        lines.append('  {} {:>6} {}'.format(label, count, '#' * min(60, count * 60 // max(1, len(delays)))))
+        lower = upper
+    ordered = sorted(delays) or [0.0]
+    lines.append('  max {:.2f}ms, p99 {:.2f}ms, total blocked {:.0f}ms'.format(
+        ordered[-1], ordered[int(len(ordered) * 0.99) - 1 if len(ordered) > 1 else 0], sum(delays)))
+    return '\n'.join(lines)
+
+
+def main():
+    """ Runs the benchmark, printing the histograms of both runs.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--ops', type=int, default=2000, help='the number of insert/read/delete rounds to run')
+    parser.add_argument('--concurrency', type=int, default=20, help='the number of rounds running at once')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        shutil.copy(os.path.join(ROOT, 'databases', 'pm.db'), path)
+        loop = asyncio.get_event_loop()
+        for name, op in (('before (database)', sync_op), ('after (async_database)', async_op)):
+            delays, elapsed = loop.run_until_complete(run(op, path, args.ops, args.concurrency))
+            print('{}: {} rounds in {:.2f}s'.format(name, args.ops, elapsed))
+            print(histogram(delays))
+        async_database.shutdown()
+        database.close_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+""" Measures the latency of reads and writes under a mixed load, comparing sqlite's defaults against the write-ahead
+log and pragmas set by storage.bootstrap.
+
+Reader threads look up random definitions, bypassing the definition cache so every read reaches sqlite, while a
+writer thread inserts and deletes definitions, committing each one. Both run for a fixed time against their own copy
+of a generated database, and the latency percentiles of each are printed.
+
+Usage
+-----
+    python benchmarks/storage_tuning.py [--defs 50000] [--readers 4] [--seconds 5] [--dir /tmp]
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import os  # Used to find the repository
+import random  # Used to pick the definitions read
+import sys  # Used to import the modules of the bot
+import tempfile  # Used to hold the generated databases
+import threading  # Used to run the readers and the writer at once
+import time  # Used to time the queries
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+import storage  # noqa: E402
+
+# The number of guilds the generated definitions are spread across
+GUILDS = 100
+
+
+def generate(path, defs):
+    """ Creates a database at the given path holding the given number of definitions, with the current schema.
+
+    """
+
+    storage.migrate(path)
+    rows = ((i % GUILDS, 'key{}'.format(i), 'definition number {} of the benchmark'.format(i)) for i in range(defs))
+    with database.connect(path, commit=True) as c:
+        c.executemany('INSERT INTO defs (server, command, def) VALUES (?, ?, ?);', rows)
+
+
+def read(path, defs, stop, latencies, seed):
+    """ Reads random definitions until told to stop, recording the latency of each read.
+
+    """
+
+    rng = random.Random(seed)
+    while not stop.is_set():
+        i = rng.randrange(defs)
+        start = time.perf_counter()
+        with database.connect(path) as c:
+            c.execute('SELECT def FROM defs WHERE server=? AND command=?;', (i % GUILDS, 'key{}'.format(i)))
+            c.fetchone()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def write(path, stop, latencies):
+    """ Inserts and deletes definitions until told to stop, committing each write and recording its latency.
+
+    """
+
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        # Inserts a definition, then deletes it again
+        if i % 2 == 0:
+            database.ins_def(path, i // 2 % GUILDS, 'written{}'.format(i // 2), 'a written definition', commit=True)
+        else:
+            database.del_def(path, i // 2 % GUILDS, 'written{}'.format(i // 2), commit=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+
+
+def summary(latencies, seconds):
+    """ Formats the throughput and latency percentiles of the given latencies, in milliseconds.
+
+    """
+
+    ordered = sorted(latencies) or [0.0]
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    return '{:>7.0f}/s  p50 {:6.2f}ms  p99 {:6.2f}ms  max {:7.2f}ms'.format(
+        len(latencies) / seconds, percentile(0.5), percentile(0.99), ordered[-1])
+
+
+def run(path, defs, readers, seconds):
+    """ Runs the readers and the writer against the given database for the given number of seconds.
+
+    Returns
+    -------
+    tuple
+        The read latencies and the write latencies, in milliseconds.
+
+    """
+
+    stop = threading.Event()
+    reads = [[] for _ in range(readers)]
+    writes = []
+    threads = [threading.Thread(target=read, args=(path, defs, stop, reads[n], n)) for n in range(readers)]
+    threads.append(threading.Thread(target=write, args=(path, stop, writes)))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return [latency for latencies in reads for latency in latencies], writes
+
+
+def main():
+    """ Runs the benchmark, printing the read and write latencies of both configurations.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--defs', type=int, default=50000, help='the number of definitions in the database')
+    parser.add_argument('--readers', type=int, default=4, help='the number of reader threads')
+    parser.add_argument('--seconds', type=float, default=5, help='the number of seconds each configuration runs for')
+    parser.add_argument('--dir', default=None, help='the directory to create the databases in, on the disk to test')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for name, tuned in (('defaults', False), ('tuned', True)):
+            path = os.path.join(tmp, '{}.db'.format(name))
+            # The pools need a connection per reader, the writer, and one to spare
+            if tuned:
+                storage.bootstrap(path, pool_size=args.readers + 2)
+            else:
+                database.get_pool(path, size=args.readers + 2)
+            generate(path, args.defs)
+            reads, writes = run(path, args.defs, args.readers, args.seconds)
+            print('{}:'.format(name))
+            print('  reads  {}'.format(summary(reads, args.seconds)))
+            print('  writes {}'.format(summary(writes, args.seconds)))
+        database.close_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+""" A local stand-in for the Wikipedia API, so the wiki commands can be benchmarked and tried out offline.
+
+The fixture serves the handful of MediaWiki API queries the wikipedia library makes (search, page info, disambiguation
+revisions and extracts) from a small in-memory corpus, over a real HTTP server on localhost. Every response can be
+delayed to stand in for the round trip to Wikipedia.
+
+Common Uses
+-----------
+Example:
+    with WikiFixture(latency=0.05):
+        # Every call made by the wikipedia library in here goes to the fixture
+
+Run the file directly to serve the fixture until interrupted:
+    python benchmarks/wiki_fixture.py --port 8765 --latency 0.05
+
+Todo
+----
+*
+
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer  # Used to serve the fixture
+from socketserver import ThreadingMixIn  # Used to answer requests concurrently, like Wikipedia would
+from urllib.parse import parse_qs, urlparse, quote  # Used to read the queries and build the urls
+import argparse  # Used to read the options when run directly
+import json  # Used to encode the responses
+import threading  # Used to serve the fixture in the background
+import time  # Used to delay the responses
+import wikipedia  # Wikipedia library, pointed at the fixture while it runs
+
+
+# The corpus served when no other corpus is given, as title: summary, or title: list of titles for disambiguations
+DEFAULT_CORPUS = {
+    'Python (programming language)': 'Python is a high-level, general-purpose programming language.',
+    'Python (genus)': 'Python is a genus of constricting snakes in the Pythonidae family.',
+    'Python (mythology)':
+        'In Greek mythology, Python was the serpent, sometimes represented as a medieval-style dragon.',
+    'Python': ['Python (programming language)', 'Python (genus)', 'Python (mythology)'],
+    'Monty Python': 'Monty Python were a British comedy troupe formed in 1969.',
+    'Python Software Foundation': 'The Python Software Foundation is an American nonprofit organization.',
+    'Project management': 'Project management is the process of leading the work of a team to achieve goals.',
+    'Project': ['Project management', 'Project (disambiguation)'],
+    'Project manager': 'A project manager is a professional in the field of project management.',
+    'Discord': 'Discord is an instant messaging and VoIP social platform.',
+}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """ An HTTP server that handles each request on its own thread.
+
+    """
+
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Answers the MediaWiki API queries made by the wikipedia library from the corpus of the server.
+
+    """
+
+    def do_GET(self):
+        """ Answers a single API query.
+
+        """
+
+        # Reads the query, keeping only the first value of each parameter
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query, keep_blank_values=True).items()}
+        # Stands in for the round trip to Wikipedia
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        body = json.dumps(self._answer(params)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """ Keeps the fixture quiet.
+
+        """
+
+        pass
+
+    def _answer(self, params):
+        """ Builds the response to the given query.
+
+        """
+
+        corpus = self.server.corpus
+        # Searches, ranking titles by how many of the query's words they contain
+        if params.get('list') == 'search':
+            words = params.get('srsearch', '').lower().split()
+            scored = [(sum(w in title.lower() for w in words), title) for title in corpus]
+            titles = [title for score, title in sorted(scored, key=lambda s: -s[0]) if score > 0]
+            return {'query': {'search': [{'title': t} for t in titles[:int(params.get('srlimit', 10))]]}}
+        title = params.get('titles', '')
+        # Answers titles that don't exist with a missing page
+        if title not in corpus:
+            return {'query': {'pages': {'-1': {'title': title, 'missing': ''}}}}
+        pageid = str(sorted(corpus).index(title) + 1)
+        entry = corpus[title]
+        prop = params.get('prop', '')
+        # Answers the page information, flagging disambiguation pages
+        if 'info' in prop:
+            page = {'pageid': int(pageid), 'title': title,
+                    'fullurl': 'https://en.wikipedia.org/wiki/{}'.format(quote(title.replace(' ', '_')))}
+            if isinstance(entry, list):
+                page['pageprops'] = {'disambiguation': ''}
+            return {'query': {'pages': {pageid: page}}}
+        # Answers the content of disambiguation pages with the list of pages they refer to
+        if prop == 'revisions':
+            html = '<ul>{}</ul>'.format(''.join('<li><a>{}</a></li>'.format(t) for t in entry))
+            return {'query': {'pages': {pageid: {'revisions': [{'*': html}]}}}}
+        # Answers the summary of the page
+        if prop == 'extracts':
+            return {'query': {'pages': {pageid: {'extract': entry if isinstance(entry, str) else ''}}}}
+        return {'error': {'info': 'The fixture does not support this query.'}}
+
+
+class WikiFixture:
+    """ Serves the stand-in for the Wikipedia API on localhost, pointing the wikipedia library at it while active.
+
+    """
+
+    def __init__(self, corpus=None, latency=0.0, port=0):
+        """ Constructs the WikiFixture class.
+
+        Parameters
+        ----------
+        corpus : dict
+            The pages served, as title: summary, or title: list of titles for disambiguation pages.
+        latency : float
+            The number of seconds each response is delayed by.
+        port : int
+            The port to serve on. 0 picks a free port.
+
+        """
+
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.corpus = corpus if corpus is not None else DEFAULT_CORPUS
+        self._server.latency = latency
+        self._server.requests = 0
+        self._thread = None
+        self._api_url = None
+
+    @property
+    def url(self):
+        """ The url of the fixture's API.
+
+        """
+
+        return 'http://127.0.0.1:{}/w/api.php'.format(self._server.server_address[1])
+
+    @property
+    def requests(self):
+        """ The number of requests the fixture has answered.
+
+        """
+
+        return self._server.requests
+
+    def __enter__(self):
+        # Starts serving in the background
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        # Points the wikipedia library at the fixture, forgetting anything it memoized from the real Wikipedia
+        self._api_url = wikipedia.wikipedia.API_URL
+        wikipedia.wikipedia.API_URL = self.url
+        for func in (wikipedia.search, wikipedia.suggest, wikipedia.summary):
+            func.clear_cache()
+        return self
+
+    def __exit__(self, *exc):
+        # Points the wikipedia library back at Wikipedia
+        wikipedia.wikipedia.API_URL = self._api_url
+        for func in (wikipedia.search, wikipedia.suggest, wikipedia.summary):
+            func.clear_cache()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8765, help='the port to serve on')
+    parser.add_argument('--latency', type=float, default=0.05, help='the seconds each response is delayed by')
+    args = parser.parse_args()
+    with WikiFixture(latency=args.latency, port=args.port) as fixture:
+        print('Serving the Wikipedia stand-in at {}'.format(fixture.url))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+""" Measures how long !wiki lookups take against the local Wikipedia stand-in, comparing the blocking lookup the Wiki
+cog used to make against the WikiClient.
+
+Each run starts several lookups at once, as if they came from different guilds, and reports the time taken for all of
+them along with the number of requests that reached the stand-in.
+
+Usage
+-----
+    python benchmarks/wiki_lookup.py [--lookups 8] [--latency 0.05]
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import asyncio  # Used to run the lookups on an event loop
+import os  # Used to find the repository
+import sys  # Used to import the modules of the bot
+import time  # Used to time the lookups
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import wikipedia  # noqa: E402
+from wiki_client import WikiClient  # noqa: E402
+from wiki_fixture import WikiFixture  # noqa: E402
+
+# The subjects looked up, cycled through by the lookups
+SUBJECTS = ['python', 'project', 'discord', 'monty python']
+
+
+async def blocking_lookup(subject):
+    """ Looks the subject up the way the Wiki cog used to, with every call blocking the event loop.
+
+    """
+
+    search = wikipedia.search(subject)
+    i = 0
+    while i < 4 and i in range(len(search)):
+        try:
+            wikipedia.summary(search[i])
+        except wikipedia.DisambiguationError:
+            search.remove(search[i])
+        else:
+            i += 1
+    if search:
+        return wikipedia.page(search[0]).url
+
+
+async def client_lookup(client, subject):
+    """ Looks the subject up with the WikiClient.
+
+    """
+
+    options = await client.options(subject)
+    if options:
+        return options[0][1]
+
+
+def main():
+    """ Runs the benchmark, printing the results of both runs.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lookups', type=int, default=8, help='the number of lookups started at once')
+    parser.add_argument('--latency', type=float, default=0.05, help='the seconds each response is delayed by')
+    parser.add_argument('--concurrency', type=int, default=8, help='the concurrency bound of the client')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    subjects = [SUBJECTS[i % len(SUBJECTS)] for i in range(args.lookups)]
+    client = WikiClient(max_concurrency=args.concurrency, timeout=30)
+    runs = (('before (blocking)', blocking_lookup), ('after (WikiClient)', lambda s: client_lookup(client, s)))
+    for name, lookup in runs:
+        # Starts every run with an empty memo in the wikipedia library, so both runs make the same requests
+        with WikiFixture(latency=args.latency) as fixture:
+            start = time.perf_counter()
+            loop.run_until_complete(asyncio.gather(*[lookup(s) for s in subjects]))
+            elapsed = time.perf_counter() - start
+            print('{}: {} lookups in {:.2f}s, {} requests'.format(name, args.lookups, elapsed, fixture.requests))
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
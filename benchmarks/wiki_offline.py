@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+""" Measures the offline Wikipedia abstracts: how long a generated abstract dump takes to build, the size of the files
+built, and the latency of searches and summaries against them.
+
+Usage
+-----
+    python benchmarks/wiki_offline.py [--articles 500000] [--lookups 10000]
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import gzip  # Used to compress the generated dump, like Wikipedia's
+import itertools  # Used to draw the words quickly
+import os  # Used to find the repository and measure the files
+import random  # Used to generate the titles and pick the lookups
+import resource  # Used to measure the memory used by the build
+import sys  # Used to import the modules of the bot
+import tempfile  # Used to hold the generated dump and abstracts
+import time  # Used to time the build and the lookups
+from xml.sax.saxutils import escape  # Used to write the generated dump
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import wiki_abstracts  # noqa: E402
+from def_search import vocabulary, percentiles  # noqa: E402
+
+
+def generate(path, articles, rng):
+    """ Writes a gzipped abstract dump of the given number of articles, with titles of one to four words drawn from a
+    Zipf distribution and abstracts of about forty words, like those of Wikipedia's dumps.
+
+    Returns
+    -------
+    list
+        The titles of the articles.
+
+    """
+
+    words, weights = vocabulary(20000, rng)
+    weights = list(itertools.accumulate(weights))
+    titles = []
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=1) as dump:
+        dump.write('<feed>\n')
+        for i in range(articles):
+            title = ' '.join(rng.choices(words, cum_weights=weights, k=rng.randint(1, 4))).capitalize()
+            if rng.random() < 0.3:
+                title += ' ({})'.format(i)
+            titles.append(title)
+            abstract = ' '.join(rng.choices(words, cum_weights=weights, k=40))
+            dump.write('<doc>\n<title>Wikipedia: {}</title>\n<url>https://en.wikipedia.org/wiki/{}</url>\n'
+                       '<abstract>{}</abstract>\n<links>\n<sublink linktype="nav"><anchor>History</anchor>'
+                       '<link>https://en.wikipedia.org/wiki/{}#History</link></sublink>\n</links>\n</doc>\n'
+                       .format(escape(title), escape(title.replace(' ', '_')), escape(abstract),
+                               escape(title.replace(' ', '_'))))
+        dump.write('</feed>\n')
+    return titles
+
+
+def main():
+    """ Runs the benchmark, printing the build time, the size of the files and the latency of the lookups.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--articles', type=int, default=500000, help='the number of articles of the generated dump')
+    parser.add_argument('--lookups', type=int, default=10000, help='the number of searches and summaries looked up')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = os.path.join(tmp, 'abstract.xml.gz')
+        path = os.path.join(tmp, 'abstracts')
+        titles = generate(dump, args.articles, rng)
+        print('Generated a dump of {} articles, {:.1f} MiB compressed'.format(
+            args.articles, os.path.getsize(dump) / 1024 / 1024))
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        with gzip.open(dump, 'rb') as fp:
+            count, skipped = wiki_abstracts.build(fp, path)
+        print('Built the abstracts of {} articles in {:.1f}s, peak memory up {:.1f} MiB'.format(
+            count, time.perf_counter() - start,
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024))
+        print('Index {:.1f} MiB, articles {:.1f} MiB'.format(os.path.getsize(path + '.idx') / 1024 / 1024,
+                                                             os.path.getsize(path + '.dat') / 1024 / 1024))
+
+        start = time.perf_counter()
+        index = wiki_abstracts.AbstractsIndex(path)
+        print('Opened the abstracts in {:.3f}ms'.format((time.perf_counter() - start) * 1000))
+        # Searches for whole titles and for the start of their first word, as users type them
+        timings = []
+        for _ in range(args.lookups):
+            title = rng.choice(titles)
+            subject = title if rng.random() < 0.5 else title.split()[0][:rng.randint(3, 8)]
+            start = time.perf_counter()
+            index.search(subject, limit=4)
+            timings.append(time.perf_counter() - start)
+        print('search: {}'.format(percentiles(timings)))
+        timings = []
+        for _ in range(args.lookups):
+            title = rng.choice(titles)
+            start = time.perf_counter()
+            index.find(title)
+            timings.append(time.perf_counter() - start)
+        print('summary: {}'.format(percentiles(timings)))
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
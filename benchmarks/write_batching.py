@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+""" Measures the number of definition writes per second with and without write batching.
+
+Many guilds insert and delete definitions at once, and a tenth of the inserts reuse a keyword that already exists so
+the per-operation failures of a batch are exercised too. Without batching every write commits on its own on the
+writer thread, as async_database did before. With batching the writes go through the WriteBatcher of the database.
+
+Usage
+-----
+    python benchmarks/write_batching.py [--ops 2000] [--concurrency 50] [--window 0.005]
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the benchmark options
+import asyncio  # Used to run the benchmark on an event loop
+import os  # Used to find the repository and the database schema
+import shutil  # Used to copy the database so the real one isn't touched
+import sys  # Used to import the modules of the bot
+import tempfile  # Used to hold the copy of the database
+import time  # Used to time the writes
+
+# Makes the modules of the bot importable when run from anywhere
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+import storage  # noqa: E402
+import async_database  # noqa: E402
+
+
+async def succeeded(write):
+    """ Awaits a write, returning whether it succeeded rather than raising the DatabaseError it failed with.
+
+    """
+
+    try:
+        await write
+    except database.DatabaseError:
+        return False
+    return True
+
+
+async def unbatched_op(path, i):
+    """ Runs one round of writes, each committing on its own.
+
+    Returns
+    -------
+    tuple
+        Whether each of the two inserts succeeded.
+
+    """
+
+    run = async_database._run
+    writer = async_database._writer
+    first = await succeeded(run(writer, database.ins_def, path, i, 'key', 'value {}'.format(i), commit=True))
+    second = await succeeded(run(writer, database.ins_def, path, i, 'key' if i % 10 == 0 else 'other', 'again',
+                                 commit=True))
+    await succeeded(run(writer, database.del_def, path, i, 'key', commit=True))
+    await succeeded(run(writer, database.del_def, path, i, 'other', commit=True))
+    return first, second
+
+
+async def batched_op(path, i):
+    """ Runs one round of writes through the write batcher.
+
+    Returns
+    -------
+    tuple
+        Whether each of the two inserts succeeded.
+
+    """
+
+    first = await succeeded(async_database.ins_def(path, i, 'key', 'value {}'.format(i), commit=True))
+    second = await succeeded(async_database.ins_def(path, i, 'key' if i % 10 == 0 else 'other', 'again', commit=True))
+    await succeeded(async_database.del_def(path, i, 'key', commit=True))
+    await succeeded(async_database.del_def(path, i, 'other', commit=True))
+    return first, second
+
+
+async def run(op, path, ops, concurrency):
+    """ Runs the given round the given number of times, the given number at once.
+
+    Returns
+    -------
+    tuple
+        The results of every round, and the total time taken in seconds.
+
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(i):
+        async with semaphore:
+            return await op(path, i)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[limited(i) for i in range(ops)])
+    return results, time.perf_counter() - start
+
+
+def main():
+    """ Runs the benchmark, printing the writes per second of both runs.
+
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--ops', type=int, default=2000, help='the number of rounds of four writes to run')
+    parser.add_argument('--concurrency', type=int, default=50, help='the number of rounds running at once')
+    parser.add_argument('--window', type=float, default=async_database.DEFAULT_BATCH_WINDOW,
+                        help='the number of seconds a batch waits for more writes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        shutil.copy(os.path.join(ROOT, 'databases', 'pm.db'), path)
+        storage.migrate(path)
+        async_database.configure_batching(path, window=args.window)
+        loop = asyncio.get_event_loop()
+        for name, op in (('unbatched', unbatched_op), ('batched', batched_op)):
+            results, elapsed = loop.run_until_complete(run(op, path, args.ops, args.concurrency))
+            # Every first insert should succeed, and only the second inserts reusing the keyword should fail
+            expected = [(True, i % 10 != 0) for i in range(args.ops)]
+            print('{:>10}: {} writes in {:.2f}s, {:.0f} writes/s, results {}'.format(
+                name, args.ops * 4, elapsed, args.ops * 4 / elapsed, 'correct' if results == expected else 'WRONG'))
+        stats = async_database.get_batcher(path).stats()
+        print('{:>10}  {batches} batches, {average:.1f} writes on average, {largest} at most'.format('', **stats))
+        async_database.shutdown()
+        database.close_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+""" This file contains the in-memory caches used by the bot to avoid repeating expensive lookups.
+
+Common Uses
+-----------
+Example:
+    cache = LRUCache(max_entries=1000, max_bytes=1024 * 1024, ttl=600)
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        value = lookup(key)
+        cache.put(key, value)
+
+Todo
+----
+*
+
+"""
+from collections import OrderedDict  # Used to keep the entries in least recently used order
+import sys  # Used to estimate the memory used by the entries
+import threading  # Used to make the caches safe to use across threads
+import time  # Used to expire entries
+
+
+# Sentinel returned by get when a key is not cached, as None can be a cached value
+MISSING = object()
+
+
+def _sizeof(key, value):
+    """ Estimates the number of bytes used by a cache entry.
+
+    Parameters
+    ----------
+    key : hashable
+        The key of the entry.
+    value : object
+        The value of the entry.
+
+    Returns
+    -------
+    int
+        The estimated size of the entry in bytes.
+
+    """
+
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class LRUCache:
+    """ A thread-safe least recently used cache, bounded by both a number of entries and an estimated memory size,
+    with entries that expire after a time to live.
+
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None, sizeof=_sizeof):
+        """ Constructs the LRUCache class.
+
+        Parameters
+        ----------
+        max_entries : int
+            The maximum number of entries held before the least recently used are evicted.
+        max_bytes : int
+            The maximum estimated size of all of the entries in bytes. None for no limit.
+        ttl : float
+            The number of seconds an entry is kept for. None for entries that never expire.
+        sizeof : callable
+            Used to estimate the size of an entry from its key and value.
+
+        """
+
+        # Sets the limits of the cache
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        # The entries of the cache, as key: (value, expiry, size), least recently used first
+        self._entries = OrderedDict()
+        # The estimated size of all of the entries
+        self._bytes = 0
+        # Lock used to guard the entries and counters
+        self._lock = threading.Lock()
+        # The statistics of the cache
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key, default=MISSING):
+        """ Gets the value of the given key, marking it as recently used.
+
+        Parameters
+        ----------
+        key : hashable
+            The key to be looked up.
+        default : object
+            The value returned if the key isn't cached.
+
+        Returns
+        -------
+        object
+            The cached value, or the default if the key isn't cached or has expired.
+
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            # Counts a miss if the key isn't cached
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            value, expiry, size = entry
+            # Drops the entry and counts a miss if it has expired
+            if expiry is not None and expiry <= time.monotonic():
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            # Marks the entry as the most recently used
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        """ Caches the given value, evicting the least recently used entries if the cache is full.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the value.
+        value : object
+            The value to be cached.
+        ttl : float
+            The time to live of this entry, overriding the cache's time to live if given.
+
+        """
+
+        ttl = self.ttl if ttl is None else ttl
+        size = self._sizeof(key, value)
+        with self._lock:
+            # Replaces any previous value of the key
+            if key in self._entries:
+                self._remove(key)
+            # Doesn't cache values that could never fit
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, None if ttl is None else time.monotonic() + ttl, size)
+            self._bytes += size
+            # Evicts the least recently used entries until the cache is within its limits
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def pop(self, key):
+        """ Removes the given key from the cache, if it is cached.
+
+        Parameters
+        ----------
+        key : hashable
+            The key to be removed.
+
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def discard(self, predicate):
+        """ Removes every entry whose key matches the given predicate.
+
+        Parameters
+        ----------
+        predicate : callable
+            Called with each key, returning True if the entry should be removed.
+
+        """
+
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        """ Removes every entry from the cache.
+
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        """ Removes the given key. Must be called while holding the lock.
+
+        """
+
+        self._bytes -= self._entries.pop(key)[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """ Gets the statistics of the cache.
+
+        Returns
+        -------
+        dict
+            The hits, misses, evictions and expirations of the cache, along with its current number of entries, its
+            estimated size in bytes and its hit rate.
+
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class DefinitionCache:
+    """ Caches the definitions of each guild in front of the defs table, including definitions that don't exist so
+    repeated misses don't reach the database either.
+
+    Each guild has an LRUCache of its own, bounded by a number of entries and an estimated memory size, so one busy
+    guild can't evict the definitions of every other guild. The guilds themselves are kept in least recently used
+    order, and only the max_guilds most recently used are kept, which bounds the memory of the whole cache at
+    max_guilds times the bound of each guild.
+
+    Every write bumps a version, so a read that raced with a write (reading the old value from the database while the
+    write committed) can't put the stale value back into the cache afterwards.
+
+    """
+
+    def __init__(self, max_entries=2000, max_bytes=512 * 1024, ttl=600, max_guilds=64):
+        """ Constructs the DefinitionCache class.
+
+        Parameters
+        ----------
+        max_entries : int
+            The maximum number of definitions held for each guild.
+        max_bytes : int
+            The maximum estimated size of the held definitions of each guild in bytes.
+        ttl : float
+            The number of seconds a definition is kept for.
+        max_guilds : int
+            The maximum number of guilds whose definitions are held.
+
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_guilds = max_guilds
+        # The cache of each guild, least recently used first
+        self._guilds = OrderedDict()
+        # The statistics of the guild caches that have been dropped, and the lookups of guilds that weren't cached
+        self._dropped = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        # Counts the writes, used to detect reads that raced with a write
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, guild):
+        """ Keeps the statistics of a guild cache that is being dropped. Must be called while holding the lock.
+
+        """
+
+        stats = guild.stats()
+        for key in self._dropped:
+            self._dropped[key] += stats[key]
+
+    def _put(self, server, command, definition):
+        """ Caches a definition, evicting the least recently used guild if too many are held. Must be called while
+        holding the lock.
+
+        """
+
+        guild = self._guilds.get(server)
+        if guild is None:
+            guild = self._guilds[server] = LRUCache(max_entries=self.max_entries, max_bytes=self.max_bytes,
+                                                    ttl=self.ttl)
+            while len(self._guilds) > self.max_guilds:
+                _, evicted = self._guilds.popitem(last=False)
+                self._drop(evicted)
+                self._dropped['evictions'] += len(evicted)
+        else:
+            self._guilds.move_to_end(server)
+        guild.put(command, definition)
+
+    def get(self, server, command):
+        """ Gets the cached definition of the given command.
+
+        Returns
+        -------
+        str, None or MISSING
+            The definition, None if the definition is known not to exist, or MISSING if it isn't cached.
+
+        """
+
+        with self._lock:
+            guild = self._guilds.get(server)
+            if guild is None:
+                self._dropped['misses'] += 1
+                return MISSING
+            self._guilds.move_to_end(server)
+        return guild.get(command)
+
+    def version(self):
+        """ Gets the current version, to be passed to fill once the definition has been read from the database.
+
+        """
+
+        with self._lock:
+            return self._version
+
+    def fill(self, server, command, definition, version):
+        """ Caches a definition that was read from the database, unless a write happened since the read started.
+
+        Parameters
+        ----------
+        server : int
+            The server id of the definition.
+        command : str
+            The command of the definition.
+        definition : str or None
+            The definition read from the database, or None if it doesn't exist.
+        version : int
+            The version from before the definition was read.
+
+        """
+
+        with self._lock:
+            if version == self._version:
+                self._put(server, command, definition)
+
+    def write(self, server, command, definition):
+        """ Writes a definition that has been committed to the database through to the cache.
+
+        """
+
+        with self._lock:
+            self._version += 1
+            self._put(server, command, definition)
+
+    def invalidate(self, server, command):
+        """ Removes a definition that has been changed or deleted in the database from the cache.
+
+        """
+
+        with self._lock:
+            self._version += 1
+            guild = self._guilds.get(server)
+            if guild is not None:
+                guild.pop(command)
+
+    def invalidate_server(self, server):
+        """ Removes every definition of the given guild from the cache, after many of them changed at once.
+
+        """
+
+        with self._lock:
+            self._version += 1
+            guild = self._guilds.pop(server, None)
+            if guild is not None:
+                self._drop(guild)
+
+    def clear(self):
+        """ Removes every definition from the cache.
+
+        """
+
+        with self._lock:
+            self._version += 1
+            for guild in self._guilds.values():
+                self._drop(guild)
+            self._guilds.clear()
+
+    def stats(self):
+        """ Gets the statistics of the cache, totalled across the guilds. See LRUCache.stats.
+
+        Returns
+        -------
+        dict
+            The statistics of LRUCache.stats, along with the number of guilds held under 'guilds'.
+
+        """
+
+        with self._lock:
+            stats = dict(self._dropped, entries=0, bytes=0, guilds=len(self._guilds))
+            guilds = list(self._guilds.values())
+        for guild in guilds:
+            for key, value in guild.stats().items():
+                if key != 'hit_rate':
+                    stats[key] += value
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -7,9 +7,17 @@ Todo
 
 """
 
+import asyncio  # Used to report the progress of imports
+import io  # Used to read and write the definition files as text
+import tempfile  # Used to hold the definition files on disk rather than in memory
+import aiohttp  # Used to download the attachments of imports
+import discord  # Used to send the exported definition files
 from discord.ext import commands  # Used to create commands for the bot to use
-import database  # Used to connect to the database
+import async_database  # Used to connect to the database without blocking the bot
+import database  # Used to read the statistics of the definition cache and to know its errors
+import defs_io  # Used to know the formats of definition files
 from settings import *  # Imports all of the settings variables
+from replies import Reply, reply  # Used to send the replies in as few messages as possible
 
 
 class Definitions:
@@ -31,6 +39,25 @@ class Definitions:
         # Sets the bot of the class to the given bot
         self.bot = bot
 
+    async def __error(self, ctx, error):
+        """ Tells the user when a command failed because of the database, rather than failing silently.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        error : discord.ext.commands.CommandError
+            The error raised by the command.
+
+        """
+
+        original = getattr(error, 'original', None)
+        if isinstance(original, database.LockedError):
+            await reply(self.bot.scheduler, ctx.message.channel, "The database is busy right now, please try again.")
+        elif isinstance(original, database.DatabaseError):
+            await reply(self.bot.scheduler, ctx.message.channel, "There was an error reaching the definitions, "
+                                                                 "please try again.")
+
     @commands.command(pass_context=True)
     async def ins_def(self, ctx, command, definition):
         """ Inserts a definition into the definition database.
@@ -50,18 +77,16 @@ class Definitions:
         guild = ctx.message.guild
         # Gets the channel from the context
         channel = ctx.message.channel
-        # Tries to insert the definition into the database, getting whether or not it was successful in doing so
-        success = database.ins_def(db_settings['path'], guild.id, command, definition, commit=True)
+        # Tries to insert the definition into the database
+        try:
+            await async_database.ins_def(db_settings['path'], guild.id, command, definition, commit=True)
+        # If the definition exists, output that the command already exists
+        except database.DuplicateError:
+            await reply(self.bot.scheduler, channel, "Definition already exists, delete the definition first or use "
+                                                     "a different keyword.")
         # If insert successful, sends a success message
-        if success:
-            # Sends a success message
-            await channel.send("Definition added!")
-        # If unsuccessful, and definition exists, output that the command already exists
-        elif not success and database.get_def(db_settings['path'], guild.id, command) is not None:
-            await channel.send("Definition already exists, delete the definition first or use a different keyword.")
-        # If unsuccessful, and definition doesn't exist, output an error occurred
         else:
-            await channel.send("There was an error inserting the definition, please try again.")
+            await reply(self.bot.scheduler, channel, "Definition added!")
 
     @commands.command(pass_context=True)
     async def get_def(self, ctx, command):
@@ -81,14 +106,23 @@ class Definitions:
         # Gets the channel from the context
         channel = ctx.message.channel
         # Gets the definition from the database
-        definition = database.get_def(db_settings['path'], guild.id, command)
+        definition = await async_database.get_def(db_settings['path'], guild.id, command)
         # Checks to see if the definition existed
         if definition is not None:
             # Sends the definition
-            await channel.send(definition)
+            await reply(self.bot.scheduler, channel, definition)
         else:
+            # Suggests the closest keywords, in case of a typo, from memory rather than from the database
+            suggestions = []
+            if def_settings['suggestions']:
+                suggestions = await async_database.suggest_defs(db_settings['path'], guild.id, command,
+                                                                limit=def_settings['suggestions'])
             # Sends an error message
-            await channel.send("That definition doesn't exist in the database.")
+            if suggestions:
+                await reply(self.bot.scheduler, channel, "That definition doesn't exist in the database. Did you mean "
+                                                         "{}?".format(", ".join(suggestions)))
+            else:
+                await reply(self.bot.scheduler, channel, "That definition doesn't exist in the database.")
 
     @commands.command(pass_context=True)
     async def del_def(self, ctx, command):
@@ -108,9 +142,244 @@ class Definitions:
         # Gets the channel from the context
         channel = ctx.message.channel
         # Removes the definition from the database
-        database.del_def(db_settings['path'], guild.id, command, commit=True)
+        try:
+            await async_database.del_def(db_settings['path'], guild.id, command, commit=True)
+        # If nothing was deleted, output that the definition doesn't exist
+        except database.NotFoundError:
+            await reply(self.bot.scheduler, channel, "That definition doesn't exist in the database.")
         # Sends a success message
-        await channel.send("Definition removed from the database!")
+        else:
+            await reply(self.bot.scheduler, channel, "Definition removed from the database!")
+
+    @commands.command(pass_context=True)
+    async def search_def(self, ctx, *, query):
+        """ Searches the definitions of the server for the given words, matching the start of the words in each
+        keyword and definition.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        query : str
+            The words to search for.
+
+        """
+
+        # Gets the guild from the context
+        guild = ctx.message.guild
+        # Gets the channel from the context
+        channel = ctx.message.channel
+        # Searches the definitions
+        results = await async_database.search_defs(db_settings['path'], guild.id, query,
+                                                   limit=def_settings['search_results'])
+        # Sends the matching keywords, with the matching part of their definitions
+        if results:
+            matches = Reply(self.bot.scheduler, channel)
+            matches.add("Definitions matching \"{}\":".format(query))
+            for command, snippet in results:
+                matches.add("**{}**: {}".format(command, snippet))
+            await matches.send()
+        else:
+            await reply(self.bot.scheduler, channel, "No definitions match \"{}\".".format(query))
+
+    @commands.command(pass_context=True)
+    async def list_defs(self, ctx, page: int = 1):
+        """ Lists the keywords of the definitions of the server, a page at a time.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        page : int
+            The page of keywords to list, starting at 1.
+
+        """
+
+        # Gets the guild from the context
+        guild = ctx.message.guild
+        # Gets the channel from the context
+        channel = ctx.message.channel
+        # Gets the number of pages, and the keywords on the requested page
+        size = def_settings['page_size']
+        total = await async_database.count_defs(db_settings['path'], guild.id)
+        pages = max(1, (total + size - 1) // size)
+        page = min(max(1, page), pages)
+        commands_on_page = await async_database.list_defs(db_settings['path'], guild.id, limit=size,
+                                                          offset=(page - 1) * size)
+        # Sends the keywords on the page
+        if commands_on_page:
+            await reply(self.bot.scheduler, channel,
+                        "Definitions (page {} of {}, {} in total):".format(page, pages, total),
+                        ", ".join(commands_on_page))
+        else:
+            await reply(self.bot.scheduler, channel, "There are no definitions in this server yet.")
+
+    @commands.command(pass_context=True)
+    @commands.has_permissions(manage_guild=True)
+    async def export_defs(self, ctx, fmt='jsonl'):
+        """ Sends every definition of the server as a file. Only usable by members who can manage the server.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        fmt : str
+            The format of the file, jsonl or csv.
+
+        """
+
+        # Gets the guild from the context
+        guild = ctx.message.guild
+        # Gets the channel from the context
+        channel = ctx.message.channel
+        fmt = fmt.lower()
+        if fmt not in defs_io.FORMATS:
+            await reply(self.bot.scheduler, channel,
+                        "Unknown format, use one of {}.".format(", ".join(defs_io.FORMATS)))
+            return
+        # Writes the definitions to a temporary file so large guilds aren't held in memory
+        with tempfile.TemporaryFile() as raw:
+            text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+            count = await async_database.export_defs(db_settings['path'], guild.id, text, fmt)
+            text.flush()
+            raw.seek(0)
+            await self.bot.scheduler.send(channel, "Exported {} definitions.".format(count),
+                                          file=discord.File(raw, filename='definitions.{}'.format(fmt)))
+            text.detach()
+
+    @commands.command(pass_context=True)
+    @commands.has_permissions(manage_guild=True)
+    async def import_defs(self, ctx, upsert: bool = False):
+        """ Inserts every definition of the attached jsonl or csv file into the server, all at once. Only usable by
+        members who can manage the server.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        upsert : bool
+            Whether definitions that already exist should be replaced. If False, they are kept.
+
+        """
+
+        # Gets the guild from the context
+        guild = ctx.message.guild
+        # Gets the channel from the context
+        channel = ctx.message.channel
+        # Checks that a definition file was attached
+        if not ctx.message.attachments:
+            await reply(self.bot.scheduler, channel, "Attach a jsonl or csv file of definitions to import.")
+            return
+        attachment = ctx.message.attachments[0]
+        fmt = defs_io.guess_format(attachment.filename)
+        if fmt is None:
+            await reply(self.bot.scheduler, channel, "The file must end in .jsonl or .csv.")
+            return
+        if attachment.size > def_settings['import_size']:
+            await reply(self.bot.scheduler, channel, "The file is too large, the limit is {} MiB.".format(
+                def_settings['import_size'] // (1024 * 1024)))
+            return
+
+        message = await self.bot.scheduler.send(channel, "Importing {}...".format(attachment.filename))
+        with tempfile.TemporaryFile() as raw:
+            # Streams the attachment to disk rather than holding it in memory
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(attachment.url) as response:
+                        # Fails on anything but the file itself, such as an expired attachment link
+                        if response.status != 200:
+                            raise aiohttp.ClientError("unexpected status {}".format(response.status))
+                        async for chunk in response.content.iter_chunked(64 * 1024):
+                            raw.write(chunk)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await self.bot.scheduler.call(('edit', channel.id), message.edit,
+                                              content="Nothing was imported, the file couldn't be downloaded.")
+                return
+            raw.seek(0)
+            text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+
+            # The import runs on a thread of its own, which counts the definitions read while this edits the message
+            read = [0]
+
+            def progress(count):
+                read[0] = count
+
+            async def report():
+                shown = 0
+                while True:
+                    await asyncio.sleep(3)
+                    if read[0] != shown:
+                        shown = read[0]
+                        await self.bot.scheduler.call(('edit', channel.id), message.edit,
+                                                      content="Importing {}... {} definitions read.".format(
+                                                          attachment.filename, shown))
+
+            reporter = asyncio.ensure_future(report())
+            try:
+                result = await async_database.import_defs(db_settings['path'], guild.id, text, fmt, upsert=upsert,
+                                                          progress=progress)
+            except (ValueError, UnicodeDecodeError) as e:
+                result = "Nothing was imported, {}.".format(e)
+            except database.DatabaseError:
+                result = "There was an error importing the definitions, nothing was imported."
+            finally:
+                reporter.cancel()
+                text.detach()
+
+        if isinstance(result, str):
+            content = result
+        elif upsert:
+            content = "Imported {} definitions, {} were added or replaced.".format(*result)
+        else:
+            content = "Imported {} definitions, {} were added and existing keywords were kept.".format(*result)
+        await self.bot.scheduler.call(('edit', channel.id), message.edit, content=content)
+
+    @commands.command(pass_context=True)
+    @commands.has_permissions(administrator=True)
+    async def cache_stats(self, ctx):
+        """ Sends the statistics of the definition cache. Only usable by server administrators.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+
+        """
+
+        # Gets the statistics of the definition cache
+        stats = database.cache_stats(db_settings['path'])
+        # Sends the statistics
+        await reply(self.bot.scheduler, ctx.message.channel,
+                    "Definition cache: {hits} hits, {misses} misses ({rate:.1%} hit rate)".format(
+                        rate=stats['hit_rate'], **stats),
+                    "{evictions} evictions, {expirations} expirations".format(**stats),
+                    "{entries} entries of {guilds} servers using {kib:.1f} KiB".format(kib=stats['bytes'] / 1024,
+                                                                                       **stats))
+
+    @commands.command(pass_context=True)
+    @commands.is_owner()
+    async def storage_stats(self, ctx):
+        """ Sends the space saved by storing the definitions of every guild once each, compressed. Only usable by the
+        owner of the bot, as it measures the definitions of every server.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+
+        """
+
+        # Measures the space used by the definitions
+        stats = await async_database.blob_stats(db_settings['path'])
+        # Sends the statistics
+        lines = ["Definition storage: {definitions} definitions stored as {blobs} texts, {compressed} compressed"
+                 .format(**stats),
+                 "{:.1f} KiB of text stored in {:.1f} KiB, saving {:.1%}".format(
+                     stats['text_bytes'] / 1024, stats['stored_bytes'] / 1024, stats['saved']),
+                 "{:.1f} KiB of free pages in the database file".format(stats['free_bytes'] / 1024)]
+        if stats['unmoved']:
+            lines.append("{unmoved} definitions are still waiting to be moved into the blob store".format(**stats))
+        await reply(self.bot.scheduler, ctx.message.channel, *lines)
 
 
 def setup(bot):
@@ -7,8 +7,41 @@ Todo
 
 """
 
+import io  # Used to send the profiles that aren't kept on disk
+import os  # Used to keep the profiles on disk
+import re  # Used to read the duration of profiles
+import discord  # Used to send the profiles as files
 from discord.ext import commands  # Used to create commands for the bot to use
 from settings import *  # Imports all of the settings variables
+from replies import Reply, reply  # Used to send the replies in as few messages as possible
+import metrics  # Used to read the measurements of the bot
+import watchdog  # Used to profile the bot
+import time  # Used to work out the uptime of the bot and name the profiles
+
+
+# The units a duration may be given in, and their number of seconds
+_UNITS = {'ms': 0.001, 's': 1, '': 1, 'm': 60}
+
+
+def parse_duration(text):
+    """ Reads a duration such as 30s, 500ms, 2m or 30 as a number of seconds.
+
+    Parameters
+    ----------
+    text : str
+        The duration to read.
+
+    Returns
+    -------
+    float
+        The number of seconds, or None if the text isn't a duration.
+
+    """
+
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(ms|s|m|)', text.strip().lower())
+    if match is None:
+        return None
+    return float(match.group(1)) * _UNITS[match.group(2)]
 
 
 class General:
@@ -29,6 +62,8 @@ class General:
 
         # Sets the bot of the class to the given bot
         self.bot = bot
+        # Whether a profile is being taken, as only one is taken at a time
+        self.profiling = False
 
     @commands.command(pass_context=True)
     async def invite(self, ctx):
@@ -42,9 +77,157 @@ class General:
         """
 
         # Sends the invite link to the live bot
-        await ctx.message.channel.send("Thank-you for your interest in {}! "
-                                       "Here is the link for the bot:\n{}".
-                                       format(self.bot.user.name, bot_settings['invite']))
+        await reply(self.bot.scheduler, ctx.message.channel, "Thank-you for your interest in {}! "
+                                                             "Here is the link for the bot:\n{}".
+                                                             format(self.bot.user.name, bot_settings['invite']))
+
+    @commands.command(pass_context=True)
+    @commands.is_owner()
+    async def queue_stats(self, ctx):
+        """ Sends the queue depth and wait times of the outbound request scheduler. Only usable by the owner of the
+        bot, as the scheduler is shared by every server.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+
+        """
+
+        # Gets the statistics of the scheduler
+        stats = self.bot.scheduler.stats()
+        stats_reply = Reply(self.bot.scheduler, ctx.message.channel)
+        stats_reply.add("Queued: {} ({}), running: {}".format(
+            stats['queued'], ", ".join("{} {}".format(k, v) for k, v in sorted(stats['depth'].items())) or "empty",
+            stats['running']))
+        # Adds the wait times of each priority
+        for priority in ('interactive', 'bulk'):
+            p = stats[priority]
+            stats_reply.add("{}: {} requests, {:.2f}s average wait, {:.2f}s max wait, {} errors".format(
+                priority.capitalize(), p['requests'], p['wait_total'] / p['requests'] if p['requests'] else 0,
+                p['wait_max'], p['errors']))
+        # Sends the statistics
+        await stats_reply.send()
+
+    @commands.command(pass_context=True)
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """ Sends a summary of the bot's measurements: the slowest commands, the database queries, the requests made
+        to discord, and the lag of the event loop. Only usable by the owner of the bot, as they cover every server.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+
+        """
+
+        def ms(seconds):
+            return "{:.1f}ms".format(seconds * 1000)
+
+        stats_reply = Reply(self.bot.scheduler, ctx.message.channel)
+        uptime = int(time.time() - metrics.REGISTRY.started)
+        stats_reply.add("Up for {}h {}m".format(uptime // 3600, uptime % 3600 // 60))
+
+        # Totals the commands, listing the slowest
+        commands_run = metrics.COMMAND_SECONDS.summary()
+        failed = sum(s['count'] for (_, status), s in commands_run.items() if status == 'error')
+        stats_reply.add("Commands: {} run, {} failed".format(sum(s['count'] for s in commands_run.values()), failed))
+        for (command, status), s in sorted(commands_run.items(), key=lambda item: -item[1]['p99'])[:5]:
+            stats_reply.add("  {}{}: {} runs, p50 {}, p99 {}".format(command, " (failed)" if status == 'error' else "",
+                                                                    s['count'], ms(s['p50']), ms(s['p99'])))
+
+        # Lists the busiest database queries
+        queries = sorted(metrics.DB_QUERY_SECONDS.summary().items(), key=lambda item: -item[1]['count'])
+        errors = sum(metrics.DB_QUERY_ERRORS.values().values())
+        stats_reply.add("Database: {} queries, {} raised".format(sum(s['count'] for _, s in queries), errors))
+        for (operation,), s in queries[:5]:
+            stats_reply.add("  {}: {} calls, p50 {}, p99 {}".format(operation, s['count'], ms(s['p50']),
+                                                                   ms(s['p99'])))
+
+        # Totals the requests made to discord by kind
+        requests = {}
+        for (route, outcome), count in metrics.API_REQUESTS.values().items():
+            requests.setdefault(route, [0, 0])[outcome == 'error'] += count
+        stats_reply.add("Discord requests: {}".format(", ".join(
+            "{} {}{}".format(route, ok, " ({} failed)".format(error) if error else "")
+            for route, (ok, error) in sorted(requests.items())) or "none"))
+
+        # Reports the lag of the event loop
+        lag = metrics.LOOP_LAG_SECONDS.summary().get((), None)
+        if lag is not None:
+            stats_reply.add("Event loop lag: p50 {}, p99 {}, max {}".format(ms(lag['p50']), ms(lag['p99']),
+                                                                           ms(lag['max'])))
+        # Reports the prompts waiting for an answer, which should stay low
+        interactions = getattr(self.bot, 'interactions', None)
+        if interactions is not None:
+            sessions = interactions.stats()
+            stats_reply.add("Prompts: {open} open, {answered} answered, {expired} expired, {replaced} replaced"
+                            .format(**sessions))
+        # Lists the recent stalls of the event loop, with the line each was stuck on
+        monitor = getattr(self.bot, 'watchdog', None)
+        if monitor is not None and monitor.stalls:
+            stalls = list(monitor.stalls)[-5:]
+            stats_reply.add("Event loop stalls: {}, the last {}:".format(
+                int(sum(watchdog.LOOP_STALLS.values().values())), len(stalls)))
+            for stall in stalls:
+                stats_reply.add("  {} for {} in {}".format(
+                    time.strftime('%H:%M:%S', time.localtime(stall.started)),
+                    ms(stall.duration) if stall.duration is not None else "ongoing", stall.where))
+        # Sends the summary
+        await stats_reply.send()
+
+    @commands.command(pass_context=True)
+    @commands.is_owner()
+    async def profile(self, ctx, duration='30s'):
+        """ Samples what the bot is running for the given time, then sends the profile as a file that flamegraph.pl
+        or speedscope can draw. Only usable by the owner of the bot, as it shows the bot's code and slows it down.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        duration : str
+            How long to profile for, such as 30s, 500ms or 2m.
+
+        """
+
+        # Gets the channel from the context
+        channel = ctx.message.channel
+        if not watchdog_settings['profiling']:
+            await reply(self.bot.scheduler, channel, "Profiling is turned off.")
+            return
+        seconds = parse_duration(duration)
+        if seconds is None or not 0 < seconds <= watchdog_settings['profile_max']:
+            await reply(self.bot.scheduler, channel, "Give a duration of up to {}s, such as 30s.".format(
+                watchdog_settings['profile_max']))
+            return
+        if self.profiling:
+            await reply(self.bot.scheduler, channel, "A profile is already being taken.")
+            return
+
+        self.profiling = True
+        try:
+            await reply(self.bot.scheduler, channel, "Profiling for {:g}s...".format(seconds))
+            # Samples the event loop's thread from a worker thread, as it's this thread that's being sampled
+            profiler = watchdog.SamplingProfiler(interval=watchdog_settings['profile_interval'])
+            profile = await self.bot.loop.run_in_executor(None, profiler.run, seconds)
+        finally:
+            self.profiling = False
+
+        name = 'profile-{}.folded'.format(time.strftime('%Y%m%d-%H%M%S'))
+        # Keeps the profile on disk, when a folder for them is given
+        if watchdog_settings['profile_dir'] is not None:
+            os.makedirs(watchdog_settings['profile_dir'], exist_ok=True)
+            await self.bot.loop.run_in_executor(None, profile.write,
+                                                os.path.join(watchdog_settings['profile_dir'], name))
+            await self.bot.loop.run_in_executor(None, watchdog.prune_profiles, watchdog_settings['profile_dir'],
+                                                watchdog_settings['profile_keep'])
+        # Sends the profile with the functions the most time was spent in
+        summary = ["{} samples over {:.1f}s, most seen in:".format(profile.samples, profile.duration)]
+        summary.extend("  {:.0%} {}".format(share, frame) for frame, share in profile.top())
+        await self.bot.scheduler.send(channel, "\n".join(summary), file=discord.File(
+            io.BytesIO(profile.collapsed().encode('utf-8')), filename=name))
 
 
 def setup(bot):
@@ -9,6 +9,18 @@ Todo
 
 from discord.ext import commands  # Used to create commands for the bot to use
 import discord  # Used for error handling
+from settings import *  # Imports all of the settings variables
+from group_registry import GroupRegistry  # Used to know the groups of each guild and their members
+import database  # Used to know the errors of the group registry
+from provisioning import Provisioner, ProvisioningError  # Used to create the parts of a group concurrently
+from scheduler import BULK  # Used to queue the group changes behind replies to users
+from replies import Reply, reply  # Used to send the replies in as few messages as possible
+import asyncio  # Used to create several groups at once
+import gzip  # Used to compress the archives of the groups
+import io  # Used to write the archives as text
+import tempfile  # Used to hold the archives on disk rather than in memory
+import membership  # Used to add roles to many users at once
+import teardown  # Used to delete and archive the parts of a group concurrently
 
 
 class Groups:
@@ -29,6 +41,159 @@ class Groups:
 
         # Sets the bot of the class to the given bot
         self.bot = bot
+        # The groups of every guild, with their members
+        self.registry = GroupRegistry(db_settings['path'])
+
+    async def __error(self, ctx, error):
+        """ Tells the user when a command failed because the group registry couldn't be reached.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        error : discord.ext.commands.CommandError
+            The error raised by the command.
+
+        """
+
+        if isinstance(getattr(error, 'original', None), database.DatabaseError):
+            await reply(self.bot.scheduler, ctx.message.channel, "There was an error reaching the groups, please try "
+                                                                 "again.")
+
+    async def on_member_update(self, before, after):
+        """ Keeps the members of the groups up to date when a member's roles change.
+
+        """
+
+        groups = self.registry.loaded(after.guild.id)
+        if groups is None:
+            return
+        before_roles = {role.id for role in before.roles}
+        after_roles = {role.id for role in after.roles}
+        for role_id in after_roles - before_roles:
+            if groups.by_role(role_id) is not None:
+                await self.registry.add_members(after.guild.id, role_id, [after.id])
+        for role_id in before_roles - after_roles:
+            if groups.by_role(role_id) is not None:
+                await self.registry.remove_members(after.guild.id, role_id, [after.id])
+
+    async def on_member_remove(self, member):
+        """ Removes a member that left the guild from its groups.
+
+        """
+
+        if self.registry.loaded(member.guild.id) is not None:
+            await self.registry.remove_members(member.guild.id, None, [member.id])
+
+    async def on_guild_role_delete(self, role):
+        """ Forgets a group when its role is deleted.
+
+        """
+
+        groups = self.registry.loaded(role.guild.id)
+        group = groups.by_role(role.id) if groups is not None else None
+        if group is not None:
+            try:
+                await self.registry.remove(role.guild.id, group.name)
+            except database.NotFoundError:
+                pass
+
+    async def register_group(self, ctx, name, results):
+        """ Adds a group that was just provisioned to the group registry, with the bot and author as its members.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        name : str
+            The name of the group.
+        results : dict
+            The role, category and channels of the group, as returned by provision_group.
+
+        """
+
+        await self.registry.add(ctx.message.guild.id, name, results['role'].id, results['category'].id,
+                                {kind: results[kind].id for kind in database.GROUP_CHANNELS},
+                                members=[ctx.me.id, ctx.message.author.id])
+
+    async def provision_group(self, ctx, name):
+        """ Creates the role, category and channels of a new group, then adds it to the group registry. The role is
+        created first, then the category and the role grants of the bot and author at the same time, then all of the
+        channels at once. If anything can't be created, or the group can't be registered, everything that was created
+        is deleted again.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        name : str
+            The name of the group.
+
+        Returns
+        -------
+        dict
+            The role, category and channels created, keyed by step name.
+
+        Raises
+        ------
+        provisioning.ProvisioningError
+            If any part of the group could not be created, or the group could not be registered.
+
+        """
+        # The guild the message was sent in
+        guild = ctx.message.guild
+        # The author of the message
+        author = ctx.message.author
+
+        def permissions(results):
+            """ Sets up the permissions to be passed to the category, locking it to the group role.
+
+            """
+
+            everyone_perm = discord.PermissionOverwrite(read_messages=False)
+            group_perm = discord.PermissionOverwrite(read_messages=True)
+            return {guild.default_role: everyone_perm, results['role']: group_perm}
+
+        # Queues every request on the scheduler as bulk work, paced per guild
+        scheduler = self.bot.scheduler
+
+        def create_role(r):
+            return scheduler.call(('create_role', guild.id), guild.create_role, name=name, mentionable=True,
+                                  priority=BULK)
+
+        def add_role(member, r):
+            return scheduler.call(('add_roles', guild.id), member.add_roles, r['role'], priority=BULK)
+
+        def create_category(r):
+            return scheduler.call(('create_channel', guild.id), guild.create_category, name,
+                                  overwrites=permissions(r), priority=BULK)
+
+        def create_channel(create, suffix, r):
+            return scheduler.call(('create_channel', guild.id), create, "{}-{}".format(name, suffix),
+                                  category=r['category'], priority=BULK)
+
+        def delete(obj):
+            return scheduler.call(('delete', guild.id), obj.delete, priority=BULK)
+
+        provisioner = Provisioner()
+        # Creates the group role
+        provisioner.add('role', create_role, undo=delete)
+        # Adds the bot and the author to the new role
+        provisioner.add('bot_role', lambda r: add_role(ctx.me, r), requires=['role'])
+        provisioner.add('author_role', lambda r: add_role(author, r), requires=['role'])
+        # Creates the category channel for the group
+        provisioner.add('category', create_category, undo=delete, requires=['role'])
+        # Creates the important text, general text and voice channels for the group
+        provisioner.add('important', lambda r: create_channel(guild.create_text_channel, 'important', r),
+                        undo=delete, requires=['category'])
+        provisioner.add('text', lambda r: create_channel(guild.create_text_channel, 'text', r),
+                        undo=delete, requires=['category'])
+        provisioner.add('voice', lambda r: create_channel(guild.create_voice_channel, 'voice', r),
+                        undo=delete, requires=['category'])
+        # Registers the group once all of it exists, so a failed registration doesn't leave it unregistered
+        provisioner.add('register', lambda r: self.register_group(ctx, name, r),
+                        requires=['bot_role', 'author_role', 'important', 'text', 'voice'])
+        return await provisioner.run()
 
     @commands.command(pass_context=True)
     async def create_group(self, ctx, name):
@@ -43,45 +208,282 @@ class Groups:
             The desired name for the group. Will be role name and prefix the chats.
 
         """
-        # The guild the message was sent in
-        guild = ctx.message.guild
-        # The author of the message
-        author = ctx.message.author
         # The channel the message was sent in
         channel = ctx.message.channel
 
         # Checks if the name only has alphabetic
-        if name.isalpha():
-            # Creates the group role
-            group_role = await guild.create_role(name=name, mentionable=True)
-            # Adds the bot to the new role
-            await ctx.me.add_roles(group_role)
-            # Adds the author to the new role
-            await author.add_roles(group_role)
-
-            # Setup the permissions to be passed to the channels
-            everyone_perm = discord.PermissionOverwrite(read_messages=False)
-            group_perm = discord.PermissionOverwrite(read_messages=True)
-            permissions = {guild.default_role: everyone_perm, group_role: group_perm}
-
-            # Creates the category channel for the group
-            category = await guild.create_category(name, overwrites=permissions)
-            # Creates the important text channel for the group
-            await guild.create_text_channel("{}-important".format(name), category=category)
-            # Creates the general text channel for the group
-            await guild.create_text_channel("{}-text".format(name), category=category)
-            # Creates the voice channel for the group
-            await guild.create_voice_channel("{}-voice".format(name), category=category)
-
-            # Send a success message after completing making the channels and role
-            await channel.send(content="The group has been successfully created.")
+        if not name.isalpha():
+            await reply(self.bot.scheduler, channel, "Use only letters as the group name.")
+            return
+        # Claims the name, refusing a group that already exists before anything is created
+        groups = await self.registry.guild(ctx.message.guild)
+        if not groups.reserve(name):
+            await reply(self.bot.scheduler, channel, "There is already a group called {}.".format(name))
+            return
+        try:
+            # Creates the role and channels and registers the group, cleaning up if any of them fails
+            try:
+                await self.provision_group(ctx, name)
+            # Exceptions in the case of the bot lacking permissions, or discord or the registry failing
+            except ProvisioningError as e:
+                await reply(self.bot.scheduler, channel, "The group could not be created ({}), nothing was "
+                                                         "kept.".format(e))
+            else:
+                # Send a success message after completing making the channels and role
+                await reply(self.bot.scheduler, channel, "The group has been successfully created.")
+        finally:
+            groups.release(name)
+
+    @commands.command(pass_context=True)
+    async def create_groups(self, ctx, *names):
+        """ Creates several groups at once, the same way as create_group. Each group is created or cleaned up on its
+        own, so one failing group doesn't stop the others. Sends a message listing which groups were created.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        names : str
+            The desired names for the groups.
+
+        """
+        # The channel the message was sent in
+        channel = ctx.message.channel
+
+        # Checks that groups were given, and that every name only has alphabetic
+        if len(names) == 0:
+            await reply(self.bot.scheduler, channel, "Please give the names of the groups to create.")
+        elif not all(name.isalpha() for name in names):
+            await reply(self.bot.scheduler, channel, "Use only letters as the group names.")
         else:
-            await channel.send(content="Use only letters as the group name.")
+            # Claims the names, leaving out the groups that already exist or are given twice
+            groups = await self.registry.guild(ctx.message.guild)
+            claimed, existing = [], []
+            for name in names:
+                (claimed if groups.reserve(name) else existing).append(name)
+            try:
+                # Creates and registers every group at once, collecting the failures rather than stopping at the first
+                results = await asyncio.gather(*[self.provision_group(ctx, name) for name in claimed],
+                                               return_exceptions=True)
+            finally:
+                for name in claimed:
+                    groups.release(name)
+            created = [name for name, result in zip(claimed, results) if not isinstance(result, Exception)]
+            failed = ["{} ({})".format(name, result) for name, result in zip(claimed, results)
+                      if isinstance(result, Exception)]
+            summary = Reply(self.bot.scheduler, channel)
+            summary.add("Created {} of {} groups.".format(len(created), len(names)))
+            if created:
+                summary.add("Created: {}".format(", ".join(created)))
+            if existing:
+                summary.add("Already exist: {}".format(", ".join(existing)))
+            if failed:
+                summary.add("Failed, nothing was kept: {}".format(", ".join(failed)))
+            await summary.send()
+
+    async def teardown_group(self, ctx, group, archive):
+        """ Deletes a group claimed from the registry, removing it from the registry once nothing of it is left. When
+        archiving, the channels are locked and their history is sent as a file first, and nothing is deleted unless
+        the archive was sent.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        group : group_registry.Group
+            The group.
+        archive : bool
+            Whether the history of the group's text channels is archived first.
+
+        Returns
+        -------
+        str
+            Why the group wasn't deleted, or None if it was.
+
+        """
+        # The guild the message was sent in
+        guild = ctx.message.guild
+        # The channel the message was sent in
+        channel = ctx.message.channel
+
+        if archive:
+            # Stops new messages being sent while the channels are read
+            failures = await teardown.lock_group(guild, group, self.bot.scheduler)
+            if failures:
+                return "could not lock {}".format(", ".join("{} ({})".format(kind, e) for kind, e in failures))
+            # Streams the history into a compressed temporary file, so long histories aren't held in memory
+            with tempfile.TemporaryFile() as raw:
+                text = io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='wb'), encoding='utf-8', newline='')
+                try:
+                    count = await teardown.archive_group(guild, group, self.bot.scheduler, text)
+                except discord.HTTPException as e:
+                    return "could not read the history ({}), the channels were locked".format(e)
+                # Compresses the end of the archive on a worker thread, like the rest of it. Closing the gzip file
+                # leaves the temporary file open
+                finally:
+                    await asyncio.get_event_loop().run_in_executor(None, text.close)
+                if raw.tell() > group_settings['archive_size']:
+                    return "the archive is {:.1f} MiB, too large to send, the channels were locked".format(
+                        raw.tell() / 1024 / 1024)
+                raw.seek(0)
+                try:
+                    await self.bot.scheduler.send(channel, "Archived {} messages of {}.".format(count, group.name),
+                                                  file=discord.File(raw, filename='{}.jsonl.gz'.format(group.name)),
+                                                  priority=BULK)
+                except discord.HTTPException as e:
+                    return "could not send the archive ({}), the channels were locked".format(e)
+        # Deletes the channels and category, then the role
+        result = await teardown.delete_group(guild, group, self.bot.scheduler)
+        if not result.ok:
+            return "could not delete {}".format(", ".join("{} ({})".format(kind, e) for kind, e in result.failed))
+        try:
+            await self.registry.remove(guild.id, group.name)
+        # Already forgotten when discord told the bot its role was deleted
+        except database.NotFoundError:
+            pass
+        return None
+
+    async def teardown_groups(self, ctx, names, archive):
+        """ Deletes the groups with the given names at the same time, archiving them first if asked to. Each group is
+        deleted on its own, so one failing group doesn't stop the others. Sends a message saying which groups were
+        deleted.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        names : list
+            The names of the groups.
+        archive : bool
+            Whether the history of the groups' text channels is archived first.
+
+        """
+        # The channel the message was sent in
+        channel = ctx.message.channel
+
+        if len(names) == 0:
+            await reply(self.bot.scheduler, channel, "Please give the names of the groups to {}.".format(
+                "archive" if archive else "delete"))
+            return
+        # Claims the groups, so they aren't deleted twice at once
+        groups = await self.registry.guild(ctx.message.guild)
+        claimed, unknown, inside = [], [], []
+        for name in names:
+            group = groups.claim(name)
+            if group is None:
+                unknown.append(name)
+            # The reply would be sent to a channel being deleted
+            elif channel.id in group.channels.values():
+                groups.release(name)
+                inside.append(group.name)
+            else:
+                claimed.append(group)
+        try:
+            results = await asyncio.gather(*[self.teardown_group(ctx, group, archive) for group in claimed])
+        finally:
+            for group in claimed:
+                groups.release(group.name)
+        # A single group gets a single line
+        if len(names) == 1:
+            if unknown:
+                message = "There is no group called {}, or it is already being deleted.".format(names[0])
+            elif inside:
+                message = "The group can't be deleted from one of its own channels."
+            elif results[0] is not None:
+                message = "The group could not be fully deleted ({}), run the command again to retry.".format(
+                    results[0])
+            else:
+                message = "The group has been successfully {}.".format("archived and deleted" if archive else
+                                                                        "deleted")
+            await reply(self.bot.scheduler, channel, message)
+            return
+        deleted = [group.name for group, error in zip(claimed, results) if error is None]
+        failed = ["{} ({})".format(group.name, error) for group, error in zip(claimed, results) if error is not None]
+        summary = Reply(self.bot.scheduler, channel)
+        summary.add("{} {} of {} groups.".format("Archived and deleted" if archive else "Deleted", len(deleted),
+                                                 len(names)))
+        if deleted:
+            summary.add("Deleted: {}".format(", ".join(deleted)))
+        if unknown:
+            summary.add("No such group, or already being deleted: {}".format(", ".join(unknown)))
+        if inside:
+            summary.add("Can't be deleted from one of their own channels: {}".format(", ".join(inside)))
+        if failed:
+            summary.add("Not fully deleted, run the command again to retry: {}".format(", ".join(failed)))
+        await summary.send()
+
+    @commands.command(pass_context=True)
+    @commands.has_permissions(manage_channels=True, manage_roles=True)
+    async def delete_group(self, ctx, name):
+        """ Deletes a group's role, category and channels, all at once. Only usable by members who can manage the
+        server's channels and roles.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        name : str
+            The name of the group.
+
+        """
+
+        await self.teardown_groups(ctx, [name], archive=False)
+
+    @commands.command(pass_context=True)
+    @commands.has_permissions(manage_channels=True, manage_roles=True)
+    async def delete_groups(self, ctx, *names):
+        """ Deletes several groups at once, the same way as delete_group.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        names : str
+            The names of the groups.
+
+        """
+
+        await self.teardown_groups(ctx, names, archive=False)
+
+    @commands.command(pass_context=True)
+    @commands.has_permissions(manage_channels=True, manage_roles=True)
+    async def archive_group(self, ctx, name):
+        """ Locks a group's channels, sends the history of its text channels as a compressed JSON Lines file, then
+        deletes the group. The group is only deleted once its archive has been sent. Only usable by members who can
+        manage the server's channels and roles.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        name : str
+            The name of the group.
+
+        """
+
+        await self.teardown_groups(ctx, [name], archive=True)
+
+    @commands.command(pass_context=True)
+    @commands.has_permissions(manage_channels=True, manage_roles=True)
+    async def archive_groups(self, ctx, *names):
+        """ Archives and deletes several groups at once, the same way as archive_group.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+        names : str
+            The names of the groups.
+
+        """
+
+        await self.teardown_groups(ctx, names, archive=True)
 
     @commands.command(pass_context=True)
     async def add_to_group(self, ctx):
-        """ Adds the given group role to the users mentioned. Must already have the role in order to add the users to it.
-        Sends a message to the channel that the command was sent through saying whether the command was successful.
+        """ Adds the given group roles to the users mentioned. Must already have the roles in order to add the users to
+        them. The users are added concurrently, and a user that can't be added doesn't stop the others.
+        Sends a message to the channel that the command was sent through saying which users were added.
 
         Parameters
         ----------
@@ -93,29 +495,51 @@ class Groups:
         author = ctx.message.author
         # Gets the channel the message was send in
         channel = ctx.message.channel
-        # Checks to see that only 1 role was mentioned
-        if len(ctx.message.role_mentions) != 1:
-            await channel.send(content="Please mention the role (only 1 role) that you would like to add the users to.")
-        # Checks to see if the role mentioned is in the user's role list
-        elif ctx.message.role_mentions[0] not in author.roles:
-            await channel.send(content="You must belong to the role in order to add users to it.")
+        # Gets the roles mentioned
+        roles = ctx.message.role_mentions
+        # Gets the groups of the guild, to check the members of the group roles without going through their roles
+        groups = await self.registry.guild(ctx.message.guild)
+
+        def has_role(member, role):
+            if groups.by_role(role.id) is not None:
+                return groups.is_member(role.id, member.id)
+            return role in member.roles
+
+        # Checks to see that at least 1 role was mentioned
+        if len(roles) < 1:
+            await reply(self.bot.scheduler, channel, "Please mention the roles that you would like to add the users "
+                                                     "to.")
+        # Checks to see if the roles mentioned are in the user's role list
+        elif not all(has_role(author, role) for role in roles):
+            await reply(self.bot.scheduler, channel, "You must belong to the roles in order to add users to them.")
         # Checks to see if the user mentioned any users
         elif len(ctx.message.mentions) < 1:
-            await channel.send(content="Please mention the users that you would like to have added to the role.")
-        # Adds the users to the given role, as all security checks have passed
+            await reply(self.bot.scheduler, channel, "Please mention the users that you would like to have added to "
+                                                     "the roles.")
+        # Adds the users to the given roles, as all security checks have passed
         else:
-            # Try to add the users to the role
-            try:
-                # Loops through all the users
-                for user in ctx.message.mentions:
-                    # Checks if the user is already in the role
-                    if ctx.message.role_mentions[0] not in user.roles:
-                        # Adds the role to the user
-                        await user.add_roles(ctx.message.role_mentions[0])
-                await channel.send(content="The given users have been successfully added to the given role.")
-            # Exceptions in the case of the bot not having permissions
-            except discord.Forbidden:
-                await channel.send(content="I don't have permissions to give user roles.")
+            # Adds the roles to every user at once, within the rate limits
+            results = await membership.add_roles(ctx.message.mentions, roles, self.bot.scheduler, has_role=has_role)
+            # Records the new members of the groups
+            for role in roles:
+                if groups.by_role(role.id) is not None:
+                    await self.registry.add_members(ctx.message.guild.id, role.id,
+                                                    [r.member.id for r in results if r.ok and role in r.changed])
+            added = [r for r in results if r.ok and r.changed]
+            already = [r for r in results if r.ok and not r.changed]
+            failed = [r for r in results if not r.ok]
+            summary = Reply(self.bot.scheduler, channel)
+            summary.add("Added {} users to the given roles.".format(len(added)))
+            if already:
+                summary.add("{} users already had them.".format(len(already)))
+            # Lists the users that couldn't be added and why
+            if failed:
+                reasons = ["{} ({})".format(r.member.display_name,
+                                            "I don't have permissions to give user roles"
+                                            if isinstance(r.error, discord.Forbidden) else r.error)
+                           for r in failed]
+                summary.add("Could not add: {}".format(", ".join(reasons)))
+            await summary.send()
 
 
 def setup(bot):
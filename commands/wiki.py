@@ -8,8 +8,15 @@ Todo
 """
 
 from discord.ext import commands  # Used to create commands for the bot to use
-import discord  # Used for error handling
-import wikipedia  # Wikipedia library
+from wiki_client import WikiClient  # Used to search wikipedia without blocking the bot
+from wiki_cache import WikiCache  # Used to avoid repeating lookups of popular subjects
+from wiki_abstracts import OfflineWikiClient  # Used to answer the lookups from the offline abstracts
+from settings import *  # Imports all of the settings variables
+from replies import Reply, reply  # Used to send the replies in as few messages as possible
+from interactions import SessionReplaced  # Used to stop waiting when the user asks for something else
+import asyncio  # Used for timeout handling
+import logging  # Used to log why the offline abstracts couldn't be used
+
 
 class Wiki:
     """ Commands that are used to search Wikipedia.
@@ -17,17 +24,46 @@ class Wiki:
     """
 
     def __init__(self, bot):
-         """ Constructs the Wiki class, adding the commands to the given bot.
+        """ Constructs the Wiki class, adding the commands to the given bot.
+
+        Parameters
+        ----------
+        bot : discord.ext.commands.Bot
+            The bot to have the commands added to.
+
+        """
 
-         Parameters
-         ----------
-         bot : discord.ext.commands.Bot
-             The bot to have the commands added to.
+        # Sets the bot of the class to the given bot
+        self.bot = bot
+        # Whether the lookups are answered from the offline abstracts rather than by calling wikipedia
+        self.offline = wiki_settings['backend'] == 'offline'
+        # The client used for every lookup, shared between guilds so the concurrency bound applies to all of them
+        self.client = None
+        if self.offline:
+            try:
+                self.client = OfflineWikiClient(wiki_settings['abstracts_path'],
+                                                max_options=wiki_settings['max_options'])
+            # Calls wikipedia instead when the abstracts are missing or can't be read, rather than losing the commands
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).error(
+                    "offline wikipedia abstracts unusable, falling back to the live backend path=%s detail=%r; build "
+                    "them with python wiki_cli.py build <dump> --output %s", wiki_settings['abstracts_path'], str(e),
+                    wiki_settings['abstracts_path'])
+                self.offline = False
+        if self.client is None:
+            self.client = WikiClient(max_concurrency=wiki_settings['max_concurrency'],
+                                     timeout=wiki_settings['timeout'],
+                                     max_options=wiki_settings['max_options'],
+                                     cache=WikiCache(max_entries=wiki_settings['cache_entries'],
+                                                     ttl=wiki_settings['cache_ttl'], path=wiki_settings['cache_path'],
+                                                     max_rows=wiki_settings['cache_rows']))
+
+    def __unload(self):
+        """ Stops the wikipedia client, or unmaps the offline abstracts, when the extension is unloaded.
 
-         """
+        """
 
-         # Sets the bot of the class to the given bot
-         self.bot = bot
+        self.client.close()
 
     @commands.command(pass_context=True)
     async def wiki(self, ctx, subject):
@@ -45,30 +81,77 @@ class Wiki:
         # The channel the message was sent in
         channel = ctx.message.channel
 
-        search = wikipedia.search(subject)
+        # Finds the options for the subject, resolving the candidates concurrently
+        try:
+            options = await self.client.options(subject)
+        # Lets the user know if wikipedia didn't respond in time
+        except asyncio.TimeoutError:
+            await reply(self.bot.scheduler, channel, "Wikipedia took too long to respond, please try again.")
+            return
 
+        if len(options) != 0:
+            # The numbers the user can choose from
+            choices = [str(i+1) for i in range(len(options))]
 
-        i = 0
-        while i < 4 and i in range(len(search)):
-            try:
-                wiki = wikipedia.summary(search[i])
-            except wikipedia.DisambiguationError:
-                search.remove(search[i])
-            else:
-                if i == 0:
-                    await channel.send("Please Specify an Option:")
-                await channel.send(content="{}: {}".format(i+1, search[i]))
-                i += 1
-
-        if len(search) != 0:
             def check(m):
-                return len(m.content) == 1 and m.content in '1234' and m.channel == channel
+                return m.content in choices
+
+            # Waits for the author's choice, listening before the options are sent so a quick answer isn't missed
+            with self.bot.interactions.open(channel, ctx.message.author, check=check) as session:
+                # Sends the options as a single message
+                prompt = Reply(self.bot.scheduler, channel)
+                prompt.add("Please Specify an Option:")
+                for i, (title, url) in enumerate(options):
+                    prompt.add("{}: {}".format(i+1, title))
+                await prompt.send()
+                try:
+                    msg = await session.wait()
+                # Lets the user know the options are no longer open
+                except asyncio.TimeoutError:
+                    await reply(self.bot.scheduler, channel, "No option was picked in time, please search again.")
+                    return
+                # Gives up quietly when the user searched for something else
+                except SessionReplaced:
+                    return
+
+            # The url was already found while resolving the options
+            title, url = options[int(msg.content)-1]
+            # The offline abstracts also have the summary of the page, read without waiting on anything
+            summary = await self.client.summary(title) if self.offline else None
+            await reply(self.bot.scheduler, channel, *([url, summary] if summary else [url]))
+        else:
+            await reply(self.bot.scheduler, channel, "Sorry I couldn't find anything")
 
-            msg = await self.bot.wait_for('message', check=check)
+    @commands.command(pass_context=True)
+    @commands.is_owner()
+    async def wiki_stats(self, ctx):
+        """ Sends the statistics of the wikipedia cache, or of the offline abstracts. Only usable by the owner of the
+        bot, as the cache is shared by every server.
+
+        Parameters
+        ----------
+        ctx : discord.ext.commands.Context
+            The context of the message.
+
+        """
+
+        if self.offline:
+            stats = self.client.index.stats()
+            await reply(self.bot.scheduler, ctx.message.channel,
+                        "Offline abstracts: {} articles, {} searches, {} articles read".format(
+                            stats['count'], stats['searches'], stats['articles']),
+                        "Mapped: {:.1f} MiB index, {:.1f} MiB articles".format(stats['index_bytes'] / 1024 / 1024,
+                                                                               stats['data_bytes'] / 1024 / 1024))
+            return
+        # Gets the statistics of the wikipedia cache
+        stats = self.client.cache.stats()
+        # Sends the statistics
+        await reply(self.bot.scheduler, ctx.message.channel,
+                    "Wikipedia cache: {:.1%} hit rate".format(stats['hit_rate']),
+                    "Memory: {hits} hits, {misses} misses, {evictions} evictions, {entries} entries"
+                    .format(**stats['memory']),
+                    "Disk: {hits} hits, {misses} misses, {pruned} pruned".format(**stats['disk']))
 
-            await channel.send(content=wikipedia.page(search[int(msg.content)-1]).url)
-        else:
-            await channel.send(content="Sorry I couldn't find anything")
 
 def setup(bot):
     """ Used to import the commands for use in the given bot.
@@ -81,4 +164,4 @@ def setup(bot):
     """
 
     # Adds the commands to the bot
-    bot.add_cog(Wiki(bot))
\ No newline at end of file
+    bot.add_cog(Wiki(bot))
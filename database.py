@@ -8,7 +8,79 @@ Example:
     with connect(path, commit=True) as cursor:
         # Use the cursor here
 
-    The connection will automatically close when you leave the with block.
+    The connection will automatically be returned to the pool when you leave the with block.
+
+Connection Pooling
+------------------
+Connections are not opened and closed per call. Each database path gets its own ConnectionPool, which keeps a small
+number of long-lived connections open, each with the pragmas given by storage.bootstrap. Every connection caches its
+prepared statements, so the sql used by the helpers below is only parsed once per connection. A connection is only ever
+checked out to one caller at a time, so the pool can be used from the bot's event loop and from worker threads alike.
+Pool statistics can be read through pool_stats.
+
+Definition Cache
+----------------
+get_def answers from an in-memory DefinitionCache per database before going to disk, including remembering
+definitions that don't exist. Each guild's definitions are bounded on their own, so a busy guild can't push out the
+definitions of the others. Committed inserts are written through to the cache and committed deletes remove the
+definition from it, so the cache never serves a definition that has been changed through these functions. Its limits
+are set with configure_cache and its statistics can be read through cache_stats.
+
+Definition Storage
+------------------
+The text of each definition is kept in the blobs table rather than in defs, addressed by the sha256 of its text, so a
+definition stored by many guilds, such as a common list of links, is only stored once. Texts longer than the
+compression threshold set with configure_blobs are compressed with zlib, when that makes them smaller. Each blob counts
+the definitions using it, kept up to date by the same triggers as the search index, and is deleted along with the last
+of them. The text is hashed and compressed before the write transaction starts, so the write lock isn't held any
+longer than before.
+
+Databases made before the blobs table existed keep their definitions in the def column of defs, and defs.blob is NULL
+for them. Every read accepts both, so migrate_blobs can move them into the blobs table a batch at a time while the bot
+runs, and blob_stats reports the space saved.
+
+Suggestions
+-----------
+suggest_defs finds the keywords of a guild closest to one that doesn't exist, from an in-memory trigram index of the
+guild's keywords (see keywords.py). A guild's index is read from the defs table the first time it is needed, and kept
+up to date by the same committed inserts and deletes that keep the definition cache up to date.
+
+Definition Search
+-----------------
+The defs table is indexed by the contentless defs_fts FTS5 table, which triggers keep in sync on every insert, update
+and delete. Every word is indexed with the server id in front of it (g<server>x<word>), so the index entries of each
+guild are separate and a search for a common word only reads its own guild's entries rather than those of every guild.
+The words are prefixed by the guild_terms sql function, which every pooled connection registers, so the defs table can
+only be changed through connections made by this file. The index is created by the migrations in storage.py, or by
+ensure_search_index for databases that aren't bootstrapped. The index follows the rowids of defs, so it must be rebuilt
+with rebuild_search_index if the database is ever vacuumed.
+
+Write Batching
+--------------
+Every commit waits for sqlite to fsync the database, which limits the number of separate writes per second no matter
+how small they are. run_batch runs many inserts and deletes in a single transaction, so they share one commit. Each
+operation runs inside its own savepoint, so one failing, such as inserting a keyword that already exists, only undoes
+that operation and the rest of the batch still commits.
+
+Group Registry
+--------------
+The groups made by the group commands are kept in the groups table, with the ids of their role, category and channels,
+and the members of each group's role in the group_members table. They are read a guild at a time by get_groups, and
+kept in memory by group_registry.GroupRegistry.
+
+Errors
+------
+Failures are raised as a DatabaseError subclass rather than returned, and are logged with the database, the kind of
+failure and sqlite's error code:
+    DuplicateError if a definition or group being inserted already exists.
+    NotFoundError if a definition or group being deleted doesn't exist.
+    LockedError if the database stayed locked by another connection for longer than the busy timeout.
+    CorruptError if the database file is damaged or isn't a database.
+    DatabaseError for any other failure of sqlite.
+The transaction is rolled back before the error is raised, so the connection returns to the pool clean.
+
+Every helper below, apart from iter_defs and migrate_blobs, is timed by metrics.timed_query under its own name. The
+batches of migrate_blobs are timed as migrate_blobs.
 
 Todo
 ----
@@ -16,13 +88,498 @@ Todo
 
 """
 from contextlib import contextmanager  # Used to simplify connecting to the database
+from cache import DefinitionCache, MISSING  # Used to cache definitions in front of the defs table
+from keywords import KeywordIndex  # Used to suggest the definitions closest to ones that don't exist
+import hashlib  # Used to address the stored definitions by their content
+import logging  # Used to log the failures of queries
+import metrics  # Used to time the queries
+import queue  # Used to hold the idle connections of a pool
+import re  # Used to split search queries into terms
 import sqlite3  # Used to connect to the database
+import threading  # Used to make the pools safe to use across threads
+import time  # Used to pause between the batches of the blob migration
+import zlib  # Used to compress the long definitions
+
+
+# The number of connections a pool will hold open when no size is given
+DEFAULT_POOL_SIZE = 5
+# The number of prepared statements each pooled connection will keep cached
+DEFAULT_CACHED_STATEMENTS = 128
+
+# The pools that have been created, keyed by the path of their database
+_pools = {}
+# Lock used to make sure only one pool is ever created per path
+_pools_lock = threading.Lock()
+# The definition caches that have been created, keyed by the path of their database
+_caches = {}
+# The keyword indexes that have been created, keyed by the path of their database
+_keyword_indexes = {}
+# The compression settings of the blobs of each database, as (threshold, level), keyed by the path of the database
+_blob_settings = {}
+
+# The number of bytes above which a definition is compressed, and the zlib level used, when none are configured
+DEFAULT_COMPRESS_ABOVE = 512
+DEFAULT_COMPRESS_LEVEL = 6
+# How the data of a blob is stored
+CODEC_TEXT = 0  # The text encoded as utf-8
+CODEC_ZLIB = 1  # The text encoded as utf-8, compressed with zlib
+
+# The logger of the database
+log = logging.getLogger(__name__)
+
+# The sqlite result codes of a lock that couldn't be taken, and of a damaged database, without their extended codes
+_LOCKED_CODES = (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED
+_CORRUPT_CODES = (11, 26)  # SQLITE_CORRUPT, SQLITE_NOTADB
+
+
+class DatabaseError(Exception):
+    """ Raised when a query on the database fails.
+
+    """
+
+    def __init__(self, message, original=None):
+        """ Constructs the DatabaseError class.
+
+        Parameters
+        ----------
+        message : str
+            The description of the failure.
+        original : sqlite3.Error
+            The error raised by sqlite, if there was one.
+
+        """
+
+        super().__init__(message)
+        self.original = original
+
+
+class DuplicateError(DatabaseError):
+    """ Raised when a definition being inserted already exists.
+
+    """
+
+
+class NotFoundError(DatabaseError):
+    """ Raised when a definition being changed doesn't exist.
+
+    """
+
+
+class LockedError(DatabaseError):
+    """ Raised when the database stays locked by another connection for longer than the busy timeout.
+
+    """
+
+
+class CorruptError(DatabaseError):
+    """ Raised when the database file is damaged or isn't a database.
+
+    """
+
+
+def _translate(e):
+    """ Converts an error raised by sqlite into the matching DatabaseError.
+
+    Parameters
+    ----------
+    e : sqlite3.Error
+        The error raised by sqlite.
+
+    Returns
+    -------
+    DatabaseError
+        The matching error.
+
+    """
+
+    # Uses the result code where python exposes it, and the message where it doesn't
+    code = getattr(e, 'sqlite_errorcode', None)
+    code = code & 0xff if code is not None else None
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError) and 'UNIQUE' in message:
+        return DuplicateError(message, e)
+    if code in _LOCKED_CODES or 'locked' in message or 'timed out waiting' in message:
+        return LockedError(message, e)
+    if code in _CORRUPT_CODES or 'malformed' in message or 'not a database' in message:
+        return CorruptError(message, e)
+    return DatabaseError(message, e)
+
+
+class ConnectionPool:
+    """ A pool of long-lived connections to a single sqlite database.
+
+    Connections are opened lazily, up to the size of the pool. When every connection is checked out, callers wait for
+    one to be released rather than opening a new one.
+
+    """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE, cached_statements=DEFAULT_CACHED_STATEMENTS, timeout=None,
+                 pragmas=None):
+        """ Constructs the ConnectionPool class.
+
+        Parameters
+        ----------
+        path : str
+            The path to the database.
+        size : int
+            The maximum number of connections the pool will hold open.
+        cached_statements : int
+            The number of prepared statements each connection will keep cached.
+        timeout : float
+            The number of seconds to wait for a free connection before giving up. None waits forever.
+        pragmas : dict
+            The pragmas set on every connection when it is opened, as name: value.
+
+        """
+
+        # Sets the settings of the pool
+        self.path = path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.pragmas = dict(pragmas or {})
+        # The connections that are open and not checked out, most recently used first
+        self._idle = queue.LifoQueue()
+        # Every connection the pool has opened
+        self._connections = []
+        # Lock used to guard the counters and the connection list
+        self._lock = threading.Lock()
+        # The statistics of the pool
+        self._stats = {'checkouts': 0, 'waits': 0, 'opens': 0, 'in_use': 0}
+        # Whether the pool has been closed
+        self._closed = False
+
+    def _open(self):
+        """ Opens a new connection to the database of the pool.
+
+        Returns
+        -------
+        sqlite3.Connection
+            The newly opened connection.
+
+        """
+
+        # Opens the connection, allowing it to be handed between threads as only one caller holds it at a time
+        db = sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.cached_statements)
+        # Registers the functions used by the triggers keeping the search index and the blobs in sync
+        db.create_function('guild_terms', 2, guild_terms)
+        db.create_function('blob_text', 2, blob_text, deterministic=True)
+        # Sets the pragmas of the connection, such as its page cache size
+        for name, value in self.pragmas.items():
+            db.execute('PRAGMA {}={};'.format(name, value))
+        return db
+
+    def acquire(self):
+        """ Checks a connection out of the pool, opening a new one if the pool is not full yet, or waiting for one to
+        be released if it is.
+
+        Returns
+        -------
+        sqlite3.Connection
+            The connection that has been checked out.
+
+        """
+
+        # Tries to reuse an idle connection first
+        try:
+            db = self._idle.get_nowait()
+        # Opens a new connection, or waits for one, when no connection is idle
+        except queue.Empty:
+            with self._lock:
+                # Reserves a slot for a new connection if the pool is not full yet
+                can_open = len(self._connections) < self.size
+                if can_open:
+                    self._connections.append(None)
+                else:
+                    self._stats['waits'] += 1
+            # Opens the new connection outside of the lock
+            if can_open:
+                try:
+                    db = self._open()
+                # Gives the reserved slot back if the connection could not be opened
+                except sqlite3.Error:
+                    with self._lock:
+                        self._connections.remove(None)
+                    raise
+                with self._lock:
+                    self._connections[self._connections.index(None)] = db
+                    self._stats['opens'] += 1
+            # Waits for another caller to release a connection
+            else:
+                try:
+                    db = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("timed out waiting for a connection to {}".format(self.path))
+        # Records the checkout
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+        return db
+
+    def release(self, db):
+        """ Returns a connection to the pool so that it can be used by the next caller.
+
+        Parameters
+        ----------
+        db : sqlite3.Connection
+            The connection to be returned.
+
+        """
+
+        # Records the connection is no longer in use
+        with self._lock:
+            self._stats['in_use'] -= 1
+            closed = self._closed
+            if closed:
+                self._connections.remove(db)
+        # Closes the connection if the pool has been closed while it was checked out
+        if closed:
+            db.close()
+        # Puts the connection back with the idle connections
+        else:
+            self._idle.put(db)
+
+    def set_pragmas(self, pragmas):
+        """ Changes the pragmas of the pool, setting them on the idle connections straight away and on new
+        connections when they are opened. Connections that are checked out keep their pragmas until they are closed.
+
+        Parameters
+        ----------
+        pragmas : dict
+            The pragmas set on every connection, as name: value.
+
+        """
+
+        self.pragmas = dict(pragmas)
+        # Takes the idle connections out of the pool, so no one uses them while their pragmas change
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        # Sets the pragmas of each one, before putting them back
+        for db in reversed(idle):
+            for name, value in self.pragmas.items():
+                db.execute('PRAGMA {}={};'.format(name, value))
+            self._idle.put(db)
+
+    def stats(self):
+        """ Gets the statistics of the pool.
+
+        Returns
+        -------
+        dict
+            The number of checkouts, waits for a free connection, and connections opened, along with the number of
+            connections currently open and in use.
+
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = len([db for db in self._connections if db is not None])
+        return stats
+
+    def close(self):
+        """ Closes every idle connection held by the pool. Connections that are checked out are closed as soon as
+        they are released.
+
+        """
+
+        # Marks the pool as closed so released connections are closed too
+        with self._lock:
+            self._closed = True
+        # Closes the idle connections until none are left
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            db.close()
+            with self._lock:
+                self._connections.remove(db)
+
+
+def get_pool(path, size=None, pragmas=None):
+    """ Gets the connection pool of the given database, creating it if it doesn't exist yet.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    size : int
+        The maximum number of connections for the pool. Only used if the pool has to be created.
+    pragmas : dict
+        The pragmas set on every connection of the pool. Only used if the pool has to be created.
+
+    Returns
+    -------
+    ConnectionPool
+        The pool of the database.
+
+    """
+
+    with _pools_lock:
+        # Creates the pool the first time the database is used
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path, size=size or DEFAULT_POOL_SIZE, pragmas=pragmas)
+        return _pools[path]
+
+
+def pool_stats(path=None):
+    """ Gets the statistics of the connection pools.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database to get the pool statistics of. If None, the statistics of every pool are returned.
+
+    Returns
+    -------
+    dict
+        The statistics of the pool, or a dict of statistics keyed by path if no path was given.
+
+    """
+
+    if path is not None:
+        return get_pool(path).stats()
+    with _pools_lock:
+        pools = dict(_pools)
+    return {p: pool.stats() for p, pool in pools.items()}
+
+
+def close_pools():
+    """ Closes the idle connections of every pool, and forgets the pools. Used when shutting down the bot.
+
+    """
+
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def configure_cache(path, max_entries=2000, max_bytes=512 * 1024, ttl=600, max_guilds=64):
+    """ Sets up the definition cache of the given database, replacing any existing cache.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    max_entries : int
+        The maximum number of definitions held for each guild, including definitions remembered as not existing.
+    max_bytes : int
+        The maximum estimated memory used by the held definitions of each guild in bytes.
+    ttl : float
+        The number of seconds a definition is cached for.
+    max_guilds : int
+        The maximum number of guilds whose definitions are held.
+
+    """
+
+    with _pools_lock:
+        _caches[path] = DefinitionCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, max_guilds=max_guilds)
+
+
+def get_cache(path):
+    """ Gets the definition cache of the given database, creating it with the default limits if it doesn't exist yet.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    Returns
+    -------
+    cache.DefinitionCache
+        The definition cache of the database.
+
+    """
+
+    with _pools_lock:
+        if path not in _caches:
+            _caches[path] = DefinitionCache()
+        return _caches[path]
+
+
+def configure_keyword_index(path, max_guilds=256):
+    """ Sets up the keyword index of the given database, replacing any existing index.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    max_guilds : int
+        The maximum number of guilds whose keywords are kept in memory.
+
+    """
+
+    with _pools_lock:
+        _keyword_indexes[path] = KeywordIndex(max_guilds=max_guilds)
+
+
+def get_keyword_index(path):
+    """ Gets the keyword index of the given database, creating it with the default limits if it doesn't exist yet.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    Returns
+    -------
+    keywords.KeywordIndex
+        The keyword index of the database.
+
+    """
+
+    with _pools_lock:
+        if path not in _keyword_indexes:
+            _keyword_indexes[path] = KeywordIndex()
+        return _keyword_indexes[path]
+
+
+def configure_blobs(path, compress_above=DEFAULT_COMPRESS_ABOVE, level=DEFAULT_COMPRESS_LEVEL):
+    """ Sets how the definitions stored in the blobs table of the given database are compressed.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    compress_above : int
+        The number of bytes above which a definition is compressed.
+    level : int
+        The zlib compression level, from 1 (fastest) to 9 (smallest).
+
+    """
+
+    with _pools_lock:
+        _blob_settings[path] = (compress_above, level)
+
+
+def cache_stats(path):
+    """ Gets the statistics of the definition cache of the given database.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    Returns
+    -------
+    dict
+        The hits, misses, evictions, expirations, entries, bytes and hit rate of the cache.
+
+    """
+
+    return get_cache(path).stats()
 
 
 @contextmanager
 def connect(path, commit=False):
-    """ Connects to the database, yielding a cursor to use during the connection, and closing the connection when
-    finished.
+    """ Checks a connection out of the database's pool, yielding a cursor to use during the connection, and returning
+    the connection to the pool when finished.
 
     Parameters
     ----------
@@ -31,35 +588,65 @@ def connect(path, commit=False):
     commit : bool
         Whether or not changes should be committed.
 
+    Raises
+    ------
+    DatabaseError
+        If sqlite fails, as the subclass matching the failure. See Errors above.
+
     """
-    # Tries to open the connection
+    # Gets the pool of the database
+    pool = get_pool(path)
+    # Checks a connection out of the pool
+    try:
+        db = pool.acquire()
+    except sqlite3.Error as e:
+        error = _translate(e)
+        log.error("connection failed path=%s error=%s detail=%r", path, type(error).__name__, str(e))
+        raise error from e
+    # Tries to use the connection
     try:
-        # Opens the connection
-        db = sqlite3.connect(path)
         # Creates the cursor
         cursor = db.cursor()
         # Yields the cursor for use outside of the function
         yield cursor
-    # Excepts any errors generated by sqlite3
+    # Excepts any errors generated by sqlite3, raising them as the matching DatabaseError
     except sqlite3.Error as e:
-        # Prints the error
-        print(e)
+        # Rolls back so the next user of the connection doesn't inherit a broken transaction
+        db.rollback()
+        error = _translate(e)
+        # Duplicates are expected, the rest are failures
+        log.log(logging.DEBUG if isinstance(error, DuplicateError) else logging.ERROR,
+                "query failed path=%s error=%s code=%s detail=%r", path, type(error).__name__,
+                getattr(e, 'sqlite_errorname', None), str(e))
+        raise error from e
+    # Rolls back on any other error before letting it through, for the same reason
+    except BaseException:
+        db.rollback()
+        raise
     # If there were no errors, checks if a commit or rollback should occur
     else:
         # If commits should occur
         if commit:
-            # Commits the database
-            db.commit()
+            # Commits the database, rolling back if the commit fails so the connection goes back to the pool clean
+            try:
+                db.commit()
+            except sqlite3.Error as e:
+                db.rollback()
+                error = _translate(e)
+                log.error("commit failed path=%s error=%s code=%s detail=%r", path, type(error).__name__,
+                          getattr(e, 'sqlite_errorname', None), str(e))
+                raise error from e
         # if commits should not occur
         else:
             # Rolls the database back
             db.rollback()
-    # Finishes the try block by closing the connection
+    # Finishes the try block by returning the connection to the pool
     finally:
-        # Closes the connection
-        db.close()
+        # Returns the connection to the pool
+        pool.release(db)
 
 
+@metrics.timed_query('sql_execute')
 def sql_execute(path, sql, commit=False):
     """ Executes the given sql, returning the cursor.
 
@@ -77,10 +664,17 @@ def sql_execute(path, sql, commit=False):
     with connect(path, commit=commit) as c:
         # Executes the given sql
         c.execute(sql)
-        # Returns the cursor results
-        return c.fetchall()
+        # Gets the cursor results
+        results = c.fetchall()
+    # Clears the definition cache and keyword index, as the sql may have changed any definition
+    if commit:
+        get_cache(path).clear()
+        get_keyword_index(path).clear()
+    # Returns the cursor results
+    return results
 
 
+@metrics.timed_query('list_tables')
 def list_tables(path, commit=False):
     """ Lists all of the tables in the database.
 
@@ -107,6 +701,201 @@ def list_tables(path, commit=False):
         return c.fetchall()
 
 
+# The sql of the blob migration, creating the blobs table, and replacing the triggers of the search index with ones
+# reading the text of each definition from its blob, which also count the definitions using each blob
+BLOB_STORE_SQL = \
+    '''
+    CREATE TABLE IF NOT EXISTS blobs
+    (
+        id    INTEGER PRIMARY KEY,
+        hash  BLOB NOT NULL UNIQUE,
+        refs  INT NOT NULL DEFAULT 0,
+        size  INT NOT NULL,
+        codec INT NOT NULL,
+        data  BLOB NOT NULL
+    );
+    ALTER TABLE defs ADD COLUMN blob INT REFERENCES blobs (id);
+    DROP TRIGGER IF EXISTS defs_fts_insert;
+    DROP TRIGGER IF EXISTS defs_fts_delete;
+    DROP TRIGGER IF EXISTS defs_fts_update;
+    CREATE TRIGGER defs_fts_insert AFTER INSERT ON defs BEGIN
+        UPDATE blobs SET refs = refs + 1 WHERE id = new.blob;
+        INSERT INTO defs_fts (rowid, command, def)
+        VALUES (new.rowid, guild_terms(new.server, new.command), guild_terms(new.server,
+                coalesce((SELECT blob_text(codec, data) FROM blobs WHERE id = new.blob), new.def)));
+    END;
+    CREATE TRIGGER defs_fts_delete AFTER DELETE ON defs BEGIN
+        INSERT INTO defs_fts (defs_fts, rowid, command, def)
+        VALUES ('delete', old.rowid, guild_terms(old.server, old.command), guild_terms(old.server,
+                coalesce((SELECT blob_text(codec, data) FROM blobs WHERE id = old.blob), old.def)));
+        UPDATE blobs SET refs = refs - 1 WHERE id = old.blob;
+        DELETE FROM blobs WHERE id = old.blob AND refs = 0;
+    END;
+    CREATE TRIGGER defs_fts_update AFTER UPDATE ON defs BEGIN
+        INSERT INTO defs_fts (defs_fts, rowid, command, def)
+        SELECT 'delete', old.rowid, guild_terms(old.server, old.command), guild_terms(old.server, old_text)
+        FROM (SELECT coalesce((SELECT blob_text(codec, data) FROM blobs WHERE id = old.blob), old.def) AS old_text,
+                     coalesce((SELECT blob_text(codec, data) FROM blobs WHERE id = new.blob), new.def) AS new_text)
+        WHERE old.server IS NOT new.server OR old.command IS NOT new.command OR old_text IS NOT new_text;
+        INSERT INTO defs_fts (rowid, command, def)
+        SELECT new.rowid, guild_terms(new.server, new.command), guild_terms(new.server, new_text)
+        FROM (SELECT coalesce((SELECT blob_text(codec, data) FROM blobs WHERE id = old.blob), old.def) AS old_text,
+                     coalesce((SELECT blob_text(codec, data) FROM blobs WHERE id = new.blob), new.def) AS new_text)
+        WHERE old.server IS NOT new.server OR old.command IS NOT new.command OR old_text IS NOT new_text;
+        UPDATE blobs SET refs = refs + 1 WHERE id = new.blob AND new.blob IS NOT old.blob;
+        UPDATE blobs SET refs = refs - 1 WHERE id = old.blob AND new.blob IS NOT old.blob;
+        DELETE FROM blobs WHERE id = old.blob AND refs = 0;
+    END;
+    '''
+
+
+def blob_text(codec, data):
+    """ Decodes the data of a blob into the text of its definition. Registered as the blob_text sql function on every
+    pooled connection, used by the triggers to index the text.
+
+    Parameters
+    ----------
+    codec : int
+        How the data is stored, CODEC_TEXT or CODEC_ZLIB.
+    data : bytes
+        The data of the blob.
+
+    Returns
+    -------
+    str
+        The text of the definition, or None if there is no blob.
+
+    """
+
+    if data is None:
+        return None
+    if codec == CODEC_ZLIB:
+        data = zlib.decompress(data)
+    return data.decode('utf-8')
+
+
+def _definition(text, codec, data):
+    """ Gets the text of a definition read along with its blob, from the def column if it hasn't been moved to the
+    blobs table.
+
+    """
+
+    return text if codec is None else blob_text(codec, data)
+
+
+def _encode_blob(path, definition):
+    """ Hashes the text of a definition, compressing it if it is long enough and compressing makes it smaller.
+
+    Returns
+    -------
+    tuple
+        The hash, size, codec and data of the blob, in the order of the columns of the blobs table.
+
+    """
+
+    with _pools_lock:
+        compress_above, level = _blob_settings.get(path, (DEFAULT_COMPRESS_ABOVE, DEFAULT_COMPRESS_LEVEL))
+    data = definition.encode('utf-8')
+    digest = hashlib.sha256(data).digest()
+    size = len(data)
+    codec = CODEC_TEXT
+    if size > compress_above:
+        compressed = zlib.compress(data, level)
+        if len(compressed) < size:
+            codec, data = CODEC_ZLIB, compressed
+    return digest, size, codec, data
+
+
+def _store_blob(c, blob):
+    """ Gets the id of the given blob, inserting it if no definition has the same text yet. Must be called inside the
+    write transaction of the definition using it, so it can't be deleted in between.
+
+    Parameters
+    ----------
+    c : sqlite3.Cursor
+        The cursor of the write transaction.
+    blob : tuple
+        The blob, as made by _encode_blob.
+
+    Returns
+    -------
+    int
+        The id of the blob.
+
+    """
+
+    c.execute('SELECT id FROM blobs WHERE hash=?;', (blob[0],))
+    row = c.fetchone()
+    if row is None:
+        c.execute('INSERT INTO blobs (hash, size, codec, data) VALUES (?, ?, ?, ?) RETURNING id;', blob)
+        row = c.fetchone()
+    return row[0]
+
+
+def _drop_unused_blob(c, blob_id):
+    """ Deletes a blob that no definition ended up using, such as when the insert it was stored for was a duplicate.
+
+    """
+
+    c.execute('DELETE FROM blobs WHERE id=? AND refs=0;', (blob_id,))
+
+
+# The single statement run by each kind of write, each returning a row only if it changed the defs table. The text of
+# an inserted definition is in its blob, so its def column is left empty
+WRITE_SQL = {
+    'ins_def':
+        '''
+        INSERT INTO defs
+        (server, command, def, blob)
+        VALUES
+        (?, ?, '', ?)
+        ON CONFLICT (server, command) DO NOTHING
+        RETURNING rowid;
+        ''',
+    'del_def':
+        '''
+        DELETE FROM defs
+        WHERE server=? AND command=?
+        RETURNING rowid;
+        ''',
+}
+
+
+def _write(c, kind, server, command, blob=None):
+    """ Runs a write of WRITE_SQL with the given cursor, storing the blob of an inserted definition first.
+
+    Parameters
+    ----------
+    c : sqlite3.Cursor
+        The cursor of the write transaction.
+    kind : str
+        'ins_def' or 'del_def'.
+    server : int
+        The server id of the server of the definition.
+    command : str
+        The command of the definition.
+    blob : tuple
+        The blob of the definition being inserted, as made by _encode_blob.
+
+    Returns
+    -------
+    bool
+        Whether the defs table was changed.
+
+    """
+
+    if kind != 'ins_def':
+        c.execute(WRITE_SQL[kind], (server, command))
+        return c.fetchone() is not None
+    blob_id = _store_blob(c, blob)
+    c.execute(WRITE_SQL[kind], (server, command, blob_id))
+    changed = c.fetchone() is not None
+    if not changed:
+        _drop_unused_blob(c, blob_id)
+    return changed
+
+
+@metrics.timed_query('ins_def')
 def ins_def(path, server, command, definition, commit=False):
     """ Inserts a new definition into the defs table. Used to store urls, definitions, etc in a database based
     on a given command value.
@@ -124,32 +913,31 @@ def ins_def(path, server, command, definition, commit=False):
     commit : bool
         Whether or not changes should be committed.
 
-    Returns
-    -------
-    bool
-        Returns whether inputting the new definition was successful or not.
+    Raises
+    ------
+    DuplicateError
+        If the server already has a definition for the command.
 
     """
 
+    # Hashes and compresses the definition before taking the write lock
+    blob = _encode_blob(path, definition)
     # Opens the database connection to retrieve the cursor
     with connect(path, commit=commit) as c:
-        # The sql that will be used to insert the definition
-        sql = \
-            '''
-            INSERT INTO defs
-            (server, command, def)
-            VALUES
-            (?, ?, ?);
-            '''
-        # Executes the sql to insert the command into the database
-        c.execute(sql, (server, command, definition))
-        # Return True to signal the definition has been successfully inserted
-        return True
-
-    # Return False to signal the definition has not been successfully inserted
-    return False
+        # Takes the write lock before looking the blob up, so it can't be deleted before the insert uses it
+        c.execute('BEGIN IMMEDIATE;')
+        # Inserts the definition, finding out only if it didn't exist yet
+        inserted = _write(c, 'ins_def', server, command, blob)
+    # Signals the definition already exists, which the insert found without a second lookup
+    if not inserted:
+        raise DuplicateError("{} already has a definition for {}".format(server, command))
+    # Writes the committed definition through to the cache and keyword index
+    if commit:
+        get_cache(path).write(server, command, definition)
+        get_keyword_index(path).add(server, command)
 
 
+@metrics.timed_query('get_def')
 def get_def(path, server, command):
     """ Gets a definition from the defs table. Assumes the connection will not need to be committed.
 
@@ -169,26 +957,41 @@ def get_def(path, server, command):
     failure : None
         Returns None if the definition does not exist in the database.
 
+    Raises
+    ------
+    DatabaseError
+        If the definition couldn't be read.
+
     """
+    # Answers from the cache when the definition, or its absence, is cached
+    cache = get_cache(path)
+    definition = cache.get(server, command)
+    if definition is not MISSING:
+        return definition
+    # Notes the version of the cache, so the read isn't cached if a write happens while it runs
+    version = cache.version()
     # Connects to the database and uses the cursor to execute sql.
     with connect(path) as c:
-        # The sql that will be used to retrieve the definition
+        # The sql that will be used to retrieve the definition, along with its blob
         sql = \
             '''
-            SELECT def
+            SELECT defs.def, blobs.codec, blobs.data
             FROM defs
-            WHERE server=? AND command=?;
+            LEFT JOIN blobs ON blobs.id = defs.blob
+            WHERE defs.server=? AND defs.command=?;
             '''
         # Executes the sql to retrieve the desired definition
         c.execute(sql, (server, command))
-        # Returns the definition from the database
-        definition = c.fetchone()
-        if definition is not None:
-            return definition[0]
-        else:
-            return None
+        # Gets the definition from the database
+        row = c.fetchone()
+        definition = _definition(*row) if row is not None else None
+        # Caches the definition, or that it doesn't exist, once it has been read successfully
+        cache.fill(server, command, definition, version)
+    # Returns the definition, or None if it doesn't exist
+    return definition
 
 
+@metrics.timed_query('del_def')
 def del_def(path, server, command, commit=False):
     """ Removes the definition from the defs table.
 
@@ -203,14 +1006,865 @@ def del_def(path, server, command, commit=False):
     commit : bool
         Determines if a commit can occur in the used connection.
 
+    Raises
+    ------
+    NotFoundError
+        If the server has no definition for the command, so nothing was deleted.
+
     """
     # Connects to the database and uses the cursor to execute sql.
     with connect(path, commit=commit) as c:
-        # The sql that will be used to delete the definition
+        # Deletes the definition, getting its rowid back only if it existed
+        c.execute(WRITE_SQL['del_def'], (server, command))
+        deleted = c.fetchone() is not None
+    # Removes the deleted definition from the cache and keyword index
+    if commit:
+        get_cache(path).invalidate(server, command)
+        get_keyword_index(path).discard(server, command)
+    # Signals nothing was deleted
+    if not deleted:
+        raise NotFoundError("{} has no definition for {}".format(server, command))
+
+
+@metrics.timed_query('run_batch')
+def run_batch(path, operations):
+    """ Runs many inserts and deletes of definitions in a single transaction, sharing one commit. Each operation runs
+    in its own savepoint, so an operation that fails is undone on its own without affecting the rest of the batch.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    operations : list
+        The operations to be run in order, each a tuple of ('ins_def', server, command, definition) or
+        ('del_def', server, command).
+
+    Returns
+    -------
+    list
+        The result of each operation: None if it succeeded, or the DatabaseError it failed with, such as a
+        DuplicateError for an insert or a NotFoundError for a delete.
+
+    Raises
+    ------
+    DatabaseError
+        If the batch as a whole couldn't be committed, in which case nothing was changed.
+
+    """
+
+    results = []
+    # Hashes and compresses the inserted definitions before taking the write lock
+    blobs = [_encode_blob(path, definition[0]) if kind == 'ins_def' else None
+             for kind, server, command, *definition in operations]
+    # Opens the database connection to retrieve the cursor
+    with connect(path, commit=True) as c:
+        # Starts the transaction explicitly, as the first savepoint would otherwise be committed when released. Takes
+        # the write lock straight away, so the blobs looked up can't be deleted before they are used
+        c.execute('BEGIN IMMEDIATE')
+        for (kind, server, command, *_), blob in zip(operations, blobs):
+            c.execute('SAVEPOINT operation')
+            try:
+                changed = _write(c, kind, server, command, blob)
+            # Undoes only this operation, such as an insert breaking a constraint
+            except sqlite3.IntegrityError as e:
+                c.execute('ROLLBACK TO operation')
+                results.append(_translate(e))
+            else:
+                if changed:
+                    results.append(None)
+                elif kind == 'ins_def':
+                    results.append(DuplicateError("{} already has a definition for {}".format(server, command)))
+                else:
+                    results.append(NotFoundError("{} has no definition for {}".format(server, command)))
+            c.execute('RELEASE operation')
+    # Brings the cache and keyword index up to date with the committed operations
+    cache = get_cache(path)
+    index = get_keyword_index(path)
+    for (kind, server, command, *definition), result in zip(operations, results):
+        if kind == 'ins_def' and result is None:
+            cache.write(server, command, definition[0])
+            index.add(server, command)
+        elif kind == 'del_def':
+            cache.invalidate(server, command)
+            index.discard(server, command)
+    return results
+
+
+@metrics.timed_query('ins_defs')
+def ins_defs(path, server, definitions, upsert=False, commit=False, progress=None, progress_every=1000):
+    """ Inserts many definitions into the defs table in a single transaction. The definitions are first read, hashed
+    and compressed into a temporary table kept on disk, so memory use doesn't grow with the number of definitions and
+    the write lock is only held while they are copied into the defs table, not while they are read.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server the definitions are to be associated with.
+    definitions : iterable
+        (command, definition) pairs to be inserted. All of them are read before the write lock is taken, so an error
+        raised while reading them leaves the database untouched without having blocked any other writer.
+    upsert : bool
+        Whether definitions that already exist should be replaced. If False, they are kept and the new ones skipped.
+    commit : bool
+        Whether or not changes should be committed.
+    progress : callable
+        Called with the number of definitions read so far, every progress_every definitions.
+    progress_every : int
+        How often progress is called.
+
+    Returns
+    -------
+    tuple
+        The number of definitions read and the number inserted or replaced.
+
+    Raises
+    ------
+    DatabaseError
+        If the insert failed, in which case nothing was inserted.
+
+    """
+
+    # The number of definitions read so far
+    read = 0
+
+    def staged():
+        """ Yields the staged row of each definition, counting them as they are read.
+
+        """
+
+        nonlocal read
+        for command, definition in definitions:
+            read += 1
+            if progress is not None and read % progress_every == 0:
+                progress(read)
+            yield (command,) + _encode_blob(path, definition)
+
+    # Opens the database connection to retrieve the cursor
+    with connect(path, commit=commit) as c:
+        # Stages the definitions in the connection's temporary database, which doesn't lock the main one, kept on disk
+        # however the pool's temp_store is set. Setting temp_store drops every temporary table, so restoring it drops
+        # the staging table too
+        temp_store = c.execute('PRAGMA temp_store;').fetchone()[0]
+        c.execute('PRAGMA temp_store=FILE;')
+        try:
+            c.execute('CREATE TEMP TABLE staged_defs (command TEXT, hash BLOB, size INT, codec INT, data BLOB);')
+            c.executemany('INSERT INTO temp.staged_defs (command, hash, size, codec, data) VALUES (?, ?, ?, ?, ?);',
+                          staged())
+            c.connection.commit()
+            # Takes the write lock before looking any blob up, so it can't be deleted before the insert uses it
+            c.execute('BEGIN IMMEDIATE;')
+            c.execute(
+                '''
+                INSERT INTO blobs
+                (hash, size, codec, data)
+                SELECT hash, size, codec, data FROM temp.staged_defs WHERE true
+                ON CONFLICT (hash) DO NOTHING;
+                ''')
+            # Inserts in the order of the file, so the last of a repeated command wins an upsert and the first otherwise
+            c.execute(
+                '''
+                INSERT INTO defs
+                (server, command, def, blob)
+                SELECT ?, staged.command, '', blobs.id
+                FROM temp.staged_defs AS staged JOIN blobs ON blobs.hash = staged.hash
+                WHERE true
+                ORDER BY staged.rowid
+                ON CONFLICT (server, command) DO {};
+                '''.format('UPDATE SET def=excluded.def, blob=excluded.blob' if upsert else 'NOTHING'), (server,))
+            changed = c.rowcount
+            # Deletes the blobs that were only stored for definitions skipped as duplicates
+            c.execute('DELETE FROM blobs WHERE refs=0 AND hash IN (SELECT hash FROM temp.staged_defs);')
+            # Ends the transaction here rather than when the connection is returned, as temp_store can't be set inside
+            # a transaction
+            if commit:
+                c.connection.commit()
+            else:
+                c.connection.rollback()
+        except BaseException:
+            c.connection.rollback()
+            raise
+        finally:
+            c.execute('PRAGMA temp_store={};'.format(temp_store))
+        result = (read, changed)
+    # Removes the guild's definitions from the cache and keyword index, as any of them may have changed
+    if commit:
+        get_cache(path).invalidate_server(server)
+        get_keyword_index(path).invalidate_server(server)
+    return result
+
+
+def iter_defs(path, server, batch_size=500):
+    """ Yields every definition of the given guild in alphabetical order. The definitions are read a batch at a time,
+    without holding a connection between batches, so memory use doesn't grow with the number of definitions.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server the definitions are to be read from.
+    batch_size : int
+        The number of definitions read at a time.
+
+    Yields
+    ------
+    tuple
+        The (command, definition) pairs of the guild.
+
+    """
+
+    # The last command read, the next batch starts after it
+    after = ''
+    while True:
+        # Connects to the database and uses the cursor to execute sql.
+        with connect(path) as c:
+            # The sql that will be used to read the batch, read in order from the primary key's index
+            sql = \
+                '''
+                SELECT defs.command, defs.def, blobs.codec, blobs.data
+                FROM defs
+                LEFT JOIN blobs ON blobs.id = defs.blob
+                WHERE defs.server=? AND defs.command>?
+                ORDER BY defs.command
+                LIMIT ?;
+                '''
+            c.execute(sql, (server, after, batch_size))
+            rows = [(command, _definition(text, codec, data)) for command, text, codec, data in c.fetchall()]
+        yield from rows
+        # Stops after the last batch
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+
+@metrics.timed_query('migrate_blobs')
+def _migrate_blob_batch(path, after, batch_size):
+    """ Moves the next batch of definitions still kept in the def column of defs into the blobs table, in its own
+    transaction. The text is read and compressed before the write lock is taken.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    after : int
+        The rowid of the last definition of the previous batch.
+    batch_size : int
+        The largest number of definitions moved.
+
+    Returns
+    -------
+    tuple
+        The rowid of the last definition of the batch, or None if there was none left, and the number moved.
+
+    """
+
+    # Reads the batch without the write lock, in rowid order so each batch starts where the last one stopped
+    with connect(path) as c:
+        c.execute('SELECT rowid, def FROM defs WHERE rowid>? AND blob IS NULL ORDER BY rowid LIMIT ?;',
+                  (after, batch_size))
+        rows = c.fetchall()
+    if not rows:
+        return None, 0
+    blobs = [(rowid, text, _encode_blob(path, text)) for rowid, text in rows]
+    moved = 0
+    with connect(path, commit=True) as c:
+        # Takes the write lock before looking the blobs up, so they can't be deleted before they are used
+        c.execute('BEGIN IMMEDIATE;')
+        for rowid, text, blob in blobs:
+            blob_id = _store_blob(c, blob)
+            # Skips definitions changed since they were read. The triggers only reindex a definition whose text changed
+            c.execute("UPDATE defs SET def='', blob=? WHERE rowid=? AND blob IS NULL AND def=?;",
+                      (blob_id, rowid, text))
+            if c.rowcount > 0:
+                moved += 1
+            else:
+                _drop_unused_blob(c, blob_id)
+    return rows[-1][0], moved
+
+
+def migrate_blobs(path, batch_size=500, pause=0.05, progress=None):
+    """ Moves every definition still kept in the def column of defs into the blobs table. The definitions are moved a
+    batch at a time, each in a short transaction followed by a pause, so the bot keeps answering and writing while it
+    runs. Safe to run again after being stopped, and alongside another run.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    batch_size : int
+        The largest number of definitions moved in a transaction.
+    pause : float
+        The number of seconds waited between batches, letting other writers take the write lock.
+    progress : callable
+        Called with the number of definitions moved so far after every batch.
+
+    Returns
+    -------
+    dict
+        The space used before and after, see blob_stats.
+
+    """
+
+    after = 0
+    moved = 0
+    while True:
+        after, count = _migrate_blob_batch(path, after, batch_size)
+        if after is None:
+            break
+        moved += count
+        if progress is not None:
+            progress(moved)
+        time.sleep(pause)
+    return blob_stats(path)
+
+
+@metrics.timed_query('blob_stats')
+def blob_stats(path):
+    """ Measures the space saved by storing the definitions in the blobs table.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    Returns
+    -------
+    dict
+        definitions: the number of definitions.
+        unmoved: the number of definitions still kept in the def column, which migrate_blobs would move.
+        blobs: the number of distinct texts stored, and compressed: how many of them are compressed.
+        text_bytes: the size of the text of every definition, as if each were stored on its own.
+        stored_bytes: the size of the text actually stored, after removing duplicates and compressing.
+        saved_bytes and saved: the difference between the two, in bytes and as a share of text_bytes.
+        free_bytes: the size of the pages sqlite has freed, reused by later writes or returned to the disk by VACUUM.
+
+    """
+
+    with connect(path) as c:
+        c.execute("SELECT COUNT(*), COUNT(*) - COUNT(blob), SUM(CASE WHEN blob IS NULL THEN length(CAST(def AS BLOB)) "
+                  "ELSE 0 END) FROM defs;")
+        definitions, unmoved, unmoved_bytes = c.fetchone()
+        c.execute('SELECT COUNT(*), SUM(codec=?), SUM(size * refs), SUM(length(data)) FROM blobs;', (CODEC_ZLIB,))
+        blobs, compressed, blob_text_bytes, blob_bytes = c.fetchone()
+        page_size = c.execute('PRAGMA page_size;').fetchone()[0]
+        free_pages = c.execute('PRAGMA freelist_count;').fetchone()[0]
+    text_bytes = (unmoved_bytes or 0) + (blob_text_bytes or 0)
+    stored_bytes = (unmoved_bytes or 0) + (blob_bytes or 0)
+    return {'definitions': definitions, 'unmoved': unmoved, 'blobs': blobs, 'compressed': compressed or 0,
+            'text_bytes': text_bytes, 'stored_bytes': stored_bytes, 'saved_bytes': text_bytes - stored_bytes,
+            'saved': (text_bytes - stored_bytes) / text_bytes if text_bytes else 0.0,
+            'free_bytes': page_size * free_pages}
+
+
+# Matches the words of a text the same way the unicode61 tokenizer of the search index splits them
+_WORD = re.compile(r'[^\W_]+')
+
+# The sql creating the search index of the defs table, and the triggers keeping it in sync
+SEARCH_INDEX_SQL = \
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS defs_fts USING fts5
+    (
+        command, def,
+        content='', tokenize='unicode61'
+    );
+    CREATE TRIGGER IF NOT EXISTS defs_fts_insert AFTER INSERT ON defs BEGIN
+        INSERT INTO defs_fts (rowid, command, def)
+        VALUES (new.rowid, guild_terms(new.server, new.command), guild_terms(new.server, new.def));
+    END;
+    CREATE TRIGGER IF NOT EXISTS defs_fts_delete AFTER DELETE ON defs BEGIN
+        INSERT INTO defs_fts (defs_fts, rowid, command, def)
+        VALUES ('delete', old.rowid, guild_terms(old.server, old.command), guild_terms(old.server, old.def));
+    END;
+    CREATE TRIGGER IF NOT EXISTS defs_fts_update AFTER UPDATE ON defs BEGIN
+        INSERT INTO defs_fts (defs_fts, rowid, command, def)
+        VALUES ('delete', old.rowid, guild_terms(old.server, old.command), guild_terms(old.server, old.def));
+        INSERT INTO defs_fts (rowid, command, def)
+        VALUES (new.rowid, guild_terms(new.server, new.command), guild_terms(new.server, new.def));
+    END;
+    '''
+
+# The sql recreating the search index without the prefix indexes it was first made with. Every word is indexed with
+# its guild's tag in front, so short prefix indexes only ever held fragments of the tags, and never served a search.
+# The triggers only refer to the table by name, so they are kept
+SEARCH_TABLE_SQL = \
+    '''
+    DROP TABLE IF EXISTS defs_fts;
+    CREATE VIRTUAL TABLE defs_fts USING fts5
+    (
+        command, def,
+        content='', tokenize='unicode61'
+    );
+    '''
+
+
+def guild_terms(server, text):
+    """ Converts the given text into the words indexed for the given guild, each with the server id in front of it.
+    Registered as the guild_terms sql function on every pooled connection.
+
+    Parameters
+    ----------
+    server : int
+        The server id of the server the text belongs to.
+    text : str
+        The text to be indexed.
+
+    Returns
+    -------
+    str
+        The words of the text, each as g<server>x<word>, separated by spaces.
+
+    """
+
+    return ' '.join('g{}x{}'.format(server, word) for word in _WORD.findall(text.lower()))
+
+
+def ensure_search_index(path):
+    """ Creates the search index of the defs table if it doesn't exist yet, indexing the existing definitions.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    """
+    # Checks whether the index already exists
+    with connect(path) as c:
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='defs_fts';")
+        exists = c.fetchone() is not None
+    # Creates the index and its triggers
+    with connect(path, commit=True) as c:
+        c.executescript(SEARCH_INDEX_SQL)
+    # Indexes the definitions that were inserted before the index existed
+    if not exists:
+        rebuild_search_index(path)
+
+
+def rebuild_search_index(path):
+    """ Rebuilds the search index of the defs table from scratch.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    """
+    # Opens the database connection to retrieve the cursor
+    with connect(path, commit=True) as c:
+        index_definitions(c)
+
+
+def index_definitions(cursor):
+    """ Empties the search index, then indexes every definition again, using the given cursor so it can be part of a
+    larger transaction.
+
+    Parameters
+    ----------
+    cursor : sqlite3.Cursor
+        The cursor of a pooled connection, which has the guild_terms function registered.
+
+    """
+
+    cursor.execute("INSERT INTO defs_fts (defs_fts) VALUES ('delete-all');")
+    # Databases the blob migration hasn't run on keep every definition in the def column
+    cursor.execute("SELECT 1 FROM pragma_table_info('defs') WHERE name='blob';")
+    if cursor.fetchone() is None:
         sql = \
             '''
-            DELETE FROM defs
-            WHERE server=? AND command=?;
+            INSERT INTO defs_fts (rowid, command, def)
+            SELECT rowid, guild_terms(server, command), guild_terms(server, def)
+            FROM defs;
             '''
-        # Executes the sql to delete the desired definition
-        c.execute(sql, (server, command))
+    else:
+        sql = \
+            '''
+            INSERT INTO defs_fts (rowid, command, def)
+            SELECT defs.rowid, guild_terms(defs.server, defs.command),
+                   guild_terms(defs.server, coalesce(blob_text(blobs.codec, blobs.data), defs.def))
+            FROM defs
+            LEFT JOIN blobs ON blobs.id = defs.blob;
+            '''
+    cursor.execute(sql)
+
+
+def _match_expression(server, query):
+    """ Builds the FTS5 match expression searching the given guild's definitions for the given query. Each word of the
+    query is matched as a prefix, in either the command or the definition, and all of the words must match.
+
+    Parameters
+    ----------
+    server : int
+        The server id of the server to search.
+    query : str
+        The words to search for, as typed by the user.
+
+    Returns
+    -------
+    str or None
+        The match expression, or None if the query has no words.
+
+    """
+
+    # Quotes every word so nothing the user types is read as FTS5 syntax
+    terms = ['"{}"*'.format(term) for term in guild_terms(int(server), query).split()]
+    if not terms:
+        return None
+    return ' AND '.join(terms)
+
+
+def _snippet(text, query, width=12):
+    """ Cuts the part of the text around the first word matching the query, marking the matching words in bold.
+
+    Parameters
+    ----------
+    text : str
+        The text of the definition.
+    query : str
+        The words searched for.
+    width : int
+        The number of words kept in the snippet.
+
+    Returns
+    -------
+    str
+        The snippet of the text.
+
+    """
+
+    prefixes = tuple(word for word in _WORD.findall(query.lower()))
+    words = text.split()
+
+    def matches(word):
+        return any(part.startswith(prefixes) for part in _WORD.findall(word.lower()))
+
+    # Starts the snippet a few words before the first match
+    first = next((i for i, word in enumerate(words) if matches(word)), 0)
+    start = max(0, min(first - width // 4, len(words) - width))
+    kept = ['**{}**'.format(word) if matches(word) else word for word in words[start:start + width]]
+    return '{}{}{}'.format('...' if start > 0 else '', ' '.join(kept), '...' if start + width < len(words) else '')
+
+
+@metrics.timed_query('search_defs')
+def search_defs(path, server, query, limit=10, offset=0):
+    """ Searches the definitions of the given guild, matching the words of the query against the start of the words
+    in each command and definition. Matches in the command rank above matches in the definition.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server to search.
+    query : str
+        The words to search for.
+    limit : int
+        The maximum number of results to return.
+    offset : int
+        The number of results to skip, used to page through the results.
+
+    Returns
+    -------
+    list
+        (command, snippet) tuples of the matching definitions, best match first, with the matches in the snippet
+        marked in bold.
+
+    """
+    # Returns nothing for queries without any words
+    expression = _match_expression(server, query)
+    if expression is None:
+        return []
+    # Connects to the database and uses the cursor to execute sql.
+    with connect(path) as c:
+        # The sql that will be used to search the definitions, reading the matching definitions from the defs table
+        sql = \
+            '''
+            SELECT defs.command, defs.def, blobs.codec, blobs.data
+            FROM defs_fts
+            JOIN defs ON defs.rowid = defs_fts.rowid
+            LEFT JOIN blobs ON blobs.id = defs.blob
+            WHERE defs_fts MATCH ?
+            ORDER BY bm25(defs_fts, 10.0, 1.0)
+            LIMIT ? OFFSET ?;
+            '''
+        # Executes the sql to search the definitions
+        c.execute(sql, (expression, limit, offset))
+        return [(command, _snippet(_definition(text, codec, data), query))
+                for command, text, codec, data in c.fetchall()]
+
+
+@metrics.timed_query('list_defs')
+def list_defs(path, server, limit=20, offset=0):
+    """ Lists the commands of the definitions of the given guild in alphabetical order, a page at a time.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server to list the definitions of.
+    limit : int
+        The maximum number of commands to return.
+    offset : int
+        The number of commands to skip, used to page through the commands.
+
+    Returns
+    -------
+    list
+        The commands of the definitions on the page.
+
+    """
+    # Connects to the database and uses the cursor to execute sql.
+    with connect(path) as c:
+        # The sql that will be used to list the commands, read straight from the primary key's index
+        sql = \
+            '''
+            SELECT command
+            FROM defs
+            WHERE server=?
+            ORDER BY command
+            LIMIT ? OFFSET ?;
+            '''
+        # Executes the sql to list the commands
+        c.execute(sql, (server, limit, offset))
+        return [row[0] for row in c.fetchall()]
+
+
+@metrics.timed_query('count_defs')
+def count_defs(path, server):
+    """ Counts the definitions of the given guild.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server to count the definitions of.
+
+    Returns
+    -------
+    int
+        The number of definitions.
+
+    """
+    # Connects to the database and uses the cursor to execute sql.
+    with connect(path) as c:
+        c.execute('SELECT COUNT(*) FROM defs WHERE server=?;', (server,))
+        return c.fetchone()[0]
+
+
+@metrics.timed_query('suggest_defs')
+def suggest_defs(path, server, command, limit=3):
+    """ Finds the commands of the given guild's definitions closest to a command that doesn't exist, such as a typo.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server to look in.
+    command : str
+        The command that was asked for.
+    limit : int
+        The maximum number of commands to return.
+
+    Returns
+    -------
+    list
+        The closest commands, closest first.
+
+    """
+
+    def load():
+        # Connects to the database and reads every command of the guild, straight from the primary key's index
+        with connect(path) as c:
+            c.execute('SELECT command FROM defs WHERE server=?;', (server,))
+            return [row[0] for row in c.fetchall()]
+
+    return get_keyword_index(path).suggest(server, command, load, limit=limit)
+
+
+# The tables of the group registry, created by the migrations in storage.py
+GROUP_TABLES_SQL = \
+    '''
+    CREATE TABLE IF NOT EXISTS groups
+    (
+        server    INT NOT NULL,
+        name      TEXT NOT NULL COLLATE NOCASE,
+        role      INT NOT NULL,
+        category  INT NOT NULL,
+        important INT,
+        text      INT,
+        voice     INT,
+        PRIMARY KEY (server, name)
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS groups_role ON groups (server, role);
+    CREATE TABLE IF NOT EXISTS group_members
+    (
+        server INT NOT NULL,
+        role   INT NOT NULL,
+        member INT NOT NULL,
+        PRIMARY KEY (server, role, member)
+    ) WITHOUT ROWID;
+    '''
+
+# The channels of a group, in the order of their columns in the groups table
+GROUP_CHANNELS = ('important', 'text', 'voice')
+
+
+@metrics.timed_query('ins_group')
+def ins_group(path, server, name, role, category, channels, members=(), commit=False):
+    """ Inserts a new group, and its members, into the group registry.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server the group is in.
+    name : str
+        The name of the group. Names are compared without case.
+    role : int
+        The id of the group's role.
+    category : int
+        The id of the group's category.
+    channels : dict
+        The ids of the group's channels, keyed by the names in GROUP_CHANNELS.
+    members : iterable
+        The ids of the members of the group's role.
+    commit : bool
+        Whether or not changes should be committed.
+
+    Raises
+    ------
+    DuplicateError
+        If the server already has a group with the name.
+
+    """
+
+    with connect(path, commit=commit) as c:
+        sql = \
+            '''
+            INSERT INTO groups
+            (server, name, role, category, important, text, voice)
+            VALUES
+            (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (server, name) DO NOTHING
+            RETURNING rowid;
+            '''
+        c.execute(sql, (server, name, role, category) + tuple(channels.get(kind) for kind in GROUP_CHANNELS))
+        if c.fetchone() is None:
+            raise DuplicateError("{} already has a group called {}".format(server, name))
+        c.executemany('INSERT OR IGNORE INTO group_members (server, role, member) VALUES (?, ?, ?);',
+                      [(server, role, member) for member in members])
+
+
+@metrics.timed_query('del_group')
+def del_group(path, server, name, commit=False):
+    """ Removes a group, and its members, from the group registry. The role and channels of the group are left alone.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server the group is in.
+    name : str
+        The name of the group.
+    commit : bool
+        Whether or not changes should be committed.
+
+    Raises
+    ------
+    NotFoundError
+        If the server has no group with the name.
+
+    """
+
+    with connect(path, commit=commit) as c:
+        c.execute('DELETE FROM groups WHERE server=? AND name=? RETURNING role;', (server, name))
+        row = c.fetchone()
+        if row is None:
+            raise NotFoundError("{} has no group called {}".format(server, name))
+        c.execute('DELETE FROM group_members WHERE server=? AND role=?;', (server, row[0]))
+
+
+@metrics.timed_query('get_groups')
+def get_groups(path, server):
+    """ Gets every group of the given guild from the group registry.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server to get the groups of.
+
+    Returns
+    -------
+    list
+        The groups, each a tuple of (name, role, category, channels, members), with the channels as a dict keyed by the
+        names in GROUP_CHANNELS and the members as a list of ids.
+
+    """
+
+    with connect(path) as c:
+        c.execute('SELECT role, member FROM group_members WHERE server=?;', (server,))
+        members = {}
+        for role, member in c.fetchall():
+            members.setdefault(role, []).append(member)
+        c.execute('SELECT name, role, category, important, text, voice FROM groups WHERE server=?;', (server,))
+        return [(name, role, category, dict(zip(GROUP_CHANNELS, channels)), members.get(role, []))
+                for name, role, category, *channels in c.fetchall()]
+
+
+@metrics.timed_query('add_group_members')
+def add_group_members(path, server, role, members, commit=False):
+    """ Adds members to a group of the group registry, ignoring the ones it already has.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server the group is in.
+    role : int
+        The id of the group's role.
+    members : iterable
+        The ids of the members to add.
+    commit : bool
+        Whether or not changes should be committed.
+
+    """
+
+    with connect(path, commit=commit) as c:
+        c.executemany('INSERT OR IGNORE INTO group_members (server, role, member) VALUES (?, ?, ?);',
+                      [(server, role, member) for member in members])
+
+
+@metrics.timed_query('del_group_members')
+def del_group_members(path, server, role, members, commit=False):
+    """ Removes members from a group of the group registry, or from every group of the guild.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server the group is in.
+    role : int
+        The id of the group's role, or None to remove the members from every group of the guild.
+    members : iterable
+        The ids of the members to remove.
+    commit : bool
+        Whether or not changes should be committed.
+
+    """
+
+    with connect(path, commit=commit) as c:
+        if role is None:
+            c.executemany('DELETE FROM group_members WHERE server=? AND member=?;',
+                          [(server, member) for member in members])
+        else:
+            c.executemany('DELETE FROM group_members WHERE server=? AND role=? AND member=?;',
+                          [(server, role, member) for member in members])
@@ -1,7 +1,10 @@
-CREATE TABLE defs
+CREATE TABLE IF NOT EXISTS defs
 (
     server  INT NOT NULL,
     command TEXT NOT NULL,
     def     TEXT NOT NULL,
     PRIMARY KEY (server, command)
-);
\ No newline at end of file
+);
+
+-- This is the first schema migration, run by storage.bootstrap when the bot starts. Later changes to the schema are
+-- added as migrations in storage.py rather than here.
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+""" Imports and exports the definitions of a guild without running the bot, for moving a guild's definitions in or
+out of the database in bulk.
+
+Usage
+-----
+    python defs_cli.py export <server> <file> [--format jsonl|csv] [--db databases/pm.db]
+    python defs_cli.py import <server> <file> [--format jsonl|csv] [--upsert] [--db databases/pm.db]
+
+The format is guessed from the file's extension when it isn't given. Use - as the file to read from standard input
+or write to standard output.
+
+Todo
+----
+*
+
+"""
+import argparse  # Used to read the options given on the command line
+import io  # Used to read from standard input and write to standard output
+import sys  # Used to report errors
+import database  # Used to close the connections and report failed imports
+import defs_io  # Used to read and write the definition files
+import storage  # Used to prepare the database and migrate its schema
+
+
+def open_file(name, mode):
+    """ Opens the given file as text for reading or writing definitions, with - for standard input or output.
+
+    """
+
+    if name == '-':
+        stream = sys.stdin.buffer if mode == 'r' else sys.stdout.buffer
+        return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    return open(name, mode, encoding='utf-8', newline='')
+
+
+def main():
+    """ Runs the export or import given on the command line.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Imports and exports the definitions of a guild.")
+    parser.add_argument('action', choices=('export', 'import'), help='whether to export or import definitions')
+    parser.add_argument('server', type=int, help='the id of the guild')
+    parser.add_argument('file', help='the file to write to or read from, - for standard output or input')
+    parser.add_argument('--format', choices=defs_io.FORMATS, help='the format of the file')
+    parser.add_argument('--upsert', action='store_true', help='replace definitions that already exist on import')
+    parser.add_argument('--db', default='databases/pm.db', help='the path to the database')
+    args = parser.parse_args()
+
+    fmt = args.format or defs_io.guess_format(args.file)
+    if fmt is None:
+        parser.error("can't guess the format of {}, give it with --format".format(args.file))
+    # Brings the schema up to date, so the triggers keeping the search index in sync exist before writing
+    storage.bootstrap(args.db)
+
+    if args.action == 'export':
+        with open_file(args.file, 'w') as f:
+            count = defs_io.export_defs(args.db, args.server, f, fmt)
+        print("Exported {} definitions.".format(count), file=sys.stderr)
+    else:
+        def progress(count):
+            print("Read {} definitions...".format(count), file=sys.stderr)
+
+        try:
+            with open_file(args.file, 'r') as f:
+                result = defs_io.import_defs(args.db, args.server, f, fmt, upsert=args.upsert, progress=progress)
+        except (ValueError, database.DatabaseError) as e:
+            sys.exit("Nothing was imported, {}.".format(e))
+        print("Read {} definitions, {} {}.".format(result[0], result[1], "inserted or replaced" if args.upsert
+                                                   else "inserted, existing keywords were kept"), file=sys.stderr)
+    database.close_pools()
+
+
+if __name__ == '__main__':
+    main()
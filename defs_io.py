@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+""" This file contains the reading and writing of definition files, used to move a guild's definitions in or out of
+the bot in bulk.
+
+Formats
+-------
+jsonl
+    One JSON object per line, as {"command": ..., "definition": ...}.
+csv
+    A header row of command,definition followed by one row per definition.
+
+Files are read and written a definition at a time, so memory use stays flat regardless of the size of the file.
+
+Common Uses
+-----------
+Example:
+    with open('defs.jsonl', 'w', encoding='utf-8', newline='') as f:
+        export_defs(path, server, f, 'jsonl')
+    with open('defs.jsonl', encoding='utf-8', newline='') as f:
+        read, changed = import_defs(path, server, f, 'jsonl')
+
+Todo
+----
+*
+
+"""
+import csv  # Used to read and write csv files
+import json  # Used to read and write jsonl files
+import os  # Used to guess the format of a file from its name
+import database  # Used to read and write the definitions
+
+
+# The formats that can be read and written
+FORMATS = ('jsonl', 'csv')
+
+
+def guess_format(filename):
+    """ Guesses the format of a definition file from its name.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file.
+
+    Returns
+    -------
+    str or None
+        The format of the file, or None if it isn't a known format.
+
+    """
+
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'json', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    return None
+
+
+def write_defs(definitions, fp, fmt):
+    """ Writes the given definitions to a file.
+
+    Parameters
+    ----------
+    definitions : iterable
+        (command, definition) pairs to be written.
+    fp : file
+        The text file to write to, opened with newline=''.
+    fmt : str
+        The format to write, one of FORMATS.
+
+    Returns
+    -------
+    int
+        The number of definitions written.
+
+    """
+
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(fp)
+        writer.writerow(('command', 'definition'))
+        for command, definition in definitions:
+            writer.writerow((command, definition))
+            count += 1
+    elif fmt == 'jsonl':
+        for command, definition in definitions:
+            fp.write(json.dumps({'command': command, 'definition': definition}, ensure_ascii=False) + '\n')
+            count += 1
+    else:
+        raise ValueError("unknown format {}, use one of {}".format(fmt, ', '.join(FORMATS)))
+    return count
+
+
+def read_defs(fp, fmt):
+    """ Reads the definitions of a file, one at a time.
+
+    Parameters
+    ----------
+    fp : file
+        The text file to read from, opened with newline=''.
+    fmt : str
+        The format to read, one of FORMATS.
+
+    Yields
+    ------
+    tuple
+        The (command, definition) pairs of the file.
+
+    Raises
+    ------
+    ValueError
+        If a line of the file isn't a valid definition, naming the line.
+
+    """
+
+    if fmt == 'csv':
+        reader = csv.DictReader(fp)
+        if reader.fieldnames is None or not {'command', 'definition'} <= set(reader.fieldnames):
+            raise ValueError("the csv file must have a header row of command,definition")
+        for row in reader:
+            if not row['command'] or row['definition'] is None:
+                raise ValueError("line {} is missing its command or definition".format(reader.line_num))
+            yield row['command'], row['definition']
+    elif fmt == 'jsonl':
+        for number, line in enumerate(fp, 1):
+            # Skips blank lines
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                command, definition = row['command'], row['definition']
+            except (ValueError, KeyError, TypeError):
+                raise ValueError("line {} is not a valid definition".format(number))
+            if not isinstance(command, str) or not isinstance(definition, str) or not command:
+                raise ValueError("line {} is not a valid definition".format(number))
+            yield command, definition
+    else:
+        raise ValueError("unknown format {}, use one of {}".format(fmt, ', '.join(FORMATS)))
+
+
+def export_defs(path, server, fp, fmt):
+    """ Writes every definition of the given guild to a file.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server to export the definitions of.
+    fp : file
+        The text file to write to, opened with newline=''.
+    fmt : str
+        The format to write, one of FORMATS.
+
+    Returns
+    -------
+    int
+        The number of definitions written.
+
+    """
+
+    return write_defs(database.iter_defs(path, server), fp, fmt)
+
+
+def import_defs(path, server, fp, fmt, upsert=False, progress=None):
+    """ Inserts every definition of a file into the given guild, in a single transaction. The whole file is read
+    before the write lock is taken, so if any line of it isn't a valid definition, nothing is inserted and no other
+    writer was kept waiting.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    server : int
+        The server id of the server to import the definitions into.
+    fp : file
+        The text file to read from, opened with newline=''.
+    fmt : str
+        The format to read, one of FORMATS.
+    upsert : bool
+        Whether definitions that already exist should be replaced. If False, they are kept.
+    progress : callable
+        Called with the number of definitions read so far, every thousand definitions.
+
+    Returns
+    -------
+    tuple
+        The number of definitions read and the number inserted or replaced.
+
+    Raises
+    ------
+    ValueError
+        If a line of the file isn't a valid definition.
+    database.DatabaseError
+        If the database failed the insert.
+
+    """
+
+    return database.ins_defs(path, server, read_defs(fp, fmt), upsert=upsert, commit=True, progress=progress)
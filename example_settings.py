@@ -32,9 +32,103 @@ bot_settings = {
     'description': "A bot made to aid in managing multiple projects in a discord server",  # The bot description
     'symbol': "!",  # The command symbol the bot should use
     'c_path': "commands/",  # The path to the folder containing bot command extensions
+    'load_mode': "background",  # How the command extensions are loaded: eager, lazy or background
+    'log_level': "WARNING",  # The lowest level of the messages logged, such as INFO or ERROR
+    'prompt_timeout': 60,  # The number of seconds the bot waits for the answer to a prompt, such as a wiki option
 }
 
 # Variables associated with the database
 db_settings = {
     'path': "databases/pm.db",  # The path to the bot's database
+    'pool_size': 5,  # The maximum number of connections kept open to the database
+    'pragmas': {  # The pragmas set on every connection to the database
+        'synchronous': 'NORMAL',  # Only syncs the write-ahead log at checkpoints
+        'cache_size': -16384,  # The page cache of each connection, negative values are in KiB
+        'mmap_size': 256 * 1024 * 1024,  # The number of bytes of the database read through a memory map
+        'busy_timeout': 5000,  # The number of milliseconds to wait for a lock before failing
+        'temp_store': 'MEMORY',  # Keeps temporary tables in memory
+    },
+    'cache_entries': 2000,  # The maximum number of definitions of each guild kept in memory
+    'cache_bytes': 512 * 1024,  # The maximum memory used by the definitions of each guild kept in memory, in bytes
+    'cache_guilds': 64,  # The maximum number of guilds whose definitions are kept in memory
+    'cache_ttl': 600,  # The number of seconds a definition is kept in memory for
+    'batch_window': 0.005,  # The number of seconds writes wait for other writes to be committed with
+    'batch_size': 200,  # The largest number of writes committed together
+    'compress_above': 512,  # The number of bytes above which a definition is stored compressed
+    'compress_level': 6,  # The zlib level definitions are compressed with, from 1 (fastest) to 9 (smallest)
+    'migrate_batch': 500,  # The number of definitions moved into the blob store in each transaction
+    'migrate_pause': 0.05,  # The number of seconds waited between the transactions moving definitions
+}
+
+# Variables associated with the definition commands
+def_settings = {
+    'search_results': 10,  # The maximum number of definitions shown by a search
+    'page_size': 50,  # The number of keywords shown on each page of the definition list
+    'import_size': 25 * 1024 * 1024,  # The largest file in bytes accepted by the import command
+    'suggestions': 3,  # The number of similar keywords suggested when a definition doesn't exist, 0 for none
+    'suggest_guilds': 256,  # The maximum number of guilds whose keywords are kept in memory for the suggestions
+}
+
+# Variables associated with the group commands
+group_settings = {
+    'archive_size': 8 * 1024 * 1024,  # The largest archive of a group's channels in bytes, the most discord accepts
+}
+
+# Variables associated with the wikipedia commands
+wiki_settings = {
+    'backend': 'live',  # 'live' to call wikipedia, 'offline' to use the abstracts built by wiki_cli.py
+    'abstracts_path': "databases/wiki_abstracts",  # The path of the offline abstracts, without .idx and .dat
+    'max_concurrency': 4,  # The maximum number of calls to wikipedia running at once, across every guild
+    'timeout': 10,  # The number of seconds a single call to wikipedia may take
+    'max_options': 4,  # The maximum number of options the user is asked to choose between
+    'cache_entries': 2048,  # The maximum number of lookups kept in memory
+    'cache_ttl': 86400,  # The number of seconds a lookup is cached for
+    'cache_path': "databases/wiki_cache.db",  # The path to the on-disk lookup cache, or None to only cache in memory
+    'cache_rows': 100000,  # The maximum number of lookups kept on disk
+}
+
+# Variables associated with the outbound request scheduler, as (requests, per seconds)
+scheduler_settings = {
+    'routes': {
+        'send': (5, 5),  # Messages sent, per channel
+        'create_role': (10, 10),  # Roles created, per guild
+        'create_channel': (10, 10),  # Channels and categories created, per guild
+        'add_roles': (10, 10),  # Role changes, per guild
+        'remove_roles': (10, 10),  # Role removals, per guild
+        'edit': (10, 10),  # Channel and role edits, per guild
+        'delete': (5, 5),  # Channels and roles deleted, per guild
+        'history': (5, 5),  # Pages of message history read, per channel
+    },
+    'global_rate': (50, 1),  # All requests together
+    'concurrency': 4,  # The maximum number of requests running at once on a single route
+}
+
+# Variables associated with the instrumentation of the bot
+metrics_settings = {
+    'host': "127.0.0.1",  # The address the metrics endpoint listens on, keep it local unless firewalled
+    'port': 9108,  # The port of the metrics endpoint, None to not serve the metrics
+    'lag_interval': 0.5,  # The number of seconds between measurements of the event loop's lag
+}
+
+# Variables associated with the event loop watchdog and the sampling profiler
+watchdog_settings = {
+    'enabled': True,  # Whether stalls of the event loop are looked for
+    'stall_threshold': 0.25,  # The number of seconds the event loop has to be blocked for to log its stack
+    'check_interval': 0.05,  # The number of seconds between checks of the event loop
+    'keep_stalls': 20,  # The number of recent stalls shown by the stats command
+    'profiling': True,  # Whether the profile command may be used
+    'profile_interval': 0.005,  # The number of seconds between the samples of the profiler
+    'profile_max': 120,  # The longest profile in seconds the profile command will take
+    'profile_dir': "profiles/",  # The folder the profiles are kept in, or None to only send them
+    'profile_keep': 20,  # The number of profiles kept in profile_dir, the oldest being deleted
+}
+
+# Variables associated with running the bot's shards across several processes with launcher.py
+shard_settings = {
+    'shard_count': 2,  # The number of shards the guilds are split between
+    'processes': 2,  # The number of worker processes the shards are run in
+    'metrics_port': 9110,  # The port the first worker serves its metrics on, the others using the ports after it
+    'restart_delay': 1,  # The number of seconds before restarting a worker that exited, doubled for each exit in a row
+    'restart_max_delay': 60,  # The longest number of seconds waited before restarting a worker
+    'stable_after': 60,  # The number of seconds a worker has to run for before its earlier exits are forgotten
 }
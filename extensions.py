@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+""" This file contains the extension loader, used by main.py to load the command extensions in the commands folder.
+
+Load Modes
+----------
+eager
+    Every extension is imported and loaded one after another before the bot starts, as the bot always used to.
+lazy
+    No extension is imported at startup. Each command is registered as a stand-in, found by reading the extension's
+    source, and the first use of any of an extension's commands imports and loads the extension before running it.
+background
+    Starts like lazy, then imports every extension concurrently on worker threads once the bot is running, so the
+    first use of a command usually finds the extension already loaded.
+
+The time taken to load each extension is printed and kept in the loader's timings.
+
+Todo
+----
+*
+
+"""
+from discord.ext import commands  # Used to register the stand-in commands
+import ast  # Used to find the commands of an extension without importing it
+import asyncio  # Used to load the extensions in the background
+import glob  # Used to retrieve all of the files in the command directory
+import importlib  # Used to import the extensions on worker threads
+import os  # Used to convert the file names to extension names
+import time  # Used to time the loading of each extension
+
+
+# The load modes that can be used
+MODES = ('eager', 'lazy', 'background')
+
+
+def find_extensions(path):
+    """ Finds the extensions in the given folder.
+
+    Parameters
+    ----------
+    path : str
+        The path to the folder containing the extensions, ending with a slash.
+
+    Returns
+    -------
+    dict
+        The file of each extension, keyed by the extension's name as passed to load_extension.
+
+    """
+
+    extensions = {}
+    for file in sorted(glob.glob("{}*.py".format(path))):
+        # Converts the file name to the acceptable string for the load_extension method
+        name = os.path.splitext(os.path.normpath(file))[0].replace(os.sep, '.').replace('/', '.')
+        extensions[name] = file
+    return extensions
+
+
+def command_names(file):
+    """ Finds the names of the commands defined in the given extension file, without importing it.
+
+    Parameters
+    ----------
+    file : str
+        The path to the extension file.
+
+    Returns
+    -------
+    list
+        The names of the commands, taken from the name given to commands.command or the function's name.
+
+    """
+
+    with open(file, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=file)
+    names = []
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            # Looks for @commands.command(...) and @command(...)
+            func = decorator.func if isinstance(decorator, ast.Call) else decorator
+            attr = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+            if attr != 'command':
+                continue
+            name = node.name
+            for keyword in getattr(decorator, 'keywords', []):
+                if keyword.arg == 'name':
+                    name = ast.literal_eval(keyword.value)
+            names.append(name)
+    return names
+
+
+class ExtensionLoader:
+    """ Loads the command extensions of the bot, eagerly, lazily on first use, or in the background.
+
+    """
+
+    def __init__(self, bot, path):
+        """ Constructs the ExtensionLoader class.
+
+        Parameters
+        ----------
+        bot : discord.ext.commands.Bot
+            The bot the extensions are loaded into.
+        path : str
+            The path to the folder containing the extensions, ending with a slash.
+
+        """
+
+        self.bot = bot
+        self.extensions = find_extensions(path)
+        # The seconds taken to load each extension
+        self.timings = {}
+        # The stand-in commands of each extension that hasn't been loaded yet
+        self._stubs = {}
+        # The loads currently running, so an extension is never loaded twice at once
+        self._loading = {}
+
+    def _record(self, name, started, error=None):
+        """ Records and prints the time taken to load an extension, or the error that stopped it loading.
+
+        """
+
+        if error is not None:
+            exc = '{}: {}'.format(type(error).__name__, error)
+            print('Failed to load extension {}.\n{}'.format(name, exc))
+            return
+        self.timings[name] = time.perf_counter() - started
+        print("Loaded the {} extension in {:.1f}ms".format(name, self.timings[name] * 1000))
+
+    def load_all(self):
+        """ Imports and loads every extension, one after another.
+
+        """
+
+        for name in self.extensions:
+            self._add(name, time.perf_counter())
+
+    def _add(self, name, started):
+        """ Loads the given extension into the bot, replacing its stand-ins with the real commands. If the extension
+        fails to load, the stand-ins are put back so its commands still exist and their next use tries again.
+
+        """
+
+        stubs = self._stubs.pop(name, [])
+        # Removes the stand-ins so the real commands can be added
+        for command in stubs:
+            self.bot.remove_command(command)
+        try:
+            self.bot.load_extension(name)
+        # Handles errors loading the extension
+        except Exception as e:
+            self._stubs[name] = []
+            for command in stubs:
+                if self.bot.get_command(command) is None:
+                    self.bot.add_command(self._stub(name, command))
+                    self._stubs[name].append(command)
+            self._record(name, started, e)
+        else:
+            self._record(name, started)
+
+    def register_stubs(self):
+        """ Registers a stand-in for every command of every extension, which loads the extension on first use.
+
+        """
+
+        for name, file in self.extensions.items():
+            self._stubs[name] = []
+            for command in command_names(file):
+                # Leaves commands that already exist alone
+                if self.bot.get_command(command) is not None:
+                    continue
+                self.bot.add_command(self._stub(name, command))
+                self._stubs[name].append(command)
+
+    def _stub(self, name, command):
+        """ Creates the stand-in for the given command of the given extension.
+
+        """
+
+        async def stub(ctx, *args):
+            # Loads the extension, replacing the stand-ins with the real commands
+            await self.ensure_loaded(name)
+            # Runs the message again, now that the real command exists
+            if self.bot.get_command(command) is not None and name in self.bot.extensions:
+                await self.bot.process_commands(ctx.message)
+
+        return commands.command(name=command, hidden=True)(stub)
+
+    async def ensure_loaded(self, name):
+        """ Loads the given extension if it hasn't been loaded yet, importing it on a worker thread.
+
+        Parameters
+        ----------
+        name : str
+            The name of the extension.
+
+        """
+
+        if name in self.bot.extensions:
+            return
+        # Waits for the load that is already running
+        if name not in self._loading:
+            self._loading[name] = asyncio.ensure_future(self._load(name))
+        await asyncio.shield(self._loading[name])
+
+    async def _load(self, name):
+        """ Imports the given extension on a worker thread, then loads it into the bot on the event loop.
+
+        """
+
+        started = time.perf_counter()
+        try:
+            # Imports the extension and its dependencies without blocking the event loop
+            await asyncio.get_event_loop().run_in_executor(None, importlib.import_module, name)
+        # Handles errors importing the extension, leaving its stand-ins in place
+        except Exception as e:
+            self._record(name, started, e)
+        else:
+            self._add(name, started)
+        finally:
+            del self._loading[name]
+
+    async def warm(self):
+        """ Loads every extension that hasn't been loaded yet, importing them concurrently.
+
+        """
+
+        started = time.perf_counter()
+        await asyncio.gather(*[self.ensure_loaded(name) for name in self.extensions])
+        print("Warmed {} extensions in {:.1f}ms".format(len(self.extensions), (time.perf_counter() - started) * 1000))
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+""" This file contains the group registry, which keeps the groups made by the group commands in memory, indexed so
+that checking whether a group exists, finding the group of a role, and checking whether a member belongs to a group
+don't scan any lists.
+
+The registry is written through to the groups and group_members tables of the database, and each guild's groups are
+read from it the first time the guild is used. They are then checked once against discord's own view of the guild, to
+catch changes made while the bot was offline, and kept up to date by the member and role events the Groups cog listens
+to.
+
+Common Uses
+-----------
+Example:
+    registry = GroupRegistry(db_settings['path'])
+    groups = await registry.guild(guild)
+    if groups.reserve(name):
+        ...
+    groups.is_member(role.id, member.id)
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to load each guild only once when several commands need it at the same time
+import async_database  # Used to read and write the registry without blocking the bot
+
+
+class Group:
+    """ A group of a guild, with the ids of its role, category and channels, and of the members of its role.
+
+    """
+
+    __slots__ = ('name', 'role', 'category', 'channels', 'members')
+
+    def __init__(self, name, role, category, channels, members=()):
+        """ Constructs the Group class.
+
+        Parameters
+        ----------
+        name : str
+            The name of the group.
+        role : int
+            The id of the group's role.
+        category : int
+            The id of the group's category.
+        channels : dict
+            The ids of the group's channels, keyed by the names in database.GROUP_CHANNELS.
+        members : iterable
+            The ids of the members of the group's role.
+
+        """
+
+        self.name = name
+        self.role = role
+        self.category = category
+        self.channels = channels
+        self.members = set(members)
+
+
+class GuildGroups:
+    """ The groups of a single guild, indexed by name and by role.
+
+    """
+
+    def __init__(self, groups=()):
+        """ Constructs the GuildGroups class.
+
+        Parameters
+        ----------
+        groups : iterable
+            The Group objects of the guild.
+
+        """
+
+        self._by_name = {}
+        self._by_role = {}
+        # The names of the groups being created, which aren't in the registry yet
+        self._reserved = set()
+        for group in groups:
+            self._add(group)
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __iter__(self):
+        return iter(list(self._by_name.values()))
+
+    def get(self, name):
+        """ Gets the group with the given name, or None. Names are compared without case, like discord's channels.
+
+        """
+
+        return self._by_name.get(name.lower())
+
+    def by_role(self, role_id):
+        """ Gets the group of the role with the given id, or None if the role isn't a group's role.
+
+        """
+
+        return self._by_role.get(role_id)
+
+    def exists(self, name):
+        """ Whether the guild has a group with the given name.
+
+        """
+
+        return name.lower() in self._by_name
+
+    def is_member(self, role_id, member_id):
+        """ Whether the member with the given id belongs to the group of the role with the given id.
+
+        """
+
+        group = self._by_role.get(role_id)
+        return group is not None and member_id in group.members
+
+    def reserve(self, name):
+        """ Claims a name for a group that is about to be created, so the same group can't be created twice at once.
+
+        Returns
+        -------
+        bool
+            False if a group with the name exists or is being created, in which case the name isn't claimed.
+
+        """
+
+        key = name.lower()
+        if key in self._by_name or key in self._reserved:
+            return False
+        self._reserved.add(key)
+        return True
+
+    def claim(self, name):
+        """ Claims an existing group that is about to be deleted, so it can't be deleted twice at once, and no group
+        with its name can be created until it is released.
+
+        Returns
+        -------
+        Group
+            The group, or None if no group has the name or it is already being deleted.
+
+        """
+
+        key = name.lower()
+        group = self._by_name.get(key)
+        if group is None or key in self._reserved:
+            return None
+        self._reserved.add(key)
+        return group
+
+    def release(self, name):
+        """ Gives up a name claimed by reserve or claim, once its group has been created or deleted, or has failed to
+        be.
+
+        """
+
+        self._reserved.discard(name.lower())
+
+    def _add(self, group):
+        self._by_name[group.name.lower()] = group
+        self._by_role[group.role] = group
+
+    def _remove(self, group):
+        self._by_name.pop(group.name.lower(), None)
+        self._by_role.pop(group.role, None)
+
+
+class GroupRegistry:
+    """ The groups of every guild, read from the database a guild at a time and written through to it.
+
+    """
+
+    def __init__(self, path):
+        """ Constructs the GroupRegistry class.
+
+        Parameters
+        ----------
+        path : str
+            The path to the database.
+
+        """
+
+        self.path = path
+        self._guilds = {}
+        # The loads that are running, by guild id
+        self._loading = {}
+
+    def loaded(self, guild_id):
+        """ Gets the groups of the guild with the given id if they have been loaded, or None.
+
+        """
+
+        return self._guilds.get(guild_id)
+
+    async def guild(self, guild):
+        """ Gets the groups of the given guild, loading them the first time.
+
+        Parameters
+        ----------
+        guild : discord.Guild
+            The guild.
+
+        Returns
+        -------
+        GuildGroups
+            The groups of the guild.
+
+        Raises
+        ------
+        database.DatabaseError
+            If the groups couldn't be read.
+
+        """
+
+        groups = self._guilds.get(guild.id)
+        if groups is not None:
+            return groups
+        if guild.id not in self._loading:
+            self._loading[guild.id] = asyncio.ensure_future(self._load(guild))
+        # Shares the load between the commands waiting for it, without one being cancelled stopping it for the others
+        return await asyncio.shield(self._loading[guild.id])
+
+    async def _load(self, guild):
+        """ Reads the groups of the given guild, bringing them up to date with the guild's roles.
+
+        """
+
+        try:
+            rows = await async_database.get_groups(self.path, guild.id)
+            groups = GuildGroups(Group(*row) for row in rows)
+            for group in groups:
+                role = guild.get_role(group.role)
+                # Forgets the groups whose role was deleted while the bot was offline
+                if role is None:
+                    await async_database.del_group(self.path, guild.id, group.name, commit=True)
+                    groups._remove(group)
+                    continue
+                # Catches up with the members that joined or left the group while the bot was offline
+                members = {member.id for member in role.members}
+                if members - group.members:
+                    await async_database.add_group_members(self.path, guild.id, group.role, members - group.members,
+                                                           commit=True)
+                if group.members - members:
+                    await async_database.del_group_members(self.path, guild.id, group.role, group.members - members,
+                                                           commit=True)
+                group.members = members
+            self._guilds[guild.id] = groups
+            return groups
+        finally:
+            del self._loading[guild.id]
+
+    async def add(self, guild_id, name, role, category, channels, members=()):
+        """ Adds a newly created group to the registry of a loaded guild.
+
+        Parameters
+        ----------
+        guild_id : int
+            The id of the guild.
+        name : str
+            The name of the group.
+        role : int
+            The id of the group's role.
+        category : int
+            The id of the group's category.
+        channels : dict
+            The ids of the group's channels, keyed by the names in database.GROUP_CHANNELS.
+        members : iterable
+            The ids of the members of the group's role.
+
+        Returns
+        -------
+        Group
+            The group.
+
+        Raises
+        ------
+        database.DuplicateError
+            If the guild already has a group with the name.
+
+        """
+
+        group = Group(name, role, category, channels, members)
+        await async_database.ins_group(self.path, guild_id, name, role, category, channels, members=group.members,
+                                       commit=True)
+        self._guilds[guild_id]._add(group)
+        return group
+
+    async def remove(self, guild_id, name):
+        """ Removes a group from the registry of a loaded guild. Its role and channels are left alone.
+
+        Raises
+        ------
+        database.NotFoundError
+            If the guild has no group with the name.
+
+        """
+
+        await async_database.del_group(self.path, guild_id, name, commit=True)
+        groups = self._guilds[guild_id]
+        group = groups.get(name)
+        if group is not None:
+            groups._remove(group)
+
+    async def add_members(self, guild_id, role_id, member_ids):
+        """ Records that the given members were given a group's role, in a loaded guild.
+
+        """
+
+        group = self._guilds[guild_id].by_role(role_id)
+        new = set(member_ids) - group.members
+        if new:
+            await async_database.add_group_members(self.path, guild_id, role_id, new, commit=True)
+            group.members |= new
+
+    async def remove_members(self, guild_id, role_id, member_ids):
+        """ Records that the given members lost a group's role in a loaded guild, or left it when role_id is None.
+
+        """
+
+        groups = self._guilds[guild_id]
+        member_ids = set(member_ids)
+        affected = [groups.by_role(role_id)] if role_id is not None else \
+            [group for group in groups if group.members & member_ids]
+        if any(group.members & member_ids for group in affected):
+            await async_database.del_group_members(self.path, guild_id, role_id, member_ids, commit=True)
+            for group in affected:
+                group.members -= member_ids
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+""" This file contains the interaction manager, used by the cogs to wait for a user's answer to a prompt, such as the
+option picked after !wiki.
+
+Each open session waits for the next message of one user in one channel, and sessions are kept in a dict keyed by
+(channel id, user id). An incoming message is handed to its session with a single lookup, rather than every waiting
+command checking every message sent in every guild. Sessions expire after a timeout even if nothing is waiting on them
+any more, and opening a second session for the same user in the same channel replaces the first, so abandoned prompts
+can't pile up. The number of open sessions is kept in the pm_interaction_sessions gauge and shown by !stats.
+
+Common Uses
+-----------
+The session is opened before the prompt is sent, so an answer sent straight away isn't missed.
+Example:
+    with bot.interactions.open(channel, author, check=lambda m: m.content in choices) as session:
+        await prompt.send()
+        message = await session.wait()
+
+wait raises asyncio.TimeoutError if the session expired, and SessionReplaced if the user opened another session in the
+same channel.
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to wait for the answers and expire the sessions
+import metrics  # Used to count the sessions
+
+
+# Counts the sessions open and how they ended
+SESSIONS_OPEN = metrics.REGISTRY.add(metrics.Gauge('pm_interaction_sessions', 'Prompts waiting for an answer.'))
+SESSIONS = metrics.REGISTRY.add(metrics.Counter('pm_interaction_sessions_total', 'Prompts by how they ended.',
+                                                ('outcome',)))
+
+# The results a session ends with when it isn't answered
+_EXPIRED = object()
+_REPLACED = object()
+_CLOSED = object()
+
+
+class SessionReplaced(Exception):
+    """ Raised by Session.wait when the user opened another session in the same channel.
+
+    """
+
+
+class Session:
+    """ A prompt waiting for the next message of a user in a channel that passes its check.
+
+    """
+
+    def __init__(self, manager, key, check, timeout):
+        """ Constructs the Session class. Sessions are made by InteractionManager.open.
+
+        """
+
+        self.manager = manager
+        self.key = key
+        self.check = check
+        self.future = manager.loop.create_future()
+        self._timer = manager.loop.call_later(timeout, self._end, _EXPIRED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _end(self, result):
+        """ Ends the session with the given message or reason, removing it from its manager.
+
+        Returns
+        -------
+        bool
+            Whether the session was still open.
+
+        """
+
+        if self.future.done():
+            return False
+        self._timer.cancel()
+        self.future.set_result(result)
+        self.manager._remove(self)
+        SESSIONS.inc(outcome={_EXPIRED: 'expired', _REPLACED: 'replaced', _CLOSED: 'closed'}.get(result, 'answered'))
+        return True
+
+    async def wait(self):
+        """ Waits for the answer.
+
+        Returns
+        -------
+        discord.Message
+            The message that answered the prompt.
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            If the session expired before it was answered.
+        SessionReplaced
+            If the user opened another session in the same channel.
+
+        """
+
+        result = await asyncio.shield(self.future)
+        if result is _EXPIRED or result is _CLOSED:
+            raise asyncio.TimeoutError()
+        if result is _REPLACED:
+            raise SessionReplaced()
+        return result
+
+    def close(self):
+        """ Ends the session if it is still open, such as when the command waiting on it stops.
+
+        """
+
+        self._end(_CLOSED)
+
+
+class InteractionManager:
+    """ Keeps the open sessions of every cog, indexed by channel and user, and hands each message to its session.
+
+    """
+
+    def __init__(self, bot, timeout=60):
+        """ Constructs the InteractionManager class, listening to the messages of the given bot.
+
+        Parameters
+        ----------
+        bot : discord.ext.commands.Bot
+            The bot to listen to.
+        timeout : float
+            The number of seconds sessions are open for, unless another timeout is given when opening them.
+
+        """
+
+        self.loop = bot.loop
+        self.timeout = timeout
+        self._sessions = {}
+        bot.add_listener(self._on_message, 'on_message')
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def open(self, channel, user, check=None, timeout=None):
+        """ Opens a session waiting for the next message of the user in the channel, replacing any session the user
+        already has open there.
+
+        Parameters
+        ----------
+        channel : discord.abc.Messageable
+            The channel the answer is sent in.
+        user : discord.abc.User
+            The user answering.
+        check : callable
+            Called with each of the user's messages in the channel, returning whether it answers the prompt. Messages
+            that don't are ignored. None to take the next message.
+        timeout : float
+            The number of seconds the session is open for. Defaults to the manager's timeout.
+
+        Returns
+        -------
+        Session
+            The session, to be waited on and closed.
+
+        """
+
+        key = (channel.id, user.id)
+        previous = self._sessions.get(key)
+        if previous is not None:
+            previous._end(_REPLACED)
+        session = Session(self, key, check, self.timeout if timeout is None else timeout)
+        self._sessions[key] = session
+        SESSIONS_OPEN.set(len(self._sessions))
+        return session
+
+    def _remove(self, session):
+        """ Removes an ended session, unless it has already been replaced.
+
+        """
+
+        if self._sessions.get(session.key) is session:
+            del self._sessions[session.key]
+            SESSIONS_OPEN.set(len(self._sessions))
+
+    def dispatch(self, message):
+        """ Hands the message to the session of its author in its channel, if there is one and the message passes its
+        check.
+
+        Returns
+        -------
+        bool
+            Whether the message answered a session.
+
+        """
+
+        session = self._sessions.get((message.channel.id, message.author.id))
+        if session is None or (session.check is not None and not session.check(message)):
+            return False
+        return session._end(message)
+
+    async def _on_message(self, message):
+        """ Listens to every message of the bot.
+
+        """
+
+        self.dispatch(message)
+
+    def stats(self):
+        """ Gets the number of open sessions and how the sessions so far have ended.
+
+        """
+
+        ended = {outcome: count for (outcome,), count in SESSIONS.values().items()}
+        return {'open': len(self._sessions), 'answered': ended.get('answered', 0),
+                'expired': ended.get('expired', 0), 'replaced': ended.get('replaced', 0),
+                'closed': ended.get('closed', 0)}
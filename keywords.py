@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+""" This file contains the keyword index, used to suggest the definitions a user may have meant when they ask for one
+that doesn't exist.
+
+Each guild's keywords are indexed by their trigrams, the runs of three letters in the keyword padded with spaces, so
+that "deadline" is found from "dedline" or "deadlines". Keywords are ranked by the share of their trigrams they have in
+common with what was asked for. A lookup only reads the keywords that could share enough of them, so it stays within a
+few milliseconds for guilds with tens of thousands of definitions.
+
+The index of a guild is built the first time the guild has a miss, and kept up to date as definitions are inserted and
+deleted. Only the most recently used guilds are kept in memory.
+
+Common Uses
+-----------
+Example:
+    index = KeywordIndex(max_guilds=256)
+    index.suggest(server, 'dedline', load=lambda: read_keywords(server))
+    index.add(server, 'deadline')
+
+Todo
+----
+*
+
+"""
+from collections import Counter  # Used to count the trigrams each keyword shares with a lookup
+from itertools import chain  # Used to count the keywords of several trigrams in one pass
+from math import ceil, floor  # Used to work out the keywords that can be similar enough
+import threading  # Used to make the index safe to use across threads
+from cache import LRUCache, MISSING  # Used to keep only the most recently used guilds in memory
+
+
+def trigrams(word):
+    """ Gets the trigrams of a word, ignoring case. The word is padded so its start and end count for more.
+
+    Parameters
+    ----------
+    word : str
+        The word.
+
+    Returns
+    -------
+    set
+        The trigrams of the word.
+
+    """
+
+    padded = '  {} '.format(word.lower())
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """ The keywords of a single guild, indexed by trigram. Not thread-safe on its own.
+
+    The keywords are also split by their number of trigrams, as a keyword can only be similar enough to the query if
+    its number of trigrams is close to the query's. Only the keywords of those sizes are read, and of them only the
+    ones found under the query's rarest trigrams, as a keyword missing from all of those can't share enough trigrams.
+
+    """
+
+    # The similarities tried in turn, loosening until enough keywords are found
+    STEPS = (0.7, 0.5)
+
+    def __init__(self, keywords=()):
+        """ Constructs the TrigramIndex class.
+
+        Parameters
+        ----------
+        keywords : iterable
+            The keywords to index.
+
+        """
+
+        # The keywords having each trigram, by the number of trigrams of the keywords
+        self._postings = {}
+        # The number of trigrams of each keyword
+        self._sizes = {}
+        for keyword in keywords:
+            self.add(keyword)
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def add(self, keyword):
+        """ Adds a keyword to the index.
+
+        """
+
+        if keyword in self._sizes:
+            return
+        grams = trigrams(keyword)
+        self._sizes[keyword] = len(grams)
+        postings = self._postings.setdefault(len(grams), {})
+        for gram in grams:
+            postings.setdefault(gram, set()).add(keyword)
+
+    def discard(self, keyword):
+        """ Removes a keyword from the index, if it is in it.
+
+        """
+
+        size = self._sizes.pop(keyword, None)
+        if size is None:
+            return
+        postings = self._postings[size]
+        for gram in trigrams(keyword):
+            keywords = postings[gram]
+            keywords.discard(keyword)
+            if not keywords:
+                del postings[gram]
+        if not postings:
+            del self._postings[size]
+
+    def _search(self, grams, similarity):
+        """ Finds every keyword whose Dice coefficient with the given trigrams is at least the given similarity.
+
+        Returns
+        -------
+        list
+            (similarity, keyword) tuples, in no order.
+
+        """
+
+        n = len(grams)
+        found = []
+        # A keyword of m trigrams sharing all it can still needs 2m / (n + m) >= similarity, and the other way round
+        for m in range(ceil(similarity * n / (2 - similarity) - 1e-9), floor((2 - similarity) * n / similarity) + 1):
+            postings = self._postings.get(m)
+            if not postings:
+                continue
+            # The number of trigrams a keyword of m trigrams has to share
+            needed = ceil(similarity * (n + m) / 2 - 1e-9)
+            lists = sorted((postings.get(gram, ()) for gram in grams), key=len)
+            # A keyword sharing enough trigrams has at least one of the n - needed + 1 rarest
+            rare = n - needed + 1
+            for keyword, count in Counter(chain.from_iterable(lists[:rare])).items():
+                for i in range(rare, n):
+                    if count + n - i < needed:
+                        break
+                    if keyword in lists[i]:
+                        count += 1
+                if count >= needed:
+                    found.append((2 * count / (n + m), keyword))
+        return found
+
+    def suggest(self, query, limit=3, min_similarity=0.3):
+        """ Finds the keywords closest to the query.
+
+        Parameters
+        ----------
+        query : str
+            The keyword that was asked for.
+        limit : int
+            The maximum number of keywords to return.
+        min_similarity : float
+            The smallest share of trigrams, between 0 and 1, a keyword must have in common with the query.
+
+        Returns
+        -------
+        list
+            The closest keywords, closest first.
+
+        """
+
+        grams = trigrams(query)
+        # Tries the strictest similarity first, which reads the fewest keywords. If enough keywords are at least that
+        # similar, the closest ones are among them
+        for similarity in [s for s in self.STEPS if s > min_similarity] + [min_similarity]:
+            found = [(s, keyword) for s, keyword in self._search(grams, similarity) if keyword != query]
+            if len(found) >= limit:
+                break
+        # Ranks the keywords by the Dice coefficient of their trigrams, breaking ties with the closest length
+        found.sort(key=lambda item: (-item[0], abs(len(item[1]) - len(query)), item[1]))
+        return [keyword for _, keyword in found[:limit]]
+
+
+class KeywordIndex:
+    """ The trigram indexes of the most recently used guilds of a database, loaded when first needed.
+
+    """
+
+    def __init__(self, max_guilds=256):
+        """ Constructs the KeywordIndex class.
+
+        Parameters
+        ----------
+        max_guilds : int
+            The maximum number of guilds kept in memory.
+
+        """
+
+        self._guilds = LRUCache(max_entries=max_guilds)
+        # Held while the indexes are read or changed, but not while a guild is loaded, so loading a large guild doesn't
+        # hold up the writes of every other guild
+        self._lock = threading.Lock()
+        # The changes made to each guild being loaded, replayed onto its index once built so none are lost
+        self._pending = {}
+        # The number of loads of each guild in progress
+        self._loading = {}
+        # Counts the invalidations, so an index loaded from before one isn't kept
+        self._generation = 0
+
+    def suggest(self, server, query, load, limit=3):
+        """ Finds the keywords of a guild closest to the query, loading the guild's index if it isn't in memory.
+
+        Parameters
+        ----------
+        server : int
+            The server id of the guild.
+        query : str
+            The keyword that was asked for.
+        load : callable
+            Called to read every keyword of the guild when its index isn't in memory.
+        limit : int
+            The maximum number of keywords to return.
+
+        Returns
+        -------
+        list
+            The closest keywords, closest first.
+
+        """
+
+        with self._lock:
+            index = self._guilds.get(server)
+            if index is not MISSING:
+                return index.suggest(query, limit=limit)
+            # Records the changes made while the guild is loaded
+            self._pending.setdefault(server, [])
+            self._loading[server] = self._loading.get(server, 0) + 1
+            generation = self._generation
+        try:
+            index = TrigramIndex(load())
+        except BaseException:
+            with self._lock:
+                self._done_loading(server)
+            raise
+        with self._lock:
+            # Replays every change since the load started. Changes already read by the load do nothing
+            for add, keyword in self._done_loading(server):
+                if add:
+                    index.add(keyword)
+                else:
+                    index.discard(keyword)
+            # Keeps the index unless another load kept one first, or the guild was invalidated while loading
+            if self._guilds.get(server) is MISSING and generation == self._generation:
+                self._guilds.put(server, index)
+            return index.suggest(query, limit=limit)
+
+    def _done_loading(self, server):
+        """ Ends a load of a guild, getting the changes made to it since the load started. Must hold the lock.
+
+        """
+
+        changes = self._pending[server]
+        self._loading[server] -= 1
+        if not self._loading[server]:
+            del self._loading[server]
+            del self._pending[server]
+        return changes
+
+    def add(self, server, keyword):
+        """ Adds a keyword that was committed to the database to its guild's index, if the guild is in memory.
+
+        """
+
+        with self._lock:
+            index = self._guilds.get(server)
+            if index is not MISSING:
+                index.add(keyword)
+            if server in self._pending:
+                self._pending[server].append((True, keyword))
+
+    def discard(self, server, keyword):
+        """ Removes a keyword that was deleted from the database from its guild's index, if the guild is in memory.
+
+        """
+
+        with self._lock:
+            index = self._guilds.get(server)
+            if index is not MISSING:
+                index.discard(keyword)
+            if server in self._pending:
+                self._pending[server].append((False, keyword))
+
+    def invalidate_server(self, server):
+        """ Drops the index of a guild after many of its keywords changed at once, to be loaded again when needed.
+
+        """
+
+        with self._lock:
+            self._guilds.pop(server)
+            self._generation += 1
+
+    def clear(self):
+        """ Drops the index of every guild.
+
+        """
+
+        with self._lock:
+            self._guilds.clear()
+            self._generation += 1
+
+    def stats(self):
+        """ Gets the statistics of the guilds kept in memory. See cache.LRUCache.stats.
+
+        """
+
+        return self._guilds.stats()
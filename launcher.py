@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+""" This file is used to run the bot across several processes, each running some of its shards, for when one process
+can't keep up with every guild. To start the bot sharded, run this file instead of main.py.
+
+Explanation
+-----------
+* Prepares the database once before starting the workers
+* Splits the shards between the worker processes, each running main.py with the shards it owns
+* Restarts the workers that exit, waiting longer after each crash in a row
+* Serves the metrics of every worker on one endpoint, labelled by worker, with the health of the workers at /health
+* Stops the workers when stopped itself
+
+Discord sends each guild's events to shard (guild id >> 22) % shard count, so every guild is owned by a single worker.
+The workers share the database, which is safe as it is in write-ahead logging mode and the writers wait on each other's
+locks, and as each guild's definitions are only written, and cached, by the worker that owns it.
+
+Usage
+-----
+    python launcher.py [--shards N] [--processes N] [--token live|dev] [--load eager|lazy|background]
+
+The shard and process counts default to the shard settings. --token must be given unless PM_BOT_MODE is set.
+
+Todo
+----
+*
+
+"""
+
+from settings import *  # Imports all of the settings variables
+from extensions import MODES  # Used to check the load mode given to the workers
+import storage  # Used to prepare the database before the workers start
+import metrics  # Used to serve the metrics of every worker together
+import argparse  # Used to read the options given on the command line
+import asyncio  # Used to run and watch the workers
+import json  # Used to format the health of the workers
+import logging  # Used to log the workers starting and exiting
+import os  # Used to read the options given in the environment
+import signal  # Used to stop the workers when the launcher is stopped
+import sys  # Used to start the workers with the same python
+import time  # Used to time the uptime of the workers
+
+
+# The logger of the launcher
+log = logging.getLogger('launcher')
+
+# The metrics of the launcher itself, served along with the workers'
+REGISTRY = metrics.Registry()
+WORKER_UP = REGISTRY.add(metrics.Gauge('pm_worker_up', 'Whether each worker process is running.', ('worker',)))
+WORKER_RESTARTS = REGISTRY.add(metrics.Counter('pm_worker_restarts_total', 'Worker processes restarted after exiting.',
+                                               ('worker',)))
+
+
+def assign_shards(shard_count, processes):
+    """ Splits the shards between the processes, as evenly as they can be.
+
+    Parameters
+    ----------
+    shard_count : int
+        The number of shards the guilds are split between.
+    processes : int
+        The number of worker processes.
+
+    Returns
+    -------
+    list
+        The shard ids of each process.
+
+    """
+
+    return [list(range(i, shard_count, processes)) for i in range(min(processes, shard_count))]
+
+
+class Worker:
+    """ A worker process, running main.py with some of the shards of the bot.
+
+    """
+
+    def __init__(self, index, shard_ids, shard_count, metrics_port, options):
+        """ Constructs the Worker class.
+
+        Parameters
+        ----------
+        index : int
+            The number of the worker, used to label its metrics.
+        shard_ids : list
+            The ids of the shards the worker runs.
+        shard_count : int
+            The number of shards across every worker.
+        metrics_port : int
+            The port the worker serves its metrics on, on localhost. None if it doesn't serve them.
+        options : list
+            The command line options passed on to main.py, such as the token to use.
+
+        """
+
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.metrics_port = metrics_port
+        self.options = options
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.last_exit = None
+
+    def command(self):
+        """ Gets the command line the worker is started with.
+
+        """
+
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'),
+                   '--shards', ','.join(str(s) for s in self.shard_ids), '--shard-count', str(self.shard_count)]
+        command += self.options
+        if self.metrics_port is not None:
+            command += ['--metrics-port', str(self.metrics_port)]
+        return command
+
+    async def start(self):
+        """ Starts the process of the worker.
+
+        """
+
+        self.process = await asyncio.create_subprocess_exec(*self.command(), stdin=asyncio.subprocess.DEVNULL)
+        self.started = time.monotonic()
+        WORKER_UP.set(1, worker=self.index)
+        log.info("worker started worker=%s pid=%s shards=%s", self.index, self.process.pid, self.shard_ids)
+
+    async def wait(self):
+        """ Waits for the process of the worker to exit.
+
+        Returns
+        -------
+        int
+            The exit code of the process.
+
+        """
+
+        code = await self.process.wait()
+        self.last_exit = code
+        WORKER_UP.set(0, worker=self.index)
+        return code
+
+    async def stop(self, timeout=10):
+        """ Asks the worker to stop, killing it if it hasn't stopped within the given number of seconds.
+
+        """
+
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("worker didn't stop, killing it worker=%s pid=%s", self.index, self.process.pid)
+            self.process.kill()
+            await self.process.wait()
+
+    async def scrape(self, timeout=2):
+        """ Reads the metrics of the worker.
+
+        Returns
+        -------
+        str
+            The page of metrics of the worker, or None if it couldn't be read.
+
+        """
+
+        if self.metrics_port is None or self.process is None or self.process.returncode is not None:
+            return None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', self.metrics_port), timeout)
+            try:
+                writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+                response = await asyncio.wait_for(reader.read(), timeout)
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError):
+            return None
+        head, _, body = response.partition(b'\r\n\r\n')
+        if not head.startswith(b'HTTP/1.1 200'):
+            return None
+        return body.decode('utf-8')
+
+    def health(self):
+        """ Gets the state of the worker.
+
+        """
+
+        running = self.process is not None and self.process.returncode is None
+        return {'worker': self.index, 'shards': self.shard_ids, 'running': running,
+                'pid': self.process.pid if running else None,
+                'uptime': round(time.monotonic() - self.started, 1) if running else 0,
+                'restarts': self.restarts, 'last_exit': self.last_exit}
+
+
+class Launcher:
+    """ Runs the workers of the bot, restarting them when they exit, and serves their metrics together.
+
+    """
+
+    def __init__(self, shard_count, processes, options, restart_delay=1, restart_max_delay=60, stable_after=60):
+        """ Constructs the Launcher class.
+
+        Parameters
+        ----------
+        shard_count : int
+            The number of shards the guilds are split between.
+        processes : int
+            The number of worker processes the shards are run in.
+        options : list
+            The command line options passed on to every worker.
+        restart_delay : float
+            The number of seconds waited before restarting a worker that exited, doubled for each exit in a row.
+        restart_max_delay : float
+            The longest number of seconds waited before restarting a worker.
+        stable_after : float
+            The number of seconds a worker has to run for before its earlier exits are forgotten.
+
+        """
+
+        base_port = shard_settings['metrics_port']
+        self.workers = [Worker(i, shard_ids, shard_count, None if base_port is None else base_port + i, options)
+                        for i, shard_ids in enumerate(assign_shards(shard_count, processes))]
+        self.restart_delay = restart_delay
+        self.restart_max_delay = restart_max_delay
+        self.stable_after = stable_after
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        """ Stops the workers and the launcher.
+
+        """
+
+        self._stopping.set()
+
+    async def _supervise(self, worker):
+        """ Runs the given worker until the launcher stops, restarting it whenever it exits.
+
+        """
+
+        crashes = 0
+        while not self._stopping.is_set():
+            await worker.start()
+            exited = asyncio.ensure_future(worker.wait())
+            stopping = asyncio.ensure_future(self._stopping.wait())
+            await asyncio.wait((exited, stopping), return_when=asyncio.FIRST_COMPLETED)
+            if not exited.done():
+                stopping.cancel()
+                await worker.stop()
+                await exited
+                break
+            stopping.cancel()
+            # Forgets the earlier exits of a worker that had been running for a while
+            crashes = 0 if time.monotonic() - worker.started >= self.stable_after else crashes + 1
+            delay = min(self.restart_delay * 2 ** max(crashes - 1, 0), self.restart_max_delay)
+            log.error("worker exited worker=%s code=%s restarting_in=%.1fs", worker.index, worker.last_exit, delay)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                worker.restarts += 1
+                WORKER_RESTARTS.inc(worker=worker.index)
+
+    async def _metrics_page(self):
+        """ Renders the metrics of the launcher and of every worker, labelled by worker.
+
+        """
+
+        pages = await asyncio.gather(*(worker.scrape() for worker in self.workers))
+        return 'text/plain; version=0.0.4; charset=utf-8', metrics.merge(
+            [(None, REGISTRY.render())] + [(w.index, page) for w, page in zip(self.workers, pages) if page])
+
+    async def _health_page(self):
+        """ Renders the state of every worker as JSON.
+
+        """
+
+        workers = [worker.health() for worker in self.workers]
+        return 'application/json', json.dumps({'healthy': all(w['running'] for w in workers), 'workers': workers})
+
+    async def run(self):
+        """ Runs the workers until the launcher is stopped.
+
+        """
+
+        server = None
+        if metrics_settings['port'] is not None:
+            pages = {'/': self._metrics_page, '/metrics': self._metrics_page, '/health': self._health_page}
+            server = await metrics.serve(metrics_settings['host'], metrics_settings['port'], pages=pages)
+            print("Serving the metrics of every worker on http://{}:{}/metrics".format(metrics_settings['host'],
+                                                                                      metrics_settings['port']))
+        try:
+            await asyncio.gather(*(self._supervise(worker) for worker in self.workers))
+        finally:
+            if server is not None:
+                server.close()
+
+
+if __name__ == "__main__":
+    """ Starts the workers of the bot, and keeps them running until stopped.
+
+    """
+
+    # Reads the options given on the command line
+    parser = argparse.ArgumentParser(description="Runs the bot's shards across several processes")
+    parser.add_argument('--shards', type=int, default=shard_settings['shard_count'],
+                        help='the number of shards the guilds are split between')
+    parser.add_argument('--processes', type=int, default=shard_settings['processes'],
+                        help='the number of worker processes the shards are run in')
+    parser.add_argument('--token', choices=('live', 'dev'), default=os.environ.get('PM_BOT_MODE') or None,
+                        required=not os.environ.get('PM_BOT_MODE'),
+                        help='which bot token the workers use. Defaults to PM_BOT_MODE, required if it is not set')
+    parser.add_argument('--load', choices=MODES, default=os.environ.get('PM_BOT_LOAD', bot_settings['load_mode']),
+                        help='how the workers load the command extensions')
+    args = parser.parse_args()
+    if args.shards < 1 or args.processes < 1:
+        parser.error('--shards and --processes must be at least 1')
+    # The defaults from the environment aren't checked against the choices, and a worker given a bad one would exit
+    # on every restart
+    if args.token not in ('live', 'dev'):
+        parser.error('PM_BOT_MODE must be live or dev, not {!r}'.format(args.token))
+    if args.load not in MODES:
+        parser.error('PM_BOT_LOAD must be one of {}, not {!r}'.format(', '.join(MODES), args.load))
+    logging.basicConfig(level=bot_settings['log_level'], format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    # Prepares the database before any worker uses it
+    applied = storage.bootstrap(db_settings['path'], pool_size=db_settings['pool_size'],
+                                pragmas=db_settings['pragmas'])
+    if applied:
+        print("Migrated the database to version {}.".format(applied[-1]))
+
+    launcher = Launcher(args.shards, args.processes, ['--token', args.token, '--load', args.load],
+                        restart_delay=shard_settings['restart_delay'],
+                        restart_max_delay=shard_settings['restart_max_delay'],
+                        stable_after=shard_settings['stable_after'])
+    for worker in launcher.workers:
+        print("Worker {} runs shards {} of {}.".format(worker.index, worker.shard_ids, args.shards))
+    loop = asyncio.get_event_loop()
+    # Stops the workers when the launcher is interrupted or terminated
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, launcher.stop)
+        except NotImplementedError:
+            pass
+    try:
+        loop.run_until_complete(launcher.run())
+    finally:
+        loop.close()
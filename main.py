@@ -5,11 +5,21 @@ If there is no applicable category, make a new category by creating a new catego
 
 Explanation
 -----------
-* Sets the bot variable up
-* Imports all the commands from the commands folder
-* Asks which bot token to use, the dev or live token
+* Sets the bot variable up, running only some of its shards when started by launcher.py
+* Loads the commands from the commands folder, eagerly, lazily on first use or in the background (--load)
+* Moves the definitions stored before the blob store existed into it, in the background
+* Picks which bot token to use, the dev or live token, from --token, PM_BOT_MODE, or by asking
 * Starts the bot
 
+Usage
+-----
+    python main.py [--token live|dev] [--load eager|lazy|background] [--metrics-port PORT]
+    python main.py --shards 0,2 --shard-count 4 ...
+
+launcher.py starts main.py with --shards and --shard-count to run the bot across several processes.
+
+PM_BOT_TOKEN can be set to run with a token that isn't in the settings.
+
 Todo
 ----
 *
@@ -18,69 +28,246 @@ Todo
 
 from discord.ext import commands  # Used to create commands for the bot
 from settings import *  # Imports all of the settings variables
-import glob  # Used to retrieve all of the files in the command directory and load all bot commands
+from scheduler import Scheduler  # Used to queue every request the cogs make to discord
+from extensions import ExtensionLoader, MODES  # Used to load the command extensions
+import database  # Used to setup the database connection pool
+import storage  # Used to prepare the database and migrate its schema
+import metrics  # Used to instrument the commands and serve the metrics
+import watchdog  # Used to catch the event loop stalling
+from interactions import InteractionManager  # Used to wait for the answers to the prompts of the cogs
+import async_database  # Used to batch the database writes and stop the worker threads on shutdown
+import argparse  # Used to read the options given on the command line
+import logging  # Used to log the failures of the bot
+import os  # Used to read the options given in the environment
+import sys  # Used to check whether the bot is being run interactively
+import time  # Used to time the command setup
+
+
+def create_bot(shard_ids=None, shard_count=None, metrics_port=metrics_settings['port']):
+    """ Sets the bot up, with the scheduler and instrumentation shared by the cogs.
+
+    Parameters
+    ----------
+    shard_ids : list
+        The ids of the shards to run, when launcher.py splits the shards of the bot between processes. None to run
+        every guild on a single connection.
+    shard_count : int
+        The number of shards across every process.
+    metrics_port : int
+        The port the metrics are served on, None to not serve them.
+
+    Returns
+    -------
+    discord.ext.commands.Bot
+        The bot, without its commands.
+
+    """
+
+    # Setup the bot, running only the given shards when the guilds are split between processes
+    if shard_count is not None:
+        bot = commands.AutoShardedBot(command_prefix=bot_settings['symbol'], description=bot_settings['description'],
+                                      shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        bot = commands.Bot(command_prefix=bot_settings['symbol'], description=bot_settings['description'])
+    # Sets up the scheduler shared by the cogs for their requests to discord
+    bot.scheduler = Scheduler(routes=scheduler_settings['routes'], global_rate=scheduler_settings['global_rate'],
+                              concurrency=scheduler_settings['concurrency'])
+    # Sets up the prompts shared by the cogs, handing each message to the prompt waiting for it
+    bot.interactions = InteractionManager(bot, timeout=bot_settings['prompt_timeout'])
+    # Records the latency of every command
+    metrics.instrument_bot(bot)
+    # The metrics endpoint and event loop lag monitor, started once the bot is ready
+    bot.metrics_tasks = None
+    # Logs the stack of the event loop whenever it is blocked for too long, started once the bot is ready
+    bot.watchdog = None
+
+    @bot.event
+    async def on_ready():
+        """ Prints out information when the bot is started.
+
+        """
+
+        # Prints out bot information
+        print('--------------------')
+        print('Logged in as')
+        print(bot.user.name)
+        print(bot.user.id)
+        if shard_count is not None:
+            print('Shards {} of {}'.format(', '.join(str(s) for s in shard_ids), shard_count))
+        print('--------------------')
+
+        # Starts measuring the event loop and serving the metrics, only the first time the bot is ready
+        if bot.metrics_tasks is None:
+            bot.metrics_tasks = [bot.loop.create_task(metrics.LagMonitor(metrics_settings['lag_interval']).run())]
+            if metrics_port is not None:
+                try:
+                    await metrics.serve(metrics_settings['host'], metrics_port)
+                except OSError as e:
+                    logging.getLogger(__name__).error("metrics endpoint failed port=%s detail=%r", metrics_port,
+                                                      str(e))
+                else:
+                    print("Serving metrics on http://{}:{}/metrics".format(metrics_settings['host'], metrics_port))
+        # Starts watching for stalls of the event loop, only the first time the bot is ready
+        if bot.watchdog is None and watchdog_settings['enabled']:
+            bot.watchdog = watchdog.StallWatchdog(threshold=watchdog_settings['stall_threshold'],
+                                                  interval=watchdog_settings['check_interval'],
+                                                  keep=watchdog_settings['keep_stalls'])
+            bot.watchdog.start(bot.loop)
 
+    return bot
 
-# Setup the bot
-bot = commands.Bot(command_prefix=bot_settings['symbol'], description=bot_settings['description'])
 
+async def migrate_blobs(path):
+    """ Moves the definitions stored before the blob store existed into it, while the bot runs, then prints the space
+    that was saved. Stopping part way is safe, the rest are moved the next time the bot starts.
 
-@bot.event
-async def on_ready():
-    """ Prints out information when the bot is started.
+    Parameters
+    ----------
+    path : str
+        The path to the database.
 
     """
 
-    # Prints out bot information
-    print('--------------------')
-    print('Logged in as')
-    print(bot.user.name)
-    print(bot.user.id)
-    print('--------------------')
+    try:
+        stats = await async_database.blob_stats(path)
+        if not stats['unmoved']:
+            return
+        print("Moving {} definitions into the blob store in the background.".format(stats['unmoved']))
+        stats = await async_database.migrate_blobs(path, batch_size=db_settings['migrate_batch'],
+                                                   pause=db_settings['migrate_pause'])
+    except database.DatabaseError as e:
+        logging.getLogger(__name__).error("blob migration failed detail=%r", str(e))
+        return
+    print("Moved the definitions into the blob store: {} definitions stored as {} texts ({} compressed), {:.1f} KiB "
+          "down to {:.1f} KiB, saving {:.1%}.".format(stats['definitions'], stats['blobs'], stats['compressed'],
+                                                   stats['text_bytes'] / 1024, stats['stored_bytes'] / 1024,
+                                                   stats['saved']))
+
+
+def select_token(choice):
+    """ Picks the bot token to use, from the given choice, the environment, or by asking if neither is given and the
+    bot is being run interactively. Exits if PM_BOT_MODE isn't live or dev, or if nothing picks the token and there
+    is nobody to ask.
+
+    Parameters
+    ----------
+    choice : str
+        'live' or 'dev' to pick the token, or None if it wasn't given on the command line.
+
+    Returns
+    -------
+    str
+        The token to run the bot with.
+
+    """
+
+    # A token given in the environment is used as is
+    if os.environ.get('PM_BOT_TOKEN'):
+        print("The bot will be started using the token from PM_BOT_TOKEN.")
+        return os.environ['PM_BOT_TOKEN']
+    # Falls back on the environment when the choice wasn't given on the command line
+    choice = choice or os.environ.get('PM_BOT_MODE') or None
+    # Refuses a misspelled mode rather than guessing which token was meant
+    if choice not in (None, 'live', 'dev'):
+        sys.exit("PM_BOT_MODE must be live or dev, not {!r}.".format(choice))
+    # Asks only when there is nobody to ask otherwise
+    if choice is None:
+        # Never starts on the live token without being told to
+        if not sys.stdin.isatty():
+            sys.exit("No bot token was picked, give --token live|dev or set PM_BOT_MODE.")
+        # Gets user input to select which bot token to use
+        select = input('Run using the live bot (1) or the dev bot (2) token?\n>')
+        # Loops until the input was valid
+        while select != '1' and select != '2':
+            select = input('Please only use input 1 for the live bot or 2 for the dev bot token.\n>')
+        choice = 'live' if select == '1' else 'dev'
+    # Sets token to appropriate value based on the choice
+    if choice == 'dev':
+        print("The bot will be started using the development version token.\n")
+        return bot_settings['dev_token']
+    print("The bot will be started using the live version token.")
+    return bot_settings['live_token']
 
 
 if __name__ == "__main__":
     """ The main function of the bot, which is used to actually start the bot. Also adds the extensions from the
-    command folder. Allows user to specify which bot token to use, picking between a live and development version.
-    
+    command folder. Allows user to specify which bot token to use, picking between a live and development version,
+    and how the extensions should be loaded.
+
     """
 
+    # Reads the options given on the command line
+    parser = argparse.ArgumentParser(description=bot_settings['description'])
+    parser.add_argument('--token', choices=('live', 'dev'),
+                        help='which bot token to use. Defaults to PM_BOT_MODE, or asks when run interactively')
+    parser.add_argument('--load', choices=MODES, default=os.environ.get('PM_BOT_LOAD', bot_settings['load_mode']),
+                        help='how the command extensions are loaded')
+    parser.add_argument('--shards', type=lambda text: [int(s) for s in text.split(',')],
+                        help='the comma separated ids of the shards to run, as given by launcher.py')
+    parser.add_argument('--shard-count', type=int,
+                        help='the number of shards across every process, as given by launcher.py')
+    parser.add_argument('--metrics-port', type=int, default=metrics_settings['port'],
+                        help='the port the metrics are served on')
+    args = parser.parse_args()
+    if (args.shards is None) != (args.shard_count is None):
+        parser.error('--shards and --shard-count must be given together')
+    # Logs the failures of the bot, such as failed queries, as key=value pairs after the logger's name
+    logging.basicConfig(level=bot_settings['log_level'], format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    # Sets the bot up, with only the given shards when run by launcher.py
+    bot = create_bot(args.shards, args.shard_count, args.metrics_port)
+
     # Heading sent to output at beginning of the command setup
     print("START COMMAND SETUP\n-------------------")
-    # Load all of the command extensions from the commands folder by looping through .py files
-    for file in glob.glob("{}*.py".format(bot_settings['c_path'])):
-        # Converts the file name to the acceptable string for the load_extension method
-        file = file.rstrip('.py')  # Strips the .py extension
-        file = file.replace('/', '.')  # Replaces the /'s in the path with .'s
-        file = file.replace('\\', '.')  # Replaces the \'s in the path with .'s
-        # Tries to load the given extension
-        try:
-            # Loads the extension
-            bot.load_extension(file)
-            # Outputs successful loading message
-            print("Loaded the {} extension".format(file))
-        # Handles errors loading the extension
-        except ModuleNotFoundError as e:
-            # Outputs error message
-            exc = '{}: {}'.format(type(e).__name__, e)
-            print('Failed to load extension {}.\n{}'.format(file, exc))
+    started = time.perf_counter()
+    # Finds the command extensions in the commands folder
+    loader = ExtensionLoader(bot, bot_settings['c_path'])
+    bot.extension_loader = loader
+    # Loads all of the command extensions now
+    if args.load == 'eager':
+        loader.load_all()
+    # Registers stand-ins that load each extension on first use
+    else:
+        loader.register_stubs()
+        print("Registered {} extensions to load {}.".format(
+            len(loader.extensions), "on first use" if args.load == 'lazy' else "in the background"))
+        # Starts loading every extension concurrently as soon as the bot is running
+        if args.load == 'background':
+            bot.loop.create_task(loader.warm())
     # Outputs a message saying command setup phase completed
-    print("Command setup phase complete.\n")
+    print("Command setup phase complete in {:.1f}ms.\n".format((time.perf_counter() - started) * 1000))
+
+    # Creates the connection pool of the database with the configured size and pragmas, and brings its schema up to
+    # date
+    applied = storage.bootstrap(db_settings['path'], pool_size=db_settings['pool_size'],
+                                pragmas=db_settings['pragmas'])
+    if applied:
+        print("Migrated the database to version {}.".format(applied[-1]))
+    # Creates the definition cache of the database with the configured limits
+    database.configure_cache(db_settings['path'], max_entries=db_settings['cache_entries'],
+                             max_bytes=db_settings['cache_bytes'], ttl=db_settings['cache_ttl'],
+                             max_guilds=db_settings['cache_guilds'])
+    # Sets how the definitions are compressed in the blob store
+    database.configure_blobs(db_settings['path'], compress_above=db_settings['compress_above'],
+                             level=db_settings['compress_level'])
+    # Moves the definitions stored before the blob store existed into it, only from one process when sharded
+    if args.shards is None or 0 in args.shards:
+        bot.loop.create_task(migrate_blobs(db_settings['path']))
+    # Creates the keyword index of the database, used to suggest definitions, with the configured limit
+    database.configure_keyword_index(db_settings['path'], max_guilds=def_settings['suggest_guilds'])
+    # Sets how long writes wait to be committed together, and how many may be
+    async_database.configure_batching(db_settings['path'], window=db_settings['batch_window'],
+                                      max_batch=db_settings['batch_size'])
 
     # Heading sent to output to signify the beginning of the specification phase
     print("START SELECT PHASE\n------------------")
-    # Gets user input to select which bot token to use
-    select = input('Run using the live bot (1) or the dev bot (2) token?\n>')
-    # Loops until the input was valid
-    while select != '1' and select != '2':
-        select = input('Please only use input 1 for the live bot or 2 for the dev bot token.\n>')
-    # Sets token to appropriate value based on select variable
-    if select == '1':
-        token = bot_settings['live_token']
-        print("The bot will be started using the live version token.")
-    elif select == '2':
-        token = bot_settings['dev_token']
-        print("The bot will be started using the development version token.\n")
+    token = select_token(args.token)
 
     # Runs the bot
     bot.run(token)
+    # Stops watching the event loop, so the stop isn't logged as a stall
+    if bot.watchdog is not None:
+        bot.watchdog.stop()
+    # Lets the queued queries finish, then closes the database connections once the bot has stopped
+    async_database.shutdown()
+    database.close_pools()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+""" This file contains the bulk membership operations, used to change the roles of many members at once.
+
+The members are handled concurrently, with the requests queued as bulk work on the bot's scheduler so a large batch
+stays within discord's rate limits and doesn't hold up replies to other users.
+Each member's outcome is reported on its own, so one member the bot can't change doesn't stop the rest.
+
+Common Uses
+-----------
+Example:
+    results = await add_roles(members, roles, bot.scheduler)
+    failed = [result for result in results if result.error is not None]
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to handle the members concurrently
+import discord  # Used for error handling
+from scheduler import BULK  # Used to queue the role changes as bulk work
+
+
+class MemberResult:
+    """ The outcome of a bulk membership operation for a single member.
+
+    Attributes
+    ----------
+    member : discord.Member
+        The member.
+    changed : list
+        The roles that were changed for the member.
+    skipped : list
+        The roles that didn't need changing, as the member already had (or didn't have) them.
+    error : Exception
+        The error that stopped the member's roles from being changed, or None.
+
+    """
+
+    def __init__(self, member, changed=(), skipped=(), error=None):
+        self.member = member
+        self.changed = list(changed)
+        self.skipped = list(skipped)
+        self.error = error
+
+    @property
+    def ok(self):
+        """ Whether the member's roles were changed, or didn't need changing.
+
+        """
+
+        return self.error is None
+
+
+async def add_roles(members, roles, scheduler, has_role=None):
+    """ Adds the given roles to every given member, skipping the roles each member already has.
+
+    Parameters
+    ----------
+    members : iterable
+        The discord.Member objects to add the roles to.
+    roles : list
+        The discord.Role objects to be added.
+    scheduler : scheduler.Scheduler
+        Used to make the requests. Requests are paced per guild, like discord does for member role changes.
+    has_role : callable
+        Called with a member and a role to check whether the member already has the role. Defaults to looking
+        through the member's roles.
+
+    Returns
+    -------
+    list
+        The MemberResult of each member, in the order the members were given.
+
+    """
+
+    if has_role is None:
+        def has_role(member, role):
+            return role in member.roles
+
+    async def add(member):
+        # Only adds the roles the member doesn't have yet
+        missing = [role for role in roles if not has_role(member, role)]
+        skipped = [role for role in roles if has_role(member, role)]
+        if not missing:
+            return MemberResult(member, skipped=skipped)
+        try:
+            await scheduler.call(('add_roles', member.guild.id), member.add_roles, *missing, priority=BULK)
+        # Reports the failure of this member without stopping the others
+        except discord.HTTPException as e:
+            return MemberResult(member, skipped=skipped, error=e)
+        return MemberResult(member, changed=missing, skipped=skipped)
+
+    return await asyncio.gather(*[add(member) for member in members])
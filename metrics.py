@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+""" This file contains the instrumentation of the bot: the latency of every command, the timing of every database
+query, the number of requests made to discord, and the lag of the event loop.
+
+The measurements are kept in memory by a Registry, and can be read in the Prometheus text format from a small HTTP
+endpoint on localhost, or summarised in discord with !stats.
+
+Metrics
+-------
+pm_command_seconds{command, status}
+    Histogram of the time from a command being invoked to it completing or failing.
+pm_commands_in_flight
+    Gauge of the commands currently running.
+pm_db_query_seconds{operation}
+    Histogram of the time taken by each database helper, cache hits included.
+pm_db_query_errors_total{operation, error}
+    Counter of the database helpers that raised, by error type.
+pm_api_requests_total{route, outcome}
+    Counter of the requests the scheduler made to discord, by kind of route.
+pm_api_wait_seconds{priority}
+    Histogram of the time requests waited in the scheduler before starting.
+pm_loop_lag_seconds
+    Histogram of how late the event loop woke up the lag monitor.
+
+Common Uses
+-----------
+Example:
+    metrics.instrument_bot(bot)
+    bot.loop.create_task(metrics.LagMonitor().run())
+    server = await metrics.serve('127.0.0.1', 9108)
+    page = metrics.merge([(0, worker_page), (1, other_worker_page)])
+
+    @metrics.timed_query('get_def')
+    def get_def(...):
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to monitor the event loop and serve the endpoint
+import bisect  # Used to find the bucket of an observation
+import collections  # Used to keep the metrics in order when merging the pages of several processes
+import functools  # Used to wrap the timed functions and give the endpoint its pages
+import logging  # Used to log the commands that fail
+import threading  # Used to make the metrics safe to update from worker threads
+import time  # Used to time the commands and queries
+
+
+# The upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The upper bounds of the event loop lag buckets, in seconds
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# The logger of the instrumentation
+log = logging.getLogger(__name__)
+
+
+class _Metric:
+    """ A metric holding a value per combination of label values.
+
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        """ Constructs the metric.
+
+        Parameters
+        ----------
+        name : str
+            The name of the metric.
+        help : str
+            The description of the metric.
+        labels : tuple
+            The names of the labels of the metric.
+
+        """
+
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """ Gets the label values in the order of the metric's labels.
+
+        """
+
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format_labels(self, key, extra=()):
+        """ Formats label values as {name="value",...}.
+
+        """
+
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in pairs) + '}'
+
+    def render(self):
+        """ Formats the metric in the Prometheus text format.
+
+        """
+
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return ['{}{} {}'.format(self.name, self._format_labels(key), value)]
+
+
+class Counter(_Metric):
+    """ A count that only goes up.
+
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """ Adds to the count of the given labels.
+
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        """ Gets the count of every combination of labels, keyed by label values.
+
+        """
+
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(_Metric):
+    """ A value that goes up and down.
+
+    """
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """ Sets the value of the given labels.
+
+        """
+
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        """ Adds to the value of the given labels.
+
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """ Takes away from the value of the given labels.
+
+        """
+
+        self.inc(-amount, **labels)
+
+
+class _Buckets:
+    """ The observations of a histogram for one combination of labels.
+
+    """
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram(_Metric):
+    """ A distribution of observations, counted into buckets.
+
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """ Constructs the Histogram class.
+
+        Parameters
+        ----------
+        name : str
+            The name of the metric.
+        help : str
+            The description of the metric.
+        labels : tuple
+            The names of the labels of the metric.
+        buckets : tuple
+            The upper bounds of the buckets, in increasing order.
+
+        """
+
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """ Records an observation for the given labels.
+
+        """
+
+        key = self._key(labels)
+        # Observations over the last bound go in the +Inf bucket, at the end
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = _Buckets(len(self.buckets) + 1)
+            data.counts[index] += 1
+            data.count += 1
+            data.sum += value
+            data.max = max(data.max, value)
+
+    def summary(self):
+        """ Summarises the observations of every combination of labels.
+
+        Returns
+        -------
+        dict
+            Keyed by label values, the count, sum, max, and the p50 and p99 estimated as the upper bound of the
+            bucket they fall in.
+
+        """
+
+        with self._lock:
+            items = [(key, list(data.counts), data.count, data.sum, data.max) for key, data in self._values.items()]
+        summary = {}
+        for key, counts, count, total, largest in items:
+            summary[key] = {'count': count, 'sum': total, 'max': largest,
+                            'p50': self._quantile(counts, count, largest, 0.5),
+                            'p99': self._quantile(counts, count, largest, 0.99)}
+        return summary
+
+    def _quantile(self, counts, count, largest, q):
+        """ Estimates a quantile as the upper bound of the bucket it falls in, capped by the largest observation.
+
+        """
+
+        rank = q * count
+        seen = 0
+        for bound, bucket in zip(self.buckets + (largest,), counts):
+            seen += bucket
+            if seen >= rank and bucket:
+                return min(bound, largest)
+        return largest
+
+    def _render_value(self, key, data):
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, data.counts):
+            cumulative += bucket
+            lines.append('{}_bucket{} {}'.format(self.name, self._format_labels(key, [('le', bound)]), cumulative))
+        lines.append('{}_bucket{} {}'.format(self.name, self._format_labels(key, [('le', '+Inf')]), data.count))
+        lines.append('{}_sum{} {}'.format(self.name, self._format_labels(key), data.sum))
+        lines.append('{}_count{} {}'.format(self.name, self._format_labels(key), data.count))
+        return lines
+
+
+class Registry:
+    """ The metrics of the bot, rendered together.
+
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self.started = time.time()
+
+    def add(self, metric):
+        """ Adds a metric to the registry, returning it.
+
+        """
+
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Formats every metric in the Prometheus text format.
+
+        """
+
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# The registry of the bot, and its metrics
+REGISTRY = Registry()
+COMMAND_SECONDS = REGISTRY.add(Histogram('pm_command_seconds', 'Time taken by each command.', ('command', 'status')))
+COMMANDS_IN_FLIGHT = REGISTRY.add(Gauge('pm_commands_in_flight', 'Commands currently running.'))
+DB_QUERY_SECONDS = REGISTRY.add(Histogram('pm_db_query_seconds', 'Time taken by each database helper.',
+                                          ('operation',)))
+DB_QUERY_ERRORS = REGISTRY.add(Counter('pm_db_query_errors_total', 'Database helpers that raised.',
+                                       ('operation', 'error')))
+API_REQUESTS = REGISTRY.add(Counter('pm_api_requests_total', 'Requests made to discord.', ('route', 'outcome')))
+API_WAIT_SECONDS = REGISTRY.add(Histogram('pm_api_wait_seconds', 'Time requests waited in the scheduler.',
+                                          ('priority',)))
+LOOP_LAG_SECONDS = REGISTRY.add(Histogram('pm_loop_lag_seconds', 'How late the event loop woke up.',
+                                          buckets=LAG_BUCKETS))
+
+
+def timed_query(operation):
+    """ Makes a decorator timing every call of a database helper, and counting the ones that raise.
+
+    Parameters
+    ----------
+    operation : str
+        The name the calls are recorded under.
+
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                DB_QUERY_ERRORS.inc(operation=operation, error=type(e).__name__)
+                raise
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+
+def instrument_bot(bot):
+    """ Hooks the command events of the bot, recording the latency of every command. Failed commands are logged, as
+    the bot stops printing them itself once something listens for on_command_error.
+
+    Parameters
+    ----------
+    bot : discord.ext.commands.Bot
+        The bot to instrument.
+
+    """
+
+    # The start time of each running command, by its context. A lazily loaded command's stand-in runs the same message
+    # again once loaded, so the message id isn't unique to a run
+    started = {}
+
+    async def on_command(ctx):
+        started[id(ctx)] = time.perf_counter()
+        COMMANDS_IN_FLIGHT.inc()
+
+    def finish(ctx, status):
+        start = started.pop(id(ctx), None)
+        if start is None:
+            return
+        COMMANDS_IN_FLIGHT.dec()
+        COMMAND_SECONDS.observe(time.perf_counter() - start, command=ctx.command.qualified_name, status=status)
+
+    async def on_command_completion(ctx):
+        finish(ctx, 'ok')
+
+    async def on_command_error(ctx, error):
+        finish(ctx, 'error')
+        original = getattr(error, 'original', error)
+        # Errors raised inside commands are bugs or outages, the rest are users mistyping or lacking permissions
+        if original is not error:
+            log.error("command failed command=%s guild=%s error=%s", ctx.command, getattr(ctx.guild, 'id', None),
+                      type(original).__name__, exc_info=(type(original), original, original.__traceback__))
+        else:
+            log.info("command rejected command=%s guild=%s error=%s detail=%r", ctx.command,
+                     getattr(ctx.guild, 'id', None), type(error).__name__, str(error))
+
+    bot.add_listener(on_command, 'on_command')
+    bot.add_listener(on_command_completion, 'on_command_completion')
+    bot.add_listener(on_command_error, 'on_command_error')
+
+
+class LagMonitor:
+    """ Measures how late the event loop is to wake up a sleeping task, which is how long other work blocked it.
+
+    """
+
+    def __init__(self, interval=0.5):
+        """ Constructs the LagMonitor class.
+
+        Parameters
+        ----------
+        interval : float
+            The number of seconds slept between measurements.
+
+        """
+
+        self.interval = interval
+
+    async def run(self):
+        """ Measures the lag of the event loop until cancelled.
+
+        """
+
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - start - self.interval))
+
+
+async def _render_registry():
+    """ Renders the metrics of the bot, as the default page of the endpoint.
+
+    """
+
+    return 'text/plain; version=0.0.4; charset=utf-8', REGISTRY.render()
+
+
+async def _handle(pages, reader, writer):
+    """ Answers a single HTTP request to the metrics endpoint.
+
+    """
+
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        # Reads the headers, which aren't needed
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request.decode('latin-1').split()
+        page = pages.get(parts[1].split('?')[0]) if len(parts) >= 2 and parts[0] == 'GET' else None
+        if page is not None:
+            content_type, text = await page()
+            status, body = '200 OK', text.encode('utf-8')
+        else:
+            content_type, status, body = 'text/plain; charset=utf-8', '404 Not Found', b'not found\n'
+        writer.write('HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(status, content_type, len(body)).encode('latin-1') + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=9108, pages=None):
+    """ Starts serving the metrics in the Prometheus text format over HTTP, on the event loop of the bot.
+
+    Parameters
+    ----------
+    host : str
+        The address to listen on. Keep it on localhost unless the port is firewalled.
+    port : int
+        The port to listen on.
+    pages : dict
+        The pages served, keyed by path, as coroutine functions returning the content type and text of the page.
+        Defaults to the metrics of the bot on / and /metrics.
+
+    Returns
+    -------
+    asyncio.AbstractServer
+        The server, closed to stop serving.
+
+    """
+
+    pages = {'/': _render_registry, '/metrics': _render_registry} if pages is None else pages
+    return await asyncio.start_server(functools.partial(_handle, pages), host, port)
+
+
+def merge(pages, label='worker'):
+    """ Merges the metrics of several processes into one page, telling them apart with a label. The samples of each
+    metric are kept together, under a single HELP and TYPE, as the Prometheus text format needs.
+
+    Parameters
+    ----------
+    pages : list
+        The (label value, page) pairs to merge, in order. Pages with a label value of None are merged as they are.
+    label : str
+        The name of the label added to the samples.
+
+    Returns
+    -------
+    str
+        The merged page in the Prometheus text format.
+
+    """
+
+    # The header and samples of each metric, in the order they were first seen
+    families = collections.OrderedDict()
+    for value, page in pages:
+        family = None
+        for line in page.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith('#'):
+                parts = line.split(None, 3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    family = families.setdefault(parts[2], ([], []))
+                    if len(family[0]) < 2:
+                        family[0].append(line)
+                continue
+            if family is None:
+                family = families.setdefault(line.split('{')[0].split()[0], ([], []))
+            if value is not None:
+                name, brace, rest = line.partition('{')
+                if brace:
+                    line = '{}{{{}="{}",{}'.format(name, label, value, rest)
+                else:
+                    name, _, rest = line.partition(' ')
+                    line = '{}{{{}="{}"}} {}'.format(name, label, value, rest)
+            family[1].append(line)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+""" This file contains the provisioning engine, used to create several related objects (such as the role, category and
+channels of a group) concurrently, cleaning up after itself if any of them can't be created.
+
+Common Uses
+-----------
+Each step is given the results of the steps before it, and only starts once the steps it requires have finished.
+Steps that don't depend on each other run at the same time.
+Example:
+    provisioner = Provisioner()
+    provisioner.add('role', lambda r: guild.create_role(name=name), undo=lambda role: role.delete())
+    provisioner.add('category', lambda r: guild.create_category(name), undo=lambda c: c.delete(),
+                    requires=['role'])
+    results = await provisioner.run()
+
+If a step fails, the steps still running are cancelled and every finished step is undone, dependents first, before a
+ProvisioningError is raised.
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to run the steps concurrently
+
+
+class ProvisioningError(Exception):
+    """ Raised when a step fails. Everything that had been created has been undone by the time it is raised.
+
+    Attributes
+    ----------
+    step : str
+        The name of the step that failed.
+    original : Exception
+        The exception raised by the step.
+    undo_errors : list
+        The (step, exception) pairs of the steps that could not be undone.
+
+    """
+
+    def __init__(self, step, original, undo_errors):
+        super().__init__("{} failed: {}".format(step, original))
+        self.step = step
+        self.original = original
+        self.undo_errors = undo_errors
+
+
+class _Step:
+    """ A single step of a provisioning run.
+
+    """
+
+    def __init__(self, name, func, undo, requires):
+        self.name = name
+        self.func = func
+        self.undo = undo
+        self.requires = list(requires)
+
+
+class Provisioner:
+    """ Runs a set of dependent steps concurrently, undoing the finished ones if any step fails.
+
+    """
+
+    def __init__(self):
+        """ Constructs the Provisioner class.
+
+        """
+
+        # The steps in the order they were added
+        self._steps = []
+
+    def add(self, name, func, undo=None, requires=()):
+        """ Adds a step to be run.
+
+        Parameters
+        ----------
+        name : str
+            The name of the step, used as the key of its result.
+        func : callable
+            Called with the dict of results of the steps before it, returning an awaitable of the step's result.
+        undo : callable
+            Called with the step's result to undo the step, returning an awaitable. None if nothing needs undoing.
+        requires : iterable
+            The names of the steps that must finish before this step starts. They must already have been added.
+
+        """
+
+        # Checks the required steps exist, which also keeps the steps free of cycles
+        names = [step.name for step in self._steps]
+        for required in requires:
+            if required not in names:
+                raise ValueError("step {} requires {}, which hasn't been added".format(name, required))
+        if name in names:
+            raise ValueError("step {} has already been added".format(name))
+        self._steps.append(_Step(name, func, undo, requires))
+
+    async def run(self):
+        """ Runs every step, each as soon as the steps it requires have finished.
+
+        Returns
+        -------
+        dict
+            The results of the steps, keyed by their names.
+
+        Raises
+        ------
+        ProvisioningError
+            If a step fails, after the finished steps have been undone.
+
+        """
+
+        results = {}
+        # The steps that finished, in the order they finished
+        finished = []
+        # The name and exception of the first step to fail
+        failure = []
+        tasks = {}
+
+        async def run_step(step):
+            # Waits for the required steps
+            if step.requires:
+                await asyncio.gather(*[tasks[name] for name in step.requires])
+            try:
+                results[step.name] = await step.func(results)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failure.append((step.name, e))
+                raise
+            finished.append(step)
+            return results[step.name]
+
+        # Starts every step, in the order they were added so required tasks always exist
+        for step in self._steps:
+            tasks[step.name] = asyncio.ensure_future(run_step(step))
+        try:
+            await asyncio.gather(*tasks.values())
+        except Exception as e:
+            # Stops the steps still running, and waits for them to stop
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            undo_errors = await self._undo(finished, results)
+            name, original = failure[0] if failure else ('unknown', e)
+            raise ProvisioningError(name, original, undo_errors) from original
+        return results
+
+    async def _undo(self, finished, results):
+        """ Undoes the given finished steps concurrently, each only once the finished steps requiring it are undone.
+
+        Parameters
+        ----------
+        finished : list
+            The steps that finished.
+        results : dict
+            The results of the steps.
+
+        Returns
+        -------
+        list
+            The (step, exception) pairs of the steps that could not be undone.
+
+        """
+
+        errors = []
+        undos = {}
+
+        async def undo_step(step):
+            # Waits for the steps that depend on this one to be undone first
+            dependents = [undos[s.name] for s in finished if step.name in s.requires and s.name in undos]
+            if dependents:
+                await asyncio.gather(*dependents)
+            if step.undo is None:
+                return
+            try:
+                await step.undo(results[step.name])
+            except Exception as e:
+                errors.append((step.name, e))
+
+        # Creates the undos of dependents first, so they exist when the steps they require look for them
+        for step in reversed(finished):
+            undos[step.name] = asyncio.ensure_future(undo_step(step))
+        if undos:
+            await asyncio.gather(*undos.values())
+        return errors
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+""" This file contains the rate limiting used to keep bursts of requests to discord within discord's rate limits.
+
+discord.py backs off once discord answers with a 429, stalling every request on that route. The token buckets here
+are used by the scheduler to pace requests ahead of time instead.
+
+Common Uses
+-----------
+Example:
+    bucket = TokenBucket(rate=10, per=10)
+    if bucket.delay() == 0:
+        bucket.take()
+
+Todo
+----
+*
+
+"""
+import time  # Used to refill the buckets
+
+
+class TokenBucket:
+    """ A token bucket, allowing bursts of up to rate requests, refilled at rate requests per per seconds.
+
+    """
+
+    def __init__(self, rate, per):
+        """ Constructs the TokenBucket class.
+
+        Parameters
+        ----------
+        rate : int
+            The number of requests allowed per period, which is also the largest burst allowed.
+        per : float
+            The length of the period in seconds.
+
+        """
+
+        self.rate = rate
+        self.per = per
+        # Starts full so the first burst isn't delayed
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        """ Adds the tokens earned since the last refill.
+
+        """
+
+        now = time.monotonic()
+        self._tokens = min(float(self.rate), self._tokens + (now - self._updated) * self.rate / self.per)
+        self._updated = now
+
+    def delay(self):
+        """ Gets how long until a token is available.
+
+        Returns
+        -------
+        float
+            The number of seconds until a token is available, 0 if one is available now.
+
+        """
+
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) * self.per / self.rate
+
+    def take(self):
+        """ Takes a token, which may leave the bucket in debt if none were available.
+
+        """
+
+        self._refill()
+        self._tokens -= 1
+
+    def full(self):
+        """ Gets whether the bucket has refilled completely, so it is the same as a new bucket.
+
+        Returns
+        -------
+        bool
+            True if every token is available.
+
+        """
+
+        self._refill()
+        return self._tokens >= self.rate
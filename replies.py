@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+""" This file contains the reply builder shared by the cogs, used to send a command's output as few messages as
+possible.
+
+Rather than sending a message per line, a command adds its lines to a Reply and sends it once. The lines are joined
+into a single message, or an embed, and only split into several messages when they go over discord's length limit.
+
+Common Uses
+-----------
+Example:
+    reply = Reply(self.bot.scheduler, channel)
+    reply.add("Please Specify an Option:")
+    for i, title in enumerate(titles):
+        reply.add("{}: {}".format(i+1, title))
+    await reply.send()
+
+Todo
+----
+*
+
+"""
+import discord  # Used to build embeds
+from scheduler import INTERACTIVE  # Used as the default priority of replies
+
+
+# The maximum length of a message's content
+MESSAGE_LIMIT = 2000
+# The maximum length of an embed's description
+EMBED_LIMIT = 2048
+
+
+def split(text, limit=MESSAGE_LIMIT):
+    """ Splits the given text into chunks no longer than the limit, at line breaks where possible.
+
+    Parameters
+    ----------
+    text : str
+        The text to be split.
+    limit : int
+        The maximum length of a chunk.
+
+    Returns
+    -------
+    list
+        The chunks of the text, in order.
+
+    """
+
+    chunks = []
+    current = ''
+    for line in text.split('\n'):
+        # Breaks lines that are too long on their own at the limit
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        # Starts a new chunk when the line doesn't fit in the current one
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = line if not current else current + '\n' + line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class Reply:
+    """ Collects the output of a command, sending it as one message or embed, split only at the length limit.
+
+    """
+
+    def __init__(self, scheduler, channel, priority=INTERACTIVE):
+        """ Constructs the Reply class.
+
+        Parameters
+        ----------
+        scheduler : scheduler.Scheduler
+            The scheduler the messages are sent through.
+        channel : discord.abc.Messageable
+            The channel the reply is sent to.
+        priority : int
+            The priority the messages are sent with.
+
+        """
+
+        self.scheduler = scheduler
+        self.channel = channel
+        self.priority = priority
+        # The lines of the reply
+        self.lines = []
+
+    def add(self, line):
+        """ Adds a line to the reply.
+
+        Parameters
+        ----------
+        line : str
+            The line to be added.
+
+        Returns
+        -------
+        Reply
+            The reply, so calls can be chained.
+
+        """
+
+        self.lines.append(str(line))
+        return self
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    async def send(self, embed=False, title=None, colour=None):
+        """ Sends the reply, as few messages as the length limit allows.
+
+        Parameters
+        ----------
+        embed : bool
+            Whether to send the reply as embeds rather than plain messages.
+        title : str
+            The title of the embeds. Only used with embed.
+        colour : discord.Colour
+            The colour of the embeds. Only used with embed.
+
+        Returns
+        -------
+        list
+            The messages sent.
+
+        """
+
+        text = '\n'.join(self.lines)
+        messages = []
+        # Sends nothing for an empty reply
+        if not text:
+            return messages
+        for chunk in split(text, EMBED_LIMIT if embed else MESSAGE_LIMIT):
+            if embed:
+                kwargs = {'description': chunk}
+                if title is not None:
+                    kwargs['title'] = title
+                if colour is not None:
+                    kwargs['colour'] = colour
+                messages.append(await self.scheduler.send(self.channel, embed=discord.Embed(**kwargs),
+                                                          priority=self.priority))
+            else:
+                messages.append(await self.scheduler.send(self.channel, content=chunk, priority=self.priority))
+        return messages
+
+
+async def reply(scheduler, channel, *lines, **kwargs):
+    """ Sends the given lines as a single reply. See Reply.send for the keyword arguments.
+
+    Parameters
+    ----------
+    scheduler : scheduler.Scheduler
+        The scheduler the messages are sent through.
+    channel : discord.abc.Messageable
+        The channel the reply is sent to.
+    lines : str
+        The lines of the reply.
+
+    Returns
+    -------
+    list
+        The messages sent.
+
+    """
+
+    builder = Reply(scheduler, channel)
+    for line in lines:
+        builder.add(line)
+    return await builder.send(**kwargs)
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+""" This file contains the outbound request scheduler, which every cog uses to talk to discord.
+
+Rather than each cog calling channel.send, guild.create_* or add_roles directly and finding out about discord's rate
+limits through 429 back-offs, every request is queued with the scheduler. It keeps a token bucket per route, plus a
+global bucket, and only starts a request once the route has budget for it. Interactive replies are queued ahead of bulk
+admin work, so a large create_groups doesn't hold up someone's !get_def.
+
+Routes
+------
+A route is a tuple of the kind of request and its major parameter, such as ('send', channel.id) or
+('create_channel', guild.id). The budget of each kind is set through the routes given to the scheduler.
+
+Common Uses
+-----------
+Example:
+    await bot.scheduler.send(channel, "Definition added!")
+    role = await bot.scheduler.call(('create_role', guild.id), guild.create_role, name=name, priority=BULK)
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to run the dispatcher and the requests
+import heapq  # Used to find the next request to start without sorting the queue
+import itertools  # Used to keep requests of the same priority in order
+import time  # Used to measure how long requests wait
+from ratelimit import TokenBucket  # Used to track the budget of each route
+import metrics  # Used to count the requests made to discord
+
+
+# The priority of replies to users, which are sent before anything else
+INTERACTIVE = 0
+# The priority of admin work touching many objects, which waits behind replies
+BULK = 1
+
+# The budget of each kind of route, as (requests, per seconds), loosely matching discord's limits
+DEFAULT_ROUTES = {
+    'send': (5, 5),
+    'create_role': (10, 10),
+    'create_channel': (10, 10),
+    'add_roles': (10, 10),
+    'remove_roles': (10, 10),
+    'edit': (10, 10),
+    'delete': (5, 5),
+    'history': (5, 5),
+}
+
+# The number of seconds between sweeps of the buckets of routes that are no longer used
+SWEEP_INTERVAL = 60
+
+
+class _Request:
+    """ A request waiting in the scheduler's queue.
+
+    """
+
+    def __init__(self, priority, seq, route, factory, future):
+        self.priority = priority
+        self.seq = seq
+        self.route = route
+        self.factory = factory
+        self.future = future
+        self.queued = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Scheduler:
+    """ Queues outbound requests per route, starting each one once its route and the global budget allow it,
+    highest priority first.
+
+    """
+
+    def __init__(self, routes=None, default=(5, 5), global_rate=(50, 1), concurrency=4):
+        """ Constructs the Scheduler class.
+
+        Parameters
+        ----------
+        routes : dict
+            The budget of each kind of route, as kind: (requests, per seconds). Defaults to DEFAULT_ROUTES.
+        default : tuple
+            The budget of kinds not in routes.
+        global_rate : tuple
+            The budget of all requests together.
+        concurrency : int
+            The maximum number of requests running at once on a single route.
+
+        """
+
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.default = default
+        self.concurrency = concurrency
+        self._global = TokenBucket(*global_rate)
+        # The bucket and number of running requests of each route
+        self._buckets = {}
+        self._running = {}
+        # The requests waiting to start, in a heap per route
+        self._queues = {}
+        # The first request of each route that may be able to start, in a heap across the routes. Routes left out are
+        # parked, mapped to True while waiting for their budget to refill, kept in _timers as (time, seq, route), and
+        # to False while waiting for one of their running requests to finish
+        self._heads = []
+        self._parked = {}
+        self._timers = []
+        self._seq = itertools.count()
+        self._swept = time.monotonic()
+        # Set whenever the dispatcher may have something new to start
+        self._wake = None
+        self._dispatcher = None
+        # The statistics of the scheduler, per priority
+        self._stats = {p: {'requests': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'errors': 0}
+                       for p in (INTERACTIVE, BULK)}
+
+    def _bucket(self, route):
+        """ Gets the bucket of the given route, creating it if needed.
+
+        """
+
+        if route not in self._buckets:
+            self._buckets[route] = TokenBucket(*self.routes.get(route[0], self.default))
+        return self._buckets[route]
+
+    def _sweep(self):
+        """ Drops the buckets of the routes with nothing queued or running whose budget has refilled, as a new bucket
+        would be the same, so buckets aren't kept for every channel ever sent to.
+
+        """
+
+        self._swept = time.monotonic()
+        for route, bucket in list(self._buckets.items()):
+            if route not in self._queues and route not in self._running and bucket.full():
+                del self._buckets[route]
+
+    def _push_head(self, route):
+        """ Offers the first request of the given route to the dispatcher, dropping the requests whose caller has given
+        up on them along the way.
+
+        """
+
+        queue = self._queues[route]
+        while queue and queue[0].future.cancelled():
+            heapq.heappop(queue)
+        if not queue:
+            del self._queues[route]
+            return
+        heapq.heappush(self._heads, queue[0])
+
+    def _unpark(self, route):
+        """ Offers the first request of a parked route to the dispatcher again.
+
+        """
+
+        del self._parked[route]
+        if route in self._queues:
+            self._push_head(route)
+
+    async def submit(self, route, factory, priority=INTERACTIVE):
+        """ Queues a request, waiting for it to be run.
+
+        Parameters
+        ----------
+        route : tuple
+            The route of the request, such as ('send', channel.id).
+        factory : callable
+            Called with no arguments once the request may start, returning the awaitable making the request.
+        priority : int
+            INTERACTIVE for replies to users, BULK for admin work.
+
+        Returns
+        -------
+        object
+            The result of the request.
+
+        """
+
+        loop = asyncio.get_event_loop()
+        # Starts the dispatcher the first time a request is submitted
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wake = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        request = _Request(priority, next(self._seq), route, factory, loop.create_future())
+        queue = self._queues.setdefault(route, [])
+        heapq.heappush(queue, request)
+        # Offers the request straight away if it is now first on its route. A parked route offers it once unparked
+        if queue[0] is request and route not in self._parked:
+            heapq.heappush(self._heads, request)
+        self._wake.set()
+        return await request.future
+
+    def call(self, route, func, *args, priority=INTERACTIVE, **kwargs):
+        """ Queues a call of the given coroutine function. See submit.
+
+        Returns
+        -------
+        coroutine
+            Awaited to get the result of the call.
+
+        """
+
+        return self.submit(route, lambda: func(*args, **kwargs), priority=priority)
+
+    def send(self, channel, *args, priority=INTERACTIVE, **kwargs):
+        """ Queues a message to be sent to the given channel. Takes the same arguments as channel.send.
+
+        Returns
+        -------
+        coroutine
+            Awaited to get the message sent.
+
+        """
+
+        return self.call(('send', channel.id), channel.send, *args, priority=priority, **kwargs)
+
+    async def _dispatch(self):
+        """ Starts the queued requests as their routes' budgets allow, highest priority first.
+
+        """
+
+        while True:
+            now = time.monotonic()
+            if now - self._swept >= SWEEP_INTERVAL:
+                self._sweep()
+            # Offers the routes whose budget has refilled again
+            while self._timers and self._timers[0][0] <= now:
+                self._unpark(heapq.heappop(self._timers)[2])
+            delay = self._timers[0][0] - now if self._timers else None
+            if self._heads:
+                request = self._heads[0]
+                queue = self._queues.get(request.route)
+                # Skips offers that are out of date, as the request was started or overtaken, or its route parked
+                if queue is None or queue[0] is not request or request.route in self._parked:
+                    heapq.heappop(self._heads)
+                    continue
+                # Offers the next request of the route instead of one whose caller has given up on it
+                if request.future.cancelled():
+                    heapq.heappop(self._heads)
+                    self._push_head(request.route)
+                    continue
+                wait = self._global.delay()
+                # Waits for the global budget without losing the request's place
+                if wait > 0:
+                    delay = wait if delay is None else min(delay, wait)
+                else:
+                    heapq.heappop(self._heads)
+                    bucket = self._bucket(request.route)
+                    wait = bucket.delay()
+                    # Parks the route, keeping the requests on it in order, until it can start another request
+                    if wait > 0 or self._running.get(request.route, 0) >= self.concurrency:
+                        self._parked[request.route] = wait > 0
+                        if wait > 0:
+                            heapq.heappush(self._timers, (now + wait, next(self._seq), request.route))
+                        continue
+                    # Starts the request
+                    heapq.heappop(queue)
+                    if queue:
+                        heapq.heappush(self._heads, queue[0])
+                    else:
+                        del self._queues[request.route]
+                    bucket.take()
+                    self._global.take()
+                    self._running[request.route] = self._running.get(request.route, 0) + 1
+                    asyncio.ensure_future(self._run(request))
+                    continue
+            # Waits until a budget refills, a request finishes, or a new request is queued
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, request):
+        """ Runs a request, passing its result or exception to the caller.
+
+        """
+
+        waited = time.monotonic() - request.queued
+        stats = self._stats[request.priority]
+        stats['requests'] += 1
+        stats['wait_total'] += waited
+        stats['wait_max'] = max(stats['wait_max'], waited)
+        metrics.API_WAIT_SECONDS.observe(waited, priority='bulk' if request.priority == BULK else 'interactive')
+        try:
+            result = await request.factory()
+        except Exception as e:
+            stats['errors'] += 1
+            metrics.API_REQUESTS.inc(route=request.route[0], outcome='error')
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            metrics.API_REQUESTS.inc(route=request.route[0], outcome='ok')
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._running[request.route] -= 1
+            if not self._running[request.route]:
+                del self._running[request.route]
+            # Lets the dispatcher start the next request on the route, unless it is waiting for its budget instead
+            if self._parked.get(request.route) is False:
+                self._unpark(request.route)
+            self._wake.set()
+
+    def stats(self):
+        """ Gets the statistics of the scheduler.
+
+        Returns
+        -------
+        dict
+            The number of queued requests under 'queued', the queued requests of each kind of route under 'depth',
+            the number of running requests under 'running', and the number of requests, total and max wait in
+            seconds, and errors of each priority under 'interactive' and 'bulk'.
+
+        """
+
+        depth = {}
+        for route, queue in self._queues.items():
+            depth[route[0]] = depth.get(route[0], 0) + len(queue)
+        return {
+            'queued': sum(depth.values()),
+            'depth': depth,
+            'running': sum(self._running.values()),
+            'interactive': dict(self._stats[INTERACTIVE]),
+            'bulk': dict(self._stats[BULK]),
+        }
+
+    async def close(self):
+        """ Stops the dispatcher. Requests still queued are never started, so this is only used once nothing more
+        will be sent, such as when shutting down.
+
+        """
+
+        if self._dispatcher is not None and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        self._dispatcher = None
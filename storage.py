@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+""" This file contains the bootstrapping of the bot's sqlite database: the pragmas every connection uses, and the
+versioned migrations that bring the schema up to date when the bot starts.
+
+Common Uses
+-----------
+Example:
+    storage.bootstrap(path, pool_size=5, pragmas=db_settings['pragmas'])
+
+    Called once, before anything else uses the database.
+
+Journal Mode
+------------
+The database is switched to write-ahead logging. Readers then read from the last committed state while a write is in
+progress, rather than waiting behind the writer's lock, and a commit only has to append to the log. With WAL,
+synchronous=NORMAL only syncs the log at checkpoints, so a commit is never corrupted by a crash but the last few
+commits before a power loss may be lost, which is acceptable for the bot's definitions.
+
+Migrations
+----------
+The schema version is kept in sqlite's user_version. Each migration in MIGRATIONS moves the schema up by one version,
+and runs in its own transaction along with the bump of user_version, so a failed migration leaves the database at the
+previous version. Migrations are only ever appended, never edited once released.
+
+Todo
+----
+*
+
+"""
+import os  # Used to find the sql file of the first migration
+import sqlite3  # Used to split the migration scripts into statements
+import database  # Used to connect to the database and build the search index
+
+
+# The pragmas set on every connection unless others are given
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',  # Safe with WAL, and only syncs at checkpoints
+    'cache_size': -16384,  # 16 MiB of page cache per connection, negative values are in KiB
+    'mmap_size': 256 * 1024 * 1024,  # Reads pages through a memory map rather than copying them
+    'busy_timeout': 5000,  # Waits up to 5 seconds for a lock rather than failing straight away
+    'temp_store': 'MEMORY',  # Keeps temporary tables and indices in memory
+}
+
+# The path to the sql of the first migration
+CREATE_TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'databases', 'create_tables.sql')
+
+
+class MigrationError(Exception):
+    """ Raised when a migration fails. The database is left at the version before the migration.
+
+    """
+
+    def __init__(self, version, description, original):
+        """ Constructs the MigrationError class.
+
+        Parameters
+        ----------
+        version : int
+            The version the failed migration would have moved the schema to.
+        description : str
+            The description of the failed migration.
+        original : Exception
+            The error raised by the migration.
+
+        """
+
+        super().__init__("migration {} ({}) failed: {}".format(version, description, original))
+        self.version = version
+        self.description = description
+        self.original = original
+
+
+def statements(script):
+    """ Splits an sql script into its statements, keeping trigger bodies whole.
+
+    Parameters
+    ----------
+    script : str
+        The sql script.
+
+    Returns
+    -------
+    list
+        The statements of the script.
+
+    """
+
+    result = []
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        # Skips comments between statements
+        if not statement and line.lstrip().startswith('--'):
+            continue
+        statement += line
+        if sqlite3.complete_statement(statement):
+            result.append(statement.strip())
+            statement = ''
+    if statement.strip():
+        result.append(statement.strip())
+    return result
+
+
+def _create_tables(c):
+    """ Creates the defs table, which databases made before migrations existed already have.
+
+    """
+
+    with open(CREATE_TABLES_PATH) as f:
+        for statement in statements(f.read()):
+            c.execute(statement)
+
+
+def _create_search_index(c):
+    """ Creates the search index of the definitions and the triggers keeping it in sync, indexing the existing
+    definitions.
+
+    """
+
+    for statement in statements(database.SEARCH_INDEX_SQL):
+        c.execute(statement)
+    database.index_definitions(c)
+
+
+def _create_group_tables(c):
+    """ Creates the tables of the group registry. Groups made before the registry existed aren't in it.
+
+    """
+
+    for statement in statements(database.GROUP_TABLES_SQL):
+        c.execute(statement)
+
+
+def _create_blob_store(c):
+    """ Creates the blobs table the definitions are stored in, and makes the triggers of the search index keep it in
+    sync. The existing definitions stay in the def column, and are moved by database.migrate_blobs while the bot runs.
+
+    """
+
+    for statement in statements(database.BLOB_STORE_SQL):
+        c.execute(statement)
+
+
+def _drop_search_prefixes(c):
+    """ Recreates the search index without its unused prefix indexes, indexing the definitions again.
+
+    """
+
+    for statement in statements(database.SEARCH_TABLE_SQL):
+        c.execute(statement)
+    database.index_definitions(c)
+
+
+# Every migration, as (version, description, function called with a cursor inside the migration's transaction)
+MIGRATIONS = [
+    (1, 'create the defs table', _create_tables),
+    (2, 'create the definition search index', _create_search_index),
+    (3, 'create the group registry tables', _create_group_tables),
+    (4, 'create the blob store of the definitions', _create_blob_store),
+    (5, 'drop the unused prefix indexes of the search index', _drop_search_prefixes),
+]
+
+
+def schema_version(path):
+    """ Gets the schema version of the given database.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    Returns
+    -------
+    int
+        The version of the schema, 0 for a database no migration has run on.
+
+    """
+
+    pool = database.get_pool(path)
+    db = pool.acquire()
+    try:
+        return db.execute('PRAGMA user_version;').fetchone()[0]
+    finally:
+        pool.release(db)
+
+
+def migrate(path):
+    """ Runs the migrations the given database hasn't had yet, in order.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+
+    Returns
+    -------
+    list
+        The versions of the migrations that were run.
+
+    Raises
+    ------
+    MigrationError
+        If a migration fails. The migrations before it stay applied.
+
+    """
+
+    applied = []
+    pool = database.get_pool(path)
+    db = pool.acquire()
+    try:
+        for version, description, func in MIGRATIONS:
+            c = db.cursor()
+            # Takes the write lock before reading the version, so two processes don't run the same migration
+            c.execute('BEGIN IMMEDIATE;')
+            try:
+                if c.execute('PRAGMA user_version;').fetchone()[0] >= version:
+                    db.rollback()
+                    continue
+                func(c)
+                c.execute('PRAGMA user_version={};'.format(version))
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                raise MigrationError(version, description, e) from e
+            applied.append(version)
+    finally:
+        pool.release(db)
+    return applied
+
+
+def bootstrap(path, pool_size=None, pragmas=None):
+    """ Prepares the given database for use: creates its connection pool with the given pragmas, switches it to
+    write-ahead logging, and runs any migrations it hasn't had yet. Should be called before anything else uses the
+    database, as connections that are checked out while it runs keep their old pragmas.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database.
+    pool_size : int
+        The maximum number of connections kept open to the database.
+    pragmas : dict
+        The pragmas set on every connection. Defaults to DEFAULT_PRAGMAS.
+
+    Returns
+    -------
+    list
+        The versions of the migrations that were run.
+
+    """
+
+    pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+    pool = database.get_pool(path, size=pool_size, pragmas=pragmas)
+    # Sets the pragmas of a pool that was already created
+    if pool.pragmas != pragmas:
+        pool.set_pragmas(pragmas)
+    db = pool.acquire()
+    try:
+        # The journal mode is stored in the database file, so this only changes anything the first time
+        db.execute('PRAGMA journal_mode=WAL;')
+    finally:
+        pool.release(db)
+    return migrate(path)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+""" This file contains the group teardown, used to delete the role, category and channels of a group, and to archive
+the history of its text channels before they are deleted.
+
+The requests are queued as bulk work on the bot's scheduler, so tearing down many groups at once stays within
+discord's rate limits and doesn't hold up replies to other users. The channels and category of a group are deleted at
+the same time, and its role only once they are all gone, so a group that couldn't be fully deleted keeps its role and
+can be deleted again. Objects that were already deleted by hand are skipped rather than reported as failures.
+
+Archiving locks the channels first, so nothing more is sent to them while they are read, then streams the history of
+each text channel into the archive a page at a time, oldest message first. Only one page of messages is held in memory
+at once, however long the history is, and each page is written on a worker thread so compressing the archive doesn't
+block the event loop. The archive is JSON Lines, one message per line.
+
+Common Uses
+-----------
+Example:
+    result = await delete_group(guild, group, bot.scheduler)
+    if not result.ok:
+        ...
+
+    await lock_group(guild, group, bot.scheduler)
+    count = await archive_group(guild, group, bot.scheduler, fp)
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to delete and read the channels concurrently
+import json  # Used to write the archived messages
+import discord  # Used for error handling and to page through the history
+from scheduler import BULK  # Used to queue the teardown as bulk work
+import database  # Used to know the channels of a group
+
+
+# The number of messages read in each request for the history of a channel, the most discord allows
+HISTORY_PAGE = 100
+
+
+class TeardownResult:
+    """ The outcome of deleting a group.
+
+    Attributes
+    ----------
+    group : group_registry.Group
+        The group.
+    deleted : list
+        The kinds of the objects that were deleted, such as 'text' or 'role'.
+    missing : list
+        The kinds of the objects that had already been deleted.
+    failed : list
+        The (kind, error) pairs of the objects that couldn't be deleted.
+
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.deleted = []
+        self.missing = []
+        self.failed = []
+
+    @property
+    def ok(self):
+        """ Whether nothing of the group is left.
+
+        """
+
+        return not self.failed
+
+
+def _channels(guild, group):
+    """ Gets the channels of the group as (kind, channel) pairs, with None for the channels that are gone.
+
+    """
+
+    return [(kind, guild.get_channel(group.channels[kind])) for kind in database.GROUP_CHANNELS]
+
+
+async def _delete(guild, objects, scheduler, result):
+    """ Deletes the given (kind, object) pairs at the same time, recording the outcome of each in the result.
+
+    """
+
+    async def delete(kind, obj):
+        if obj is None:
+            result.missing.append(kind)
+            return
+        try:
+            await scheduler.call(('delete', guild.id), obj.delete, priority=BULK)
+        # Deleted by someone else in the meantime
+        except discord.NotFound:
+            result.missing.append(kind)
+        except discord.HTTPException as e:
+            result.failed.append((kind, e))
+        else:
+            result.deleted.append(kind)
+
+    await asyncio.gather(*[delete(kind, obj) for kind, obj in objects])
+
+
+async def delete_group(guild, group, scheduler):
+    """ Deletes the channels and category of a group at the same time, then its role if they are all gone.
+
+    Parameters
+    ----------
+    guild : discord.Guild
+        The guild of the group.
+    group : group_registry.Group
+        The group.
+    scheduler : scheduler.Scheduler
+        Used to make the requests. Deletions are paced per guild.
+
+    Returns
+    -------
+    TeardownResult
+        What was deleted, and what couldn't be.
+
+    """
+
+    result = TeardownResult(group)
+    await _delete(guild, _channels(guild, group) + [('category', guild.get_channel(group.category))], scheduler,
+                  result)
+    # Keeps the role while anything else of the group is left, so the group can still be found and deleted again
+    if result.failed:
+        return result
+    await _delete(guild, [('role', guild.get_role(group.role))], scheduler, result)
+    return result
+
+
+async def lock_group(guild, group, scheduler):
+    """ Stops the members of a group from sending messages to its text channels or joining its voice channel, while
+    still letting them read the channels. The channels are locked at the same time.
+
+    Parameters
+    ----------
+    guild : discord.Guild
+        The guild of the group.
+    group : group_registry.Group
+        The group.
+    scheduler : scheduler.Scheduler
+        Used to make the requests. Edits are paced per guild.
+
+    Returns
+    -------
+    list
+        The (kind, error) pairs of the channels that couldn't be locked.
+
+    """
+
+    role = guild.get_role(group.role)
+    # Without its role, the channels of the group are already hidden from everyone
+    if role is None:
+        return []
+
+    async def lock(kind, channel):
+        overwrite = {'connect': False} if kind == 'voice' else {'send_messages': False, 'add_reactions': False}
+        try:
+            await scheduler.call(('edit', guild.id), channel.set_permissions, role, read_messages=True,
+                                 priority=BULK, **overwrite)
+        except discord.HTTPException as e:
+            return kind, e
+
+    failures = await asyncio.gather(*[lock(kind, channel) for kind, channel in _channels(guild, group)
+                                      if channel is not None])
+    return [failure for failure in failures if failure is not None]
+
+
+def _record(kind, message):
+    """ Converts a message into the line written to the archive for it.
+
+    """
+
+    return json.dumps({'channel': kind, 'id': message.id, 'author': str(message.author),
+                       'author_id': message.author.id, 'created_at': message.created_at.isoformat(),
+                       'content': message.content, 'attachments': [a.url for a in message.attachments]},
+                      ensure_ascii=False) + '\n'
+
+
+def _write(fp, kind, messages):
+    """ Writes a page of messages to the archive. Blocks, so must be run on a worker thread.
+
+    """
+
+    fp.writelines(_record(kind, message) for message in messages)
+
+
+async def _page(channel, after, limit):
+    """ Reads the messages of a channel sent after the given message, oldest first.
+
+    """
+
+    return await channel.history(limit=limit, after=after).flatten()
+
+
+async def archive_group(guild, group, scheduler, fp):
+    """ Writes the history of every text channel of a group to the given file, one message per line, oldest first.
+    The channels are read at the same time, but their messages are written a page at a time, so the lines of different
+    channels may be interleaved. Each line says which channel it came from.
+
+    Parameters
+    ----------
+    guild : discord.Guild
+        The guild of the group.
+    group : group_registry.Group
+        The group.
+    scheduler : scheduler.Scheduler
+        Used to make the requests. Reads are paced per channel.
+    fp : io.TextIOBase
+        The file the archive is written to, from worker threads, one page at a time.
+
+    Returns
+    -------
+    int
+        The number of messages archived.
+
+    Raises
+    ------
+    discord.HTTPException
+        If the history of a channel couldn't be read.
+
+    """
+
+    loop = asyncio.get_event_loop()
+    # The channels are read at the same time, but the file can only be written by one thread at once
+    lock = asyncio.Lock()
+
+    async def archive(kind, channel):
+        count = 0
+        # Every message of a channel was sent after the channel was created, so its id is before all of theirs
+        after = discord.Object(id=channel.id)
+        while True:
+            page = await scheduler.call(('history', channel.id), _page, channel, after, HISTORY_PAGE, priority=BULK)
+            async with lock:
+                await loop.run_in_executor(None, _write, fp, kind, page)
+            count += len(page)
+            if len(page) < HISTORY_PAGE:
+                return count
+            after = page[-1]
+
+    # Voice channels have no messages
+    text_channels = [(kind, channel) for kind, channel in _channels(guild, group)
+                     if channel is not None and kind != 'voice']
+    return sum(await asyncio.gather(*[archive(kind, channel) for kind, channel in text_channels]))
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+""" This file contains the tools used to find out why the bot froze: a watchdog that notices when the event loop
+stalls and captures what it was stuck running, and a sampling profiler that can be run on demand.
+
+Stalls
+------
+A heartbeat task on the event loop records the time every interval. A separate thread checks the heartbeat, and when
+it hasn't been updated for longer than the threshold, something is blocking the loop. The thread then takes the stack
+of the loop's thread, which shows the coroutine running the blocking code, and logs it. When the loop recovers, the
+heartbeat logs how long the stall lasted. The last few stalls are kept for !stats.
+
+Profiling
+---------
+The SamplingProfiler takes the stack of a thread every few milliseconds for a given time, and counts how often each
+stack was seen. The counts are written in the collapsed stack format, one "frame;frame;frame count" line per stack,
+which flamegraph.pl, speedscope and inferno read directly.
+
+Common Uses
+-----------
+Example:
+    watchdog = StallWatchdog(threshold=0.5)
+    watchdog.start(loop)
+
+    profile = await loop.run_in_executor(None, SamplingProfiler(interval=0.005).run, 30)
+    profile.write('profile.folded')
+
+Todo
+----
+*
+
+"""
+import asyncio  # Used to run the heartbeat on the event loop
+import collections  # Used to keep the recent stalls and count the samples
+import glob  # Used to find the profiles kept on disk
+import logging  # Used to log the stalls
+import os  # Used to name the frames by file
+import sys  # Used to take the stacks of other threads
+import threading  # Used to watch the event loop from outside of it
+import time  # Used to time the heartbeat and the samples
+import traceback  # Used to format the stacks of stalls
+import metrics  # Used to count the stalls
+
+
+# The logger of the watchdog
+log = logging.getLogger(__name__)
+
+# Counts the stalls of the event loop
+LOOP_STALLS = metrics.REGISTRY.add(metrics.Counter('pm_loop_stalls_total', 'Event loop stalls over the threshold.'))
+
+
+class Stall:
+    """ A stall of the event loop.
+
+    Attributes
+    ----------
+    started : float
+        The time the stall was noticed, as given by time.time().
+    duration : float
+        The number of seconds the loop was blocked for, or None while it is still blocked.
+    stack : str
+        The stack of the event loop's thread when the stall was noticed.
+    where : str
+        The function and line the event loop was blocked on.
+
+    """
+
+    def __init__(self, started, stack, where):
+        self.started = started
+        self.duration = None
+        self.stack = stack
+        self.where = where
+
+
+class StallWatchdog:
+    """ Notices when the event loop is blocked for longer than a threshold, capturing the stack it is blocked in.
+
+    """
+
+    def __init__(self, threshold=0.5, interval=0.1, keep=20):
+        """ Constructs the StallWatchdog class.
+
+        Parameters
+        ----------
+        threshold : float
+            The number of seconds the loop has to be blocked for to count as a stall.
+        interval : float
+            The number of seconds between heartbeats, and between checks of the heartbeat.
+        keep : int
+            The number of recent stalls kept.
+
+        """
+
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = collections.deque(maxlen=keep)
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._current = None
+        self._stopped = threading.Event()
+        self._heartbeat = None
+        self._thread = None
+
+    def start(self, loop):
+        """ Starts watching the given event loop. Must be called from the loop's thread.
+
+        """
+
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._heartbeat = loop.create_task(self._run_heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='stall-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops watching the event loop.
+
+        """
+
+        self._stopped.set()
+        if self._heartbeat is not None and not self._heartbeat.done():
+            self._heartbeat.cancel()
+
+    async def _run_heartbeat(self):
+        """ Records that the event loop is running every interval, finishing the stall the loop recovers from.
+
+        """
+
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                blocked = now - self._beat - self.interval
+                self._beat = now
+                stall = self._current
+                if stall is not None:
+                    self._current = None
+                    stall.duration = max(blocked, self.threshold)
+                    log.warning("event loop stall ended duration=%.3fs", stall.duration)
+        finally:
+            # Stops the checks once the heartbeat is cancelled, such as when the bot is shutting down
+            self._stopped.set()
+
+    def _watch(self):
+        """ Checks the heartbeat from outside of the event loop, capturing the loop's stack when it stops.
+
+        """
+
+        while not self._stopped.wait(self.interval):
+            if self._current is not None or time.monotonic() - self._beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                stall = Stall(time.time(), 'unknown\n', 'unknown')
+            else:
+                stall = Stall(time.time(), ''.join(traceback.format_stack(frame)), '{} ({}:{})'.format(
+                    frame.f_code.co_name, os.path.basename(frame.f_code.co_filename), frame.f_lineno))
+            self._current = stall
+            self.stalls.append(stall)
+            LOOP_STALLS.inc()
+            log.warning("event loop stalled threshold=%.3fs where=%s stack:\n%s", self.threshold, stall.where,
+                        stall.stack)
+
+
+def _frame_name(frame):
+    """ Names a frame as function (file:line of the function), as shown in a flamegraph.
+
+    """
+
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Profile:
+    """ The samples taken by a SamplingProfiler, counted by stack.
+
+    """
+
+    def __init__(self, counts, samples, duration):
+        """ Constructs the Profile class.
+
+        Parameters
+        ----------
+        counts : collections.Counter
+            The number of times each stack was seen, keyed by the tuple of frame names from the outermost in.
+        samples : int
+            The number of samples taken.
+        duration : float
+            The number of seconds the samples were taken over.
+
+        """
+
+        self.counts = counts
+        self.samples = samples
+        self.duration = duration
+
+    def collapsed(self):
+        """ Formats the profile in the collapsed stack format read by flamegraph tools.
+
+        """
+
+        return ''.join('{} {}\n'.format(';'.join(stack), count) for stack, count in self.counts.most_common())
+
+    def top(self, limit=5):
+        """ Gets the functions the most samples were taken in, as (frame name, share of samples) pairs.
+
+        """
+
+        innermost = collections.Counter()
+        for stack, count in self.counts.items():
+            innermost[stack[-1]] += count
+        return [(name, count / self.samples) for name, count in innermost.most_common(limit)] if self.samples else []
+
+    def write(self, path):
+        """ Writes the profile to the given file in the collapsed stack format.
+
+        """
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+
+def prune_profiles(folder, keep):
+    """ Deletes all but the newest of the profiles kept in the given folder, so the folder doesn't grow without bound.
+
+    Parameters
+    ----------
+    folder : str
+        The folder the profiles are kept in.
+    keep : int
+        The number of profiles to keep.
+
+    """
+
+    # The profiles are named by the time they were taken, so sort oldest first
+    profiles = sorted(glob.glob(os.path.join(folder, 'profile-*.folded')))
+    for path in profiles[:max(len(profiles) - keep, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class SamplingProfiler:
+    """ Samples the stack of a thread at a fixed interval, to find out where it spends its time.
+
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        """ Constructs the SamplingProfiler class.
+
+        Parameters
+        ----------
+        interval : float
+            The number of seconds between samples.
+        thread_id : int
+            The id of the thread to sample, as given by threading.get_ident. Defaults to the thread creating the
+            profiler, so create it on the event loop to profile the loop.
+
+        """
+
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+
+    def run(self, duration):
+        """ Samples the thread for the given number of seconds. Blocks, so must be run on another thread than the one
+        being sampled.
+
+        Returns
+        -------
+        Profile
+            The samples taken.
+
+        """
+
+        counts = collections.Counter()
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + duration
+        while time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            counts[tuple(reversed(stack))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return Profile(counts, samples, time.perf_counter() - start)
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+""" This file contains the offline Wikipedia backend, used to answer !wiki lookups from a local copy of Wikipedia's
+abstracts rather than by calling Wikipedia, for deployments that can't reach it or don't want to wait on it.
+
+The abstracts are built from one of Wikipedia's abstract dumps (such as enwiki-latest-abstract.xml.gz) by wiki_cli.py,
+into two files next to each other:
+
+<path>.dat
+    The articles, in the order they appear in the dump, after a header of the id of the build. Each is its length
+    followed by its title, url and abstract, separated by null characters.
+<path>.idx
+    The title index. A header of the id of the build, the number of articles and the size of the titles, then the
+    offset of each title, the offset of each article in the .dat file, then the titles themselves, in sorted order.
+    Titles are stored casefolded with their whitespace collapsed, so lookups ignore case and spacing.
+
+Both files are memory-mapped, never read into memory. A lookup is a binary search over the offset table, reading only
+the few titles it compares against, so it takes microseconds and only the pages it touches are resident. Lookups are
+fast enough to run on the event loop, without worker threads.
+
+Disambiguation pages are left out when building, so every title found leads to a single article. The files are built
+under temporary names and moved into place once complete, so a build never leaves half written files behind, and
+files of different builds are refused by their ids.
+
+Common Uses
+-----------
+Example:
+    with gzip.open('enwiki-latest-abstract.xml.gz') as dump:
+        build(dump, 'databases/wiki_abstracts')
+
+    index = AbstractsIndex('databases/wiki_abstracts')
+    for title, url, abstract in index.search('python'):
+        # Use the article here
+
+Todo
+----
+*
+
+"""
+from xml.etree import ElementTree  # Used to read the dump a page at a time
+import bisect  # Used to find where each title starts in the sorted titles
+import mmap  # Used to read the files without loading them into memory
+import os  # Used to move the built files into place
+import struct  # Used to read and write the offsets
+
+
+# The first bytes of every index file, changed whenever its layout changes
+MAGIC = b'PMWABS01'
+# The magic, the id of the build, the number of articles and the size of the titles in bytes
+HEADER = struct.Struct('<8s8sQQ')
+# The magic and the id of the build, at the start of the .dat file
+DATA_HEADER = struct.Struct('<8s8s')
+# An offset into the titles or the articles
+OFFSET = struct.Struct('<Q')
+# The start and end offsets of a title, read together
+SPAN = struct.Struct('<QQ')
+# The length of an article in the .dat file
+LENGTH = struct.Struct('<I')
+# The offset of an article after its title while building, big-endian so titles sort in the order of the dump
+ENTRY = struct.Struct('>Q')
+# The prefix Wikipedia gives the titles in its abstract dumps
+TITLE_PREFIX = 'Wikipedia: '
+
+
+def normalize(title):
+    """ Gets the form of a title that is indexed and looked up, ignoring case and spacing.
+
+    Parameters
+    ----------
+    title : str
+        The title.
+
+    Returns
+    -------
+    bytes
+        The title casefolded, with its whitespace collapsed, as utf-8. Its bytes sort in the same order as its
+        characters, and never contain a null byte.
+
+    """
+
+    return ' '.join(title.casefold().replace('\0', ' ').split()).encode('utf-8')
+
+
+def is_disambiguation(title, abstract):
+    """ Checks if an article of the dump is a disambiguation page, which lists other articles rather than being one.
+
+    """
+
+    return title.endswith('(disambiguation)') or abstract.rstrip().endswith('may refer to:')
+
+
+def read_dump(fp):
+    """ Reads the articles of an abstract dump one at a time, dropping each page's elements once read so the dump is
+    never held in memory.
+
+    Parameters
+    ----------
+    fp : io.BufferedIOBase
+        The dump, as uncompressed XML.
+
+    Yields
+    ------
+    tuple
+        The title, url and abstract of each article.
+
+    """
+
+    pages = ElementTree.iterparse(fp, events=('start', 'end'))
+    # The root keeps every page read until it is cleared
+    _, root = next(pages)
+    for event, element in pages:
+        if event == 'end' and element.tag == 'doc':
+            title = element.findtext('title') or ''
+            if title.startswith(TITLE_PREFIX):
+                title = title[len(TITLE_PREFIX):]
+            yield title, element.findtext('url') or '', element.findtext('abstract') or ''
+            root.clear()
+
+
+def build(fp, path, progress=None, every=100000):
+    """ Builds the offline abstracts from an abstract dump in a single streaming pass. The articles are written to the
+    .dat file as they are read, and only their titles and offsets are kept in memory to be sorted into the index.
+
+    Parameters
+    ----------
+    fp : io.BufferedIOBase
+        The dump, as uncompressed XML.
+    path : str
+        The path of the files built, without their .idx and .dat extensions.
+    progress : callable
+        Called with the number of articles read so far, every so often. None to not report progress.
+    every : int
+        The number of articles read between calls of progress.
+
+    Returns
+    -------
+    tuple
+        The number of articles indexed, and the number of disambiguation pages left out.
+
+    """
+
+    # Each title followed by a null byte and the offset of its article, as a single bytes object to keep them small.
+    # The null byte sorts before any character, so a title sorts before the longer titles it starts
+    entries = []
+    skipped = 0
+    build_id = os.urandom(8)
+    try:
+        with open(path + '.dat.tmp', 'wb') as data:
+            data.write(DATA_HEADER.pack(MAGIC, build_id))
+            offset = DATA_HEADER.size
+            for read, (title, url, abstract) in enumerate(read_dump(fp), 1):
+                if not title or is_disambiguation(title, abstract):
+                    skipped += 1
+                else:
+                    record = '\0'.join((title, url, abstract.strip())).encode('utf-8')
+                    data.write(LENGTH.pack(len(record)))
+                    data.write(record)
+                    entries.append(normalize(title) + b'\0' + ENTRY.pack(offset))
+                    offset += LENGTH.size + len(record)
+                if progress is not None and read % every == 0:
+                    progress(read)
+        entries.sort()
+        with open(path + '.idx.tmp', 'wb') as index:
+            suffix = 1 + ENTRY.size
+            index.write(HEADER.pack(MAGIC, build_id, len(entries), sum(len(entry) - suffix for entry in entries)))
+            start = 0
+            for entry in entries:
+                index.write(OFFSET.pack(start))
+                start += len(entry) - suffix
+            index.write(OFFSET.pack(start))
+            for entry in entries:
+                index.write(OFFSET.pack(ENTRY.unpack_from(entry, len(entry) - ENTRY.size)[0]))
+            for entry in entries:
+                index.write(entry[:-suffix])
+    # Leaves the files of the last build as they were
+    except BaseException:
+        for name in (path + '.dat.tmp', path + '.idx.tmp'):
+            if os.path.exists(name):
+                os.remove(name)
+        raise
+    # The bot refuses to open the files while only one of them has been replaced
+    os.replace(path + '.dat.tmp', path + '.dat')
+    os.replace(path + '.idx.tmp', path + '.idx')
+    return len(entries), skipped
+
+
+class _Titles:
+    """ The sorted titles of an index, as a sequence bisect can search without reading them all.
+
+    """
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index.count
+
+    def __getitem__(self, i):
+        return self._index.title(i)
+
+
+class AbstractsIndex:
+    """ The offline abstracts, memory-mapped from the files built by build. Not thread-safe, as it is only read from
+    the event loop.
+
+    """
+
+    def __init__(self, path):
+        """ Constructs the AbstractsIndex class, mapping the files built at the given path.
+
+        Parameters
+        ----------
+        path : str
+            The path of the files, without their .idx and .dat extensions.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the abstracts haven't been built at the path.
+        ValueError
+            If the files aren't ones built by build, or are of different builds, such as while a build is being moved
+            into place.
+
+        """
+
+        self.path = path
+        with open(path + '.idx', 'rb') as index, open(path + '.dat', 'rb') as data:
+            # Both files always have their headers, and an empty file can't be mapped
+            if not os.fstat(index.fileno()).st_size or not os.fstat(data.fileno()).st_size:
+                raise ValueError("{} are not abstracts built by wiki_cli.py".format(path))
+            self._index = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._check()
+        except ValueError:
+            self.close()
+            raise
+        # The number of searches and articles read, for the statistics
+        self._stats = {'searches': 0, 'articles': 0}
+
+    def _check(self):
+        """ Reads the headers of the files, checking they are of the same build and the index is complete.
+
+        """
+
+        if len(self._index) < HEADER.size or len(self._data) < DATA_HEADER.size:
+            raise ValueError("{} are not abstracts built by wiki_cli.py".format(self.path))
+        magic, build_id, self.count, size = HEADER.unpack_from(self._index, 0)
+        if magic != MAGIC or DATA_HEADER.unpack_from(self._data, 0)[0] != MAGIC:
+            raise ValueError("{} are not abstracts built by this version of wiki_cli.py".format(self.path))
+        if DATA_HEADER.unpack_from(self._data, 0)[1] != build_id:
+            raise ValueError("{}.idx and {}.dat are of different builds".format(self.path, self.path))
+        # Where the offsets of the titles, the offsets of the articles and the titles start
+        self._title_offsets = HEADER.size
+        self._article_offsets = self._title_offsets + OFFSET.size * (self.count + 1)
+        self._titles = self._article_offsets + OFFSET.size * self.count
+        if len(self._index) != self._titles + size:
+            raise ValueError("{}.idx is truncated".format(self.path))
+
+    def __len__(self):
+        return self.count
+
+    def title(self, i):
+        """ Gets the normalized title at the given position of the index.
+
+        """
+
+        start, end = SPAN.unpack_from(self._index, self._title_offsets + OFFSET.size * i)
+        return self._index[self._titles + start:self._titles + end]
+
+    def article(self, i):
+        """ Gets the article at the given position of the index.
+
+        Returns
+        -------
+        tuple
+            The title, url and abstract of the article.
+
+        """
+
+        self._stats['articles'] += 1
+        offset, = OFFSET.unpack_from(self._index, self._article_offsets + OFFSET.size * i)
+        length, = LENGTH.unpack_from(self._data, offset)
+        start = offset + LENGTH.size
+        return tuple(self._data[start:start + length].decode('utf-8').split('\0', 2))
+
+    def search(self, subject, limit=10, scan=100):
+        """ Finds the articles whose titles start with the subject, ignoring case and spacing.
+
+        Parameters
+        ----------
+        subject : str
+            The subject to be searched for.
+        limit : int
+            The maximum number of articles returned.
+        scan : int
+            The maximum number of titles starting with the subject that are ranked. Only the first in sorted order are
+            read, so common prefixes don't read a large part of the index.
+
+        Returns
+        -------
+        list
+            The title, url and abstract of each article found. Titles equal to the subject come first, then the
+            shortest titles, as they are the most likely to be what was meant.
+
+        """
+
+        self._stats['searches'] += 1
+        key = normalize(subject)
+        if not key:
+            return []
+        titles = _Titles(self)
+        first = bisect.bisect_left(titles, key)
+        found = []
+        for i in range(first, min(first + scan, self.count)):
+            title = self.title(i)
+            if not title.startswith(key):
+                break
+            found.append((len(title), i))
+        # Sorting by length puts the titles equal to the subject first, and keeps sorted order between equal lengths
+        found.sort()
+        return [self.article(i) for _, i in found[:limit]]
+
+    def find(self, title):
+        """ Gets the article with the given title, preferring the one with the same case if several only differ in
+        case.
+
+        Parameters
+        ----------
+        title : str
+            The title of the article.
+
+        Returns
+        -------
+        tuple
+            The title, url and abstract of the article, or None if there is no article with the title.
+
+        """
+
+        self._stats['searches'] += 1
+        key = normalize(title)
+        found = None
+        for i in range(bisect.bisect_left(_Titles(self), key), self.count):
+            if self.title(i) != key:
+                break
+            article = self.article(i)
+            if article[0] == title:
+                return article
+            found = found or article
+        return found
+
+    def stats(self):
+        """ Gets the statistics of the index.
+
+        Returns
+        -------
+        dict
+            The number of articles, the sizes of the index and article files in bytes, and the number of searches and
+            articles read.
+
+        """
+
+        return dict(self._stats, count=self.count, index_bytes=len(self._index), data_bytes=len(self._data))
+
+    def close(self):
+        """ Unmaps the files.
+
+        """
+
+        self._index.close()
+        self._data.close()
+
+
+class OfflineWikiClient:
+    """ Answers the lookups of the Wiki cog from the offline abstracts, with the same options as WikiClient.
+
+    """
+
+    def __init__(self, path, max_options=4):
+        """ Constructs the OfflineWikiClient class.
+
+        Parameters
+        ----------
+        path : str
+            The path of the abstracts, without their .idx and .dat extensions.
+        max_options : int
+            The maximum number of options returned by options.
+
+        """
+
+        self.max_options = max_options
+        self.index = AbstractsIndex(path)
+
+    async def options(self, subject):
+        """ Finds the articles the user can choose between for the given subject. See WikiClient.options.
+
+        Returns
+        -------
+        list
+            Up to max_options tuples of the title and url of each option, best match first.
+
+        """
+
+        return [(title, url) for title, url, _ in self.index.search(subject, limit=self.max_options)]
+
+    async def summary(self, title):
+        """ Gets the abstract of the article with the given title, or None if there is no such article.
+
+        """
+
+        article = self.index.find(title)
+        return article[2] if article is not None else None
+
+    def close(self):
+        """ Unmaps the abstracts.
+
+        """
+
+        self.index.close()
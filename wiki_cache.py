@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+""" This file contains the cache used by the WikiClient to avoid repeating lookups of popular subjects.
+
+The cache has two tiers. The first is an in-process LRUCache, checked on the event loop before any work is scheduled.
+The second is an optional sqlite store, which survives restarts and is only read from the client's worker threads.
+Values found in the store are promoted into memory.
+
+Kinds
+-----
+search
+    The titles found when searching for a subject.
+page
+    The url of a title, or None when the title is a disambiguation page or doesn't have a page.
+
+Todo
+----
+*
+
+"""
+import json  # Used to store the values in the sqlite store
+import threading  # Used to guard the statistics of the store
+import time  # Used to expire the values in the sqlite store
+from cache import LRUCache, MISSING  # Used as the in-memory tier
+import database  # Used to connect to the sqlite store
+
+
+class WikiCache:
+    """ A two tier cache of Wikipedia lookups, with an in-memory tier and an optional sqlite tier.
+
+    """
+
+    def __init__(self, max_entries=2048, ttl=86400, path=None, max_rows=100000):
+        """ Constructs the WikiCache class.
+
+        Parameters
+        ----------
+        max_entries : int
+            The maximum number of lookups held in memory.
+        ttl : float
+            The number of seconds a lookup is kept for, in both tiers.
+        path : str
+            The path to the sqlite store. None to only cache in memory.
+        max_rows : int
+            The maximum number of lookups held in the sqlite store. The ones closest to expiring are dropped first.
+
+        """
+
+        # Sets the settings of the cache
+        self.ttl = ttl
+        self.path = path
+        self.max_rows = max_rows
+        # The in-memory tier
+        self._memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        # The statistics of the sqlite tier
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'pruned': 0}
+        # Creates the table of the sqlite store
+        if path is not None:
+            with database.connect(path, commit=True) as c:
+                # Lets the workers of a sharded bot read the store while another one writes to it
+                c.execute('PRAGMA journal_mode=WAL;')
+                sql = \
+                    '''
+                    CREATE TABLE IF NOT EXISTS wiki_cache
+                    (
+                        kind    TEXT NOT NULL,
+                        key     TEXT NOT NULL,
+                        value   TEXT NOT NULL,
+                        expires REAL NOT NULL,
+                        PRIMARY KEY (kind, key)
+                    );
+                    '''
+                c.execute(sql)
+
+    def get_memory(self, kind, key):
+        """ Gets a lookup from the in-memory tier only. Safe to call from the event loop.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of lookup.
+        key : str
+            The subject or title looked up.
+
+        Returns
+        -------
+        object
+            The cached value, or MISSING if it isn't held in memory.
+
+        """
+
+        return self._memory.get((kind, key))
+
+    def get_disk(self, kind, key):
+        """ Gets a lookup from the sqlite store, promoting it into memory if found. Used after get_memory misses.
+        Blocks, so must be run on a worker thread.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of lookup.
+        key : str
+            The subject or title looked up.
+
+        Returns
+        -------
+        object
+            The cached value, or MISSING if it isn't in the store, or there is no store.
+
+        """
+
+        value = MISSING
+        if self.path is None:
+            return value
+        # Treats a store that can't be read as a miss, the database has already logged why
+        try:
+            with database.connect(self.path) as c:
+                sql = \
+                    '''
+                    SELECT value, expires
+                    FROM wiki_cache
+                    WHERE kind=? AND key=?;
+                    '''
+                c.execute(sql, (kind, key))
+                row = c.fetchone()
+                # Ignores rows that have expired, they are overwritten or pruned later
+                if row is not None and row[1] > time.time():
+                    value = json.loads(row[0])
+        except database.DatabaseError:
+            pass
+        with self._lock:
+            self._stats['misses' if value is MISSING else 'hits'] += 1
+        # Promotes the value into memory, only keeping it for as long as the store would have
+        if value is not MISSING:
+            self._memory.put((kind, key), value, ttl=min(self.ttl, row[1] - time.time()))
+        return value
+
+    def put(self, kind, key, value):
+        """ Caches a lookup in both tiers. Blocks, so must be run on a worker thread.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of lookup.
+        key : str
+            The subject or title looked up.
+        value : object
+            The result of the lookup. Must be json serializable.
+
+        """
+
+        self._memory.put((kind, key), value)
+        if self.path is None:
+            return
+        # Only keeps the lookup in memory if the store can't be written, the database has already logged why
+        try:
+            with database.connect(self.path, commit=True) as c:
+                sql = \
+                    '''
+                    INSERT OR REPLACE INTO wiki_cache
+                    (kind, key, value, expires)
+                    VALUES
+                    (?, ?, ?, ?);
+                    '''
+                c.execute(sql, (kind, key, json.dumps(value), time.time() + self.ttl))
+        except database.DatabaseError:
+            return
+        with self._lock:
+            self._stats['writes'] += 1
+            # Checks the size of the store every so often rather than on every write
+            prune = self._stats['writes'] % 100 == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """ Drops the expired lookups from the sqlite store, then the ones closest to expiring until the store is
+        within its size cap. Blocks, so must be run on a worker thread.
+
+        """
+
+        if self.path is None:
+            return
+        # Leaves the store as it is if it can't be pruned, the next prune tries again
+        try:
+            with database.connect(self.path, commit=True) as c:
+                c.execute('DELETE FROM wiki_cache WHERE expires <= ?;', (time.time(),))
+                pruned = c.rowcount
+                sql = \
+                    '''
+                    DELETE FROM wiki_cache
+                    WHERE rowid IN (SELECT rowid FROM wiki_cache ORDER BY expires DESC LIMIT -1 OFFSET ?);
+                    '''
+                c.execute(sql, (self.max_rows,))
+                pruned += c.rowcount
+        except database.DatabaseError:
+            return
+        with self._lock:
+            self._stats['pruned'] += pruned
+
+    def stats(self):
+        """ Gets the statistics of both tiers of the cache.
+
+        Returns
+        -------
+        dict
+            The statistics of the in-memory tier under 'memory', those of the sqlite store under 'disk', and the
+            overall hit rate under 'hit_rate'.
+
+        """
+
+        memory = self._memory.stats()
+        with self._lock:
+            disk = dict(self._stats)
+        # Every memory miss goes on to the store, so the hits of both tiers count towards the overall hit rate
+        lookups = memory['hits'] + memory['misses']
+        hits = memory['hits'] + disk['hits']
+        return {'memory': memory, 'disk': disk, 'hit_rate': hits / lookups if lookups else 0.0}
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+""" Builds the offline Wikipedia abstracts used by the Wiki cog when wiki_settings['backend'] is 'offline', and looks
+subjects up in them without running the bot.
+
+Usage
+-----
+    python wiki_cli.py build <dump> [--output databases/wiki_abstracts]
+    python wiki_cli.py lookup <subject> [--output databases/wiki_abstracts]
+
+The dump is one of Wikipedia's abstract dumps, such as enwiki-latest-abstract.xml.gz from
+https://dumps.wikimedia.org/enwiki/latest/. It is read in a single pass, compressed with gzip or bz2 or not at all,
+and never held in memory. Use - as the dump to read it from standard input.
+
+Only the titles and offsets of the articles are kept in memory while building, about 75 bytes for each article, to be
+sorted into the index once the whole dump has been read.
+
+Todo
+----
+*
+
+"""
+from xml.etree import ElementTree  # Used to report dumps that can't be read
+import argparse  # Used to read the options given on the command line
+import bz2  # Used to read dumps compressed with bz2
+import gzip  # Used to read dumps compressed with gzip
+import sys  # Used to read the dump from standard input and report progress
+import time  # Used to time the build
+import wiki_abstracts  # Used to build and read the abstracts
+
+
+def open_dump(name):
+    """ Opens the given dump for reading as bytes, decompressing it by its extension, with - for standard input.
+
+    """
+
+    if name == '-':
+        return sys.stdin.buffer
+    if name.endswith('.gz'):
+        return gzip.open(name, 'rb')
+    if name.endswith('.bz2'):
+        return bz2.open(name, 'rb')
+    return open(name, 'rb')
+
+
+def main():
+    """ Runs the build or lookup given on the command line.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Builds and searches the offline Wikipedia abstracts.")
+    parser.add_argument('action', choices=('build', 'lookup'), help='whether to build the abstracts or look in them')
+    parser.add_argument('target', help='the dump to build from, - for standard input, or the subject to look up')
+    parser.add_argument('--output', default='databases/wiki_abstracts',
+                        help='the path of the abstracts, without their .idx and .dat extensions')
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        def progress(count):
+            print("Read {} articles...".format(count), file=sys.stderr)
+
+        started = time.perf_counter()
+        try:
+            with open_dump(args.target) as dump:
+                count, skipped = wiki_abstracts.build(dump, args.output, progress=progress)
+        except (OSError, ElementTree.ParseError) as e:
+            sys.exit("The abstracts were not built, {}.".format(e))
+        print("Indexed {} articles, leaving out {} disambiguation pages, in {:.1f}s.".format(
+            count, skipped, time.perf_counter() - started), file=sys.stderr)
+    else:
+        try:
+            index = wiki_abstracts.AbstractsIndex(args.output)
+        except (OSError, ValueError) as e:
+            sys.exit("The abstracts could not be read, {}.".format(e))
+        for title, url, abstract in index.search(args.target):
+            print("{}\n{}\n{}\n".format(title, url, abstract))
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+""" This file contains the client used by the bot to look things up on Wikipedia without blocking the event loop.
+
+The wikipedia library only offers blocking calls, each of which is at least one round trip to Wikipedia. The client
+runs them on its own worker threads, resolves the candidate pages of a search concurrently, and puts a timeout on
+every call. A single semaphore bounds how many calls run at once across every guild using the bot. When given a
+WikiCache, searches and resolved pages (including the titles found to be disambiguation pages) are answered from it
+before any call is made.
+
+Common Uses
+-----------
+Example:
+    client = WikiClient(max_concurrency=4, timeout=10)
+    options = await client.options(subject)
+    for title, url in options:
+        # Use the title and url here
+
+Todo
+----
+*
+
+"""
+from concurrent.futures import ThreadPoolExecutor  # Used to run the wikipedia calls off of the event loop
+import asyncio  # Used to await the wikipedia calls from the event loop
+import functools  # Used to pass keyword arguments to the executor
+import wikipedia  # Wikipedia library
+from cache import MISSING  # Used to tell when a lookup isn't cached
+
+
+def _page_url(title):
+    """ Resolves the page of the given title. Blocks, so must be run on a worker thread.
+
+    Parameters
+    ----------
+    title : str
+        The title of the page.
+
+    Returns
+    -------
+    str or None
+        The url of the page, or None if the title is a disambiguation page or doesn't have a page.
+
+    """
+
+    # Loading the page is enough to find out if it is a disambiguation page, and already has the url
+    try:
+        return wikipedia.page(title).url
+    # Skips titles that don't lead to a single page
+    except (wikipedia.DisambiguationError, wikipedia.PageError):
+        return None
+
+
+class WikiClient:
+    """ Runs the wikipedia library's calls on worker threads, with bounded concurrency and a timeout per call.
+
+    """
+
+    def __init__(self, max_concurrency=4, timeout=10, max_options=4, cache=None):
+        """ Constructs the WikiClient class.
+
+        Parameters
+        ----------
+        max_concurrency : int
+            The maximum number of calls to Wikipedia running at once, across every guild.
+        timeout : float
+            The number of seconds a single call to Wikipedia may take, including the wait for a free thread.
+        max_options : int
+            The maximum number of options returned by options.
+        cache : wiki_cache.WikiCache
+            The cache the lookups are answered from when possible. None to not cache lookups.
+
+        """
+
+        # Sets the settings of the client
+        self.timeout = timeout
+        self.max_options = max_options
+        self.cache = cache
+        # The threads the calls are run on, one for each call that may run at once
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='wiki')
+        # Bounds the calls running on the threads. A call that timed out keeps running on its thread, as a blocking
+        # call can't be stopped, so it only frees its slot once it finishes. Calls never queue inside the executor
+        # where their timeout couldn't see them, they wait here for a free thread instead
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _call(self, func, *args, **kwargs):
+        """ Runs the given wikipedia function on a worker thread.
+
+        Parameters
+        ----------
+        func : callable
+            The wikipedia function to be run.
+
+        Returns
+        -------
+        object
+            The result of the function.
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            If the call, including the wait for a free thread, takes longer than the timeout of the client.
+
+        """
+
+        async def run():
+            await self._semaphore.acquire()
+            future = asyncio.get_event_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+            future.add_done_callback(self._finished)
+            # Shielded, as cancelling the future would mark it done, freeing the slot while the thread still runs
+            return await asyncio.shield(future)
+
+        return await asyncio.wait_for(run(), self.timeout)
+
+    def _finished(self, future):
+        """ Frees the slot of a call once its thread has finished, whether or not anything is still waiting for it.
+
+        """
+
+        self._semaphore.release()
+        # Retrieves the error of a call nothing waits for any more, so it isn't logged as never retrieved
+        if not future.cancelled():
+            future.exception()
+
+    async def _cached_call(self, kind, key, func):
+        """ Runs the given lookup on a worker thread, unless it is already cached.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of lookup, see wiki_cache.
+        key : str
+            The subject or title to be looked up, passed to the function.
+        func : callable
+            The blocking function doing the lookup.
+
+        Returns
+        -------
+        object
+            The result of the lookup.
+
+        """
+
+        if self.cache is None:
+            return await self._call(func, key)
+        # Checks the in-memory tier on the loop, as it never blocks
+        value = self.cache.get_memory(kind, key)
+        if value is not MISSING:
+            return value
+        # Checks the sqlite tier, and looks the key up if that misses too, on a worker thread
+        return await self._call(self._load, kind, key, func)
+
+    def _load(self, kind, key, func):
+        """ Gets a lookup from the sqlite tier of the cache, or looks it up and caches it. Blocks, so must be run on
+        a worker thread.
+
+        """
+
+        value = self.cache.get_disk(kind, key)
+        if value is MISSING:
+            value = func(key)
+            self.cache.put(kind, key, value)
+        return value
+
+    async def search(self, subject):
+        """ Searches Wikipedia for the given subject.
+
+        Parameters
+        ----------
+        subject : str
+            The subject to be searched for.
+
+        Returns
+        -------
+        list
+            The titles of the pages found, best match first.
+
+        """
+
+        return await self._cached_call('search', subject, wikipedia.search)
+
+    async def resolve(self, title):
+        """ Resolves the page of the given title.
+
+        Parameters
+        ----------
+        title : str
+            The title of the page.
+
+        Returns
+        -------
+        str or None
+            The url of the page, or None if the title is a disambiguation page or doesn't have a page.
+
+        """
+
+        return await self._cached_call('page', title, _page_url)
+
+    async def options(self, subject):
+        """ Finds the pages the user can choose between for the given subject. The candidates are resolved
+        concurrently, a batch at a time, skipping disambiguation pages until enough options are found or the
+        search results run out.
+
+        Parameters
+        ----------
+        subject : str
+            The subject to be searched for.
+
+        Returns
+        -------
+        list
+            Up to max_options tuples of the title and url of each option, in the order of the search results.
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            If any of the calls to Wikipedia takes longer than the timeout of the client.
+
+        """
+
+        # Gets the candidate titles
+        titles = await self.search(subject)
+        options = []
+        # Resolves the next batch of candidates until there are enough options
+        while titles and len(options) < self.max_options:
+            batch, titles = titles[:self.max_options - len(options)], titles[self.max_options - len(options):]
+            urls = await asyncio.gather(*[self.resolve(title) for title in batch])
+            options.extend((title, url) for title, url in zip(batch, urls) if url is not None)
+        return options
+
+    def close(self):
+        """ Stops the worker threads of the client.
+
+        """
+
+        self._executor.shutdown(wait=False)